@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for post-processing benchmarks, at realistic scales :
+    - setCompare result files in both formats (20-length words and shorter words), ordered like setCompare output
+    - blastn xml (-outfmt 5) and tabular outputs with many homolog genes
+    - motif-broker occurence documents, couchDB genome and taxon documents for N genomes
+All generators are seeded, so that a given size always gives the same inputs.
+"""
+
+import numpy as np
+
+FULL_LENGTH = 23
+WRITE_BATCH = 100000
+
+
+def genome_uuids(nb_genomes):
+    return [f"genome_{i}" for i in range(nb_genomes)]
+
+def fasta_refs(genome, nb_fasta):
+    return [f"{genome}_seq{j}" for j in range(nb_fasta)]
+
+def _distinct_codes(rng, n, nb_bits):
+    """n distinct random codes lower than 2 ** nb_bits, in random order"""
+    codes = np.unique(rng.integers(0, 1 << nb_bits, size = int(n * 1.1) + 16, dtype = np.uint64))
+    while len(codes) < n:
+        codes = np.unique(np.concatenate([codes, rng.integers(0, 1 << nb_bits, size = n, dtype = np.uint64)]))
+    return rng.permutation(codes)[:n]
+
+def _weights(rng, n, nb_genomes):
+    """Weights like setCompare ones : at least one occurence by genome, a few words repeated"""
+    return nb_genomes + rng.geometric(0.7, size = n).astype(np.uint64) - 1
+
+def _set_compare_order(codes, weights):
+    order = np.lexsort((codes, -weights.astype(np.int64)))
+    return codes[order], weights[order]
+
+def write_set_compare(path, nb_hits, word_length = 20, nb_genomes = 2, max_longer = 3, seed = 0):
+    """Write a setCompare result file
+
+    :param path: Output file
+    :type path: str
+    :param nb_hits: Number of hits
+    :type nb_hits: int
+    :param word_length: sgRNA length without pam, 20 for one line format, shorter for one hit by line format, defaults to 20
+    :type word_length: int, optional
+    :param nb_genomes: Number of included genomes, hits weights are at least nb_genomes, defaults to 2
+    :type nb_genomes: int, optional
+    :param max_longer: Maximum number of 23-length words by shorter word, defaults to 3
+    :type max_longer: int, optional
+    :param seed: Random seed, defaults to 0
+    :type seed: int, optional
+    """
+    rng = np.random.default_rng(seed)
+    length = word_length + 3
+    codes, weights = _set_compare_order(_distinct_codes(rng, nb_hits, 2 * length), _weights(rng, nb_hits, nb_genomes))
+    with open(path, "w") as o:
+        o.write(f"Final set (Intersect of {nb_genomes} sets) - (Union of 0 sets)\n# {nb_hits} items set\n")
+        if length == FULL_LENGTH:
+            for start in range(0, nb_hits, WRITE_BATCH):
+                o.write("".join(f"{code}:{weight}," for code, weight in zip(codes[start:start + WRITE_BATCH].tolist(), weights[start:start + WRITE_BATCH].tolist())))
+            o.write("\n")
+            return
+
+        prefix_bits = 2 * (FULL_LENGTH - length)
+        for start in range(0, nb_hits, WRITE_BATCH):
+            batch_codes = codes[start:start + WRITE_BATCH].tolist()
+            nb_longer = rng.integers(1, max_longer + 1, size = len(batch_codes))
+            prefixes = rng.integers(0, 1 << prefix_bits, size = int(nb_longer.sum())).tolist()
+            lines = []
+            i = 0
+            for code, weight, nb in zip(batch_codes, weights[start:start + WRITE_BATCH].tolist(), nb_longer.tolist()):
+                longer = sorted({(prefix << (2 * length)) | code for prefix in prefixes[i:i + nb]})
+                i += nb
+                lines.append(f"{code}:{weight}[{','.join(map(str, longer))}]\n")
+            o.write("".join(lines))
+        o.write("\n")
+
+def write_blast(path, genomes, nb_homologs, nb_fasta = 2, fasta_size = 1000000, query_len = 1500, blast_format = "xml", seed = 0):
+    """Write a blastn output with nb_homologs hits by genome, spread over genome fasta subsequences
+
+    :param path: Output file
+    :type path: str
+    :param genomes: Genomes uuid
+    :type genomes: List[str]
+    :param nb_homologs: Number of homolog genes by genome
+    :type nb_homologs: int
+    :param blast_format: xml (-outfmt 5) or tabular (-outfmt "6 stitle qlen nident length sstart send"), defaults to xml
+    :type blast_format: str, optional
+    """
+    rng = np.random.default_rng(seed)
+    hits = []
+    for genome in genomes:
+        refs = fasta_refs(genome, nb_fasta)
+        identities = rng.integers(query_len // 2, query_len + 1, size = nb_homologs)
+        identities[0] = query_len # At least one homolog by genome
+        for ref, start, identity, reverse in zip(rng.choice(refs, size = nb_homologs).tolist(), rng.integers(1, fasta_size - query_len, size = nb_homologs).tolist(), identities.tolist(), rng.integers(0, 2, size = nb_homologs).tolist()):
+            end = start + query_len - 1
+            hits.append((f"{genome}|{ref} synthetic sequence", identity, start, end) if not reverse else (f"{genome}|{ref} synthetic sequence", identity, end, start))
+
+    with open(path, "w") as o:
+        if blast_format == "tabular":
+            o.write("".join(f"{hit_def}\t{query_len}\t{identity}\t{query_len}\t{hit_from}\t{hit_to}\n" for hit_def, identity, hit_from, hit_to in hits))
+            return
+        o.write(f'<?xml version="1.0"?>\n<BlastOutput>\n<BlastOutput_query-len>{query_len}</BlastOutput_query-len>\n<BlastOutput_iterations>\n<Iteration>\n<Iteration_hits>\n')
+        for num, (hit_def, identity, hit_from, hit_to) in enumerate(hits, 1):
+            o.write(f"<Hit>\n<Hit_num>{num}</Hit_num>\n<Hit_def>{hit_def}</Hit_def>\n<Hit_hsps>\n<Hsp>\n<Hsp_num>1</Hsp_num>\n<Hsp_hit-from>{hit_from}</Hsp_hit-from>\n<Hsp_hit-to>{hit_to}</Hsp_hit-to>\n<Hsp_identity>{identity}</Hsp_identity>\n<Hsp_align-len>{query_len}</Hsp_align-len>\n</Hsp>\n</Hit_hsps>\n</Hit>\n")
+        o.write("</Iteration_hits>\n</Iteration>\n</BlastOutput_iterations>\n</BlastOutput>\n")
+
+def occurence_documents(sequences, genomes, nb_fasta = 2, fasta_size = 1000000, max_coords = 3, seed = 0):
+    """Generate motif-broker documents, with occurences of each sequence in all genomes
+
+    :param sequences: 23-length sgRNA sequences
+    :type sequences: List[str]
+    :param genomes: Genomes uuid
+    :type genomes: List[str]
+    :return: Dict with sequences as keys and motif-broker documents { genome : { fasta_ref : List[str] } } as values
+    :rtype: Dict[str, Dict]
+    """
+    rng = np.random.default_rng(seed)
+    refs = {genome : fasta_refs(genome, nb_fasta) for genome in genomes}
+    docs = {}
+    for seq in sequences:
+        doc = {}
+        for genome in genomes:
+            nb_coords = int(rng.integers(1, max_coords + 1))
+            ref_choices = rng.integers(0, nb_fasta, size = nb_coords).tolist()
+            starts = rng.integers(0, fasta_size - FULL_LENGTH, size = nb_coords).tolist()
+            strands = rng.integers(0, 2, size = nb_coords).tolist()
+            genome_doc = {}
+            for ref_choice, start, strand in zip(ref_choices, starts, strands):
+                genome_doc.setdefault(refs[genome][ref_choice], []).append(f"{'+-'[strand]}({start},{start + FULL_LENGTH - 1})")
+            doc[genome] = genome_doc
+        docs[seq] = doc
+    return docs
+
+def metadata_documents(genomes, nb_fasta = 2, fasta_size = 1000000):
+    """Generate couchDB genome and taxon documents
+
+    :return: genome documents and taxon documents, by id
+    :rtype: Tuple[Dict[str, Dict], Dict[str, Dict]]
+    """
+    genome_docs = {}
+    taxon_docs = {}
+    for i, genome in enumerate(genomes):
+        refs = fasta_refs(genome, nb_fasta)
+        genome_docs[genome] = {"_id" : genome, "_rev" : "1-bench", "taxon" : f"taxon_{i}",
+            "size" : {ref : fasta_size for ref in refs},
+            "headers" : {ref : f"{ref} synthetic sequence" for ref in refs}}
+        taxon_docs[f"taxon_{i}"] = {"_id" : f"taxon_{i}", "_rev" : "1-bench", "name" : f"Synthetic organism {i}"}
+    return genome_docs, taxon_docs
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of CrisprResultManager stages on synthetic inputs of growing sizes. No couchDB or
+motif-broker is needed : genome and taxon documents are served from a metadata cache store and
+occurence documents from an occurence cache stand-in, both filled with generated documents.
+
+For each word length and each number of setCompare hits, stages are timed and their peak memory
+is measured with tracemalloc :
+    parse, search_occurences, parseBlast, format_results, write_results, serializeResults
+
+Usage (from repository root, after `source test/setenv`) :
+    python bench/run_benchmarks.py --sizes 1000,10000,100000 --output bench.json
+    python bench/run_benchmarks.py --sizes 1000,10000,100000 --compare bench.json
+--compare exits with status 1 if a stage is slower than in the baseline by more than --tolerance.
+CI keeps the json of a reference run as baseline and runs the --compare command on each change.
+test/test_benchmarks.py runs the same stages on small sizes with pytest (and pytest-benchmark if installed).
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generators
+from CSTB.crispr_result_manager import CrisprResultManager
+from CSTB.utils.disk_cache import SqliteLRUStore
+from CSTB.utils.metadata_cache import MetadataCache
+
+STAGES = ["parse", "search_occurences", "parseBlast", "format_results", "write_results", "serializeResults"]
+TAXON_DB = "taxon_db"
+GENOME_DB = "genome_db"
+
+
+class GeneratedOccurences():
+    """Occurence cache stand-in serving pre-generated motif-broker documents, with OccurenceCache interface"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, sequences):
+        found = {seq : self.documents[seq] for seq in sequences if seq in self.documents}
+        self.hits += len(found)
+        self.misses += len(sequences) - len(found)
+        return found
+
+    def put_many(self, documents):
+        pass
+
+def args_gestion(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark post-processing stages on synthetic data")
+    parser.add_argument("--sizes", metavar = "<int,...>", help = "Numbers of setCompare hits", default = "1000,10000,100000")
+    parser.add_argument("--lengths", metavar = "<int,...>", help = "sgRNA lengths, 20 and shorter lengths use different setCompare formats", default = "20,16")
+    parser.add_argument("--to_keep", metavar = "<int>", help = "Number of hits treated after parsing, all hits if 0", default = 0, type = int)
+    parser.add_argument("--genomes", metavar = "<int>", help = "Number of included genomes", default = 4, type = int)
+    parser.add_argument("--homologs", metavar = "<int>", help = "Number of homolog genes by genome in blast output", default = 200, type = int)
+    parser.add_argument("--blast_format", metavar = "<str>", help = "Blast output format", choices = ["xml", "tabular"], default = "xml")
+    parser.add_argument("--stages", metavar = "<str,...>", help = "Stages to run, following stages are skipped", default = ",".join(STAGES))
+    parser.add_argument("--no_memory", help = "Don't trace memory, timings are then closer to production ones", action = "store_true")
+    parser.add_argument("--workdir", metavar = "<dir>", help = "Directory for generated inputs and outputs, temporary if not given")
+    parser.add_argument("--output", metavar = "<file>", help = "Write results as json")
+    parser.add_argument("--compare", metavar = "<file>", help = "Baseline json results to compare with")
+    parser.add_argument("--tolerance", metavar = "<float>", help = "Accepted slowdown ratio over baseline", default = 0.25, type = float)
+    return parser.parse_args(argv)
+
+def measure(stage, results, trace_memory, function, *args, **kwargs):
+    """Run function and append its duration and peak memory to results"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    duration = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results.append({"stage" : stage, "seconds" : duration, "peak_bytes" : peak})
+    return value
+
+def bench_one(PARAM, workdir, size, word_length, metadata_store):
+    """Run all stages for one setCompare size and word length
+
+    :return: Measures of each stage
+    :rtype: List[Dict]
+    """
+    stages = PARAM.stages.split(",")
+    genomes = generators.genome_uuids(PARAM.genomes)
+    set_compare_file = os.path.join(workdir, f"set_compare_{word_length}_{size}.txt")
+    blast_file = os.path.join(workdir, f"blast_{PARAM.homologs}.{PARAM.blast_format}")
+    if not os.path.isfile(set_compare_file):
+        generators.write_set_compare(set_compare_file, size, word_length, len(genomes))
+    if not os.path.isfile(blast_file):
+        generators.write_blast(blast_file, genomes, PARAM.homologs, blast_format = PARAM.blast_format)
+
+    metadata_cache = MetadataCache(None, metadata_store, ttl = float("inf"))
+    manager = CrisprResultManager(None, TAXON_DB, GENOME_DB, None, f"bench_{word_length}_{size}", metadata_cache = metadata_cache)
+    manager.set_taxon_names(genomes, [])
+
+    results = []
+    trace_memory = not PARAM.no_memory
+    blast = "parseBlast" in stages
+    for stage in stages:
+        if stage == "parse":
+            measure(stage, results, trace_memory, manager.parse_set_compare, set_compare_file, word_length, PARAM.to_keep)
+        elif stage == "search_occurences":
+            sequences = list({seq for hit in manager.hits_collection for seq in hit.to_request_sequences})
+            manager.occurence_cache = GeneratedOccurences(generators.occurence_documents(sequences, genomes))
+            measure(stage, results, trace_memory, manager.search_occurences, genomes)
+        elif stage == "parseBlast":
+            measure(stage, results, trace_memory, manager.parseBlast, blast_file, 70, genomes, PARAM.blast_format)
+        elif stage == "format_results":
+            measure(stage, results, trace_memory, manager.format_results, blast)
+        elif stage == "write_results":
+            with open(os.devnull, "w") as devnull:
+                measure(stage, results, trace_memory, manager.write_results, devnull, blast)
+        elif stage == "serializeResults":
+            measure(stage, results, trace_memory, manager.serializeResults, os.path.join(workdir, f"bench_{word_length}_{size}_results.tsv"), blast)
+        else:
+            raise ValueError(f"Unknown stage {stage}")
+    for result in results:
+        result.update({"size" : size, "word_length" : word_length, "treated_hits" : manager.nb_treated_hits})
+    return results
+
+def compare(results, baseline_file, tolerance, no_memory):
+    """Print stages slower than baseline
+
+    :return: Number of regressions
+    :rtype: int
+    """
+    with open(baseline_file) as f:
+        baseline_data = json.load(f)
+    if baseline_data["parameters"].get("no_memory") != no_memory:
+        print("WARNING : memory tracing differs from baseline, timings are not comparable")
+    baseline = {(r["stage"], r["size"], r["word_length"]) : r for r in baseline_data["results"]}
+    nb_regressions = 0
+    for result in results:
+        reference = baseline.get((result["stage"], result["size"], result["word_length"]))
+        if not reference or not reference["seconds"]:
+            continue
+        ratio = result["seconds"] / reference["seconds"]
+        if ratio > 1 + tolerance:
+            nb_regressions += 1
+            print(f"REGRESSION {result['stage']} (length {result['word_length']}, {result['size']} hits) : {reference['seconds']:.3f}s -> {result['seconds']:.3f}s (x{ratio:.2f})")
+    return nb_regressions
+
+def print_table(results):
+    print(f"{'stage':<18}{'length':>7}{'hits':>10}{'treated':>10}{'seconds':>10}{'peak MB':>10}")
+    for r in results:
+        peak = f"{r['peak_bytes'] / 1e6:.1f}" if r["peak_bytes"] is not None else "-"
+        print(f"{r['stage']:<18}{r['word_length']:>7}{r['size']:>10}{r['treated_hits']:>10}{r['seconds']:>10.3f}{peak:>10}")
+
+def main():
+    PARAM = args_gestion()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workdir = PARAM.workdir if PARAM.workdir else tmp_dir
+        os.makedirs(workdir, exist_ok = True)
+
+        genome_docs, taxon_docs = generators.metadata_documents(generators.genome_uuids(PARAM.genomes))
+        metadata_store = os.path.join(workdir, "metadata.sqlite")
+        store = SqliteLRUStore(metadata_store)
+        store.put_many({f"{GENOME_DB}/{doc_id}" : doc for doc_id, doc in genome_docs.items()})
+        store.put_many({f"{TAXON_DB}/{doc_id}" : doc for doc_id, doc in taxon_docs.items()})
+        store.close()
+
+        results = []
+        for word_length in [int(length) for length in PARAM.lengths.split(",")]:
+            for size in [int(size) for size in PARAM.sizes.split(",")]:
+                results.extend(bench_one(PARAM, workdir, size, word_length, metadata_store))
+
+    print_table(results)
+    if PARAM.output:
+        with open(PARAM.output, "w") as o:
+            json.dump({"parameters" : vars(PARAM), "results" : results}, o, indent = 1)
+    if PARAM.compare and compare(results, PARAM.compare, PARAM.tolerance, PARAM.no_memory):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
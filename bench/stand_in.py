@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for couchDB and motif-broker, so that post_processing.py can run end-to-end without the
+real services. Each service is a localhost HTTP server answering the requests CSTB sends :
+    - couchDB : ping, database info, document GET and HEAD, _all_docs with keys
+    - motif-broker : handshake, bulk_request
+Genome and taxon documents and sgRNA occurences come from fixture files :
+    - results.json files of test/data (default), genomes are named after organisms accession. Their sequences
+      come from pow2 encoded indexes, they are recoded to the twobits sequences post_processing.py requests.
+    - json files {"genome_db" : {id : doc}, "taxon_db" : {id : doc}, "occurences" : {sequence : doc}}
+Sequences missing from fixtures get a synthetic document, the same at each request, in all fixture genomes.
+Fixture documents are completed the same way for the genomes they lack.
+
+Faults are injected independently for each service, with a comma-separated spec of key=value :
+    latency, jitter : seconds added to each request, plus uniform random jitter
+    key_latency : seconds added by requested key (bulk_request and _all_docs), to measure batching
+    rate : maximum number of requests by second, following requests wait for their turn
+    concurrency : maximum number of requests handled at the same time, following requests wait
+    error_rate : probability of answering 503
+    drop_rate : probability of closing connection without answer
+    seed : random seed of jitter and failures
+Counters of each service are given at /_stats, never delayed nor failed.
+
+Usage (from repository root, after `source test/setenv`) :
+    python bench/stand_in.py --couch_port 5984 --motif_broker_port 3282 --motif_broker_faults latency=0.05,error_rate=0.1
+    python bin/post_processing.py --couch_endpoint http://127.0.0.1:5984 --motif_broker_endpoint http://127.0.0.1:3282 \\
+        --taxon_db taxon_db --genome_db genome_db --include "GCF_000217635.1&GCF_000953695.1" --exclude "" \\
+        --set_compare test/data/ag_simple/set_index.txt --length 20 --tag load_test
+It can also be started in process with StandIn.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from CSTB.engine.batch_decoding import ALPHABETS
+
+GENOME_DB = "genome_db"
+TAXON_DB = "taxon_db"
+FULL_LENGTH = 23
+COORDS_PATTERN = re.compile(r"[+-]\((\d+),(\d+)\)")
+DEFAULT_FIXTURES = "test/data/*/results.json"
+
+
+class Faults():
+    """Latency, throughput limits and failures injected in a service answers
+
+    :ivar latency: Seconds added to each request
+    :vartype latency: float
+    :ivar jitter: Maximum random seconds added to latency
+    :vartype jitter: float
+    :ivar key_latency: Seconds added by requested key
+    :vartype key_latency: float
+    :ivar rate: Maximum number of requests by second, no limit if 0
+    :vartype rate: float
+    :ivar concurrency: Maximum number of requests handled at the same time, no limit if 0
+    :vartype concurrency: int
+    :ivar error_rate: Probability of answering 503
+    :vartype error_rate: float
+    :ivar drop_rate: Probability of closing connection without answer
+    :vartype drop_rate: float
+    """
+
+    def __init__(self, latency = 0, jitter = 0, key_latency = 0, rate = 0, concurrency = 0, error_rate = 0, drop_rate = 0, seed = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.key_latency = key_latency
+        self.rate = rate
+        self.concurrency = concurrency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_slot = 0
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Create Faults from a "key=value,key=value" spec
+
+        :raises ValueError: Raise if a key is unknown
+        """
+        kwargs = {}
+        for item in filter(None, (spec or "").split(",")):
+            key, value = item.split("=")
+            if key not in ("latency", "jitter", "key_latency", "rate", "concurrency", "error_rate", "drop_rate", "seed"):
+                raise ValueError(f"Unknown fault {key}")
+            kwargs[key] = int(value) if key in ("concurrency", "seed") else float(value)
+        return cls(**kwargs)
+
+    def acquire(self):
+        """Wait for a free slot and for throughput limit
+
+        :return: Seconds spent waiting
+        :rtype: float
+        """
+        start = time.perf_counter()
+        if self._slots:
+            self._slots.acquire()
+        if self.rate:
+            with self._lock:
+                now = time.perf_counter()
+                slot = max(now, self._next_slot)
+                self._next_slot = slot + 1 / self.rate
+            time.sleep(max(0, slot - time.perf_counter()))
+        return time.perf_counter() - start
+
+    def release(self):
+        if self._slots:
+            self._slots.release()
+
+    def draw(self, nb_keys = 0):
+        """Draw delay and outcome of a request
+
+        :return: Seconds to wait and outcome, None for a normal answer, "error" or "drop"
+        :rtype: Tuple[float, str]
+        """
+        with self._lock:
+            delay = self.latency + self.key_latency * nb_keys + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            outcome = self._random.random()
+        if outcome < self.drop_rate:
+            return delay, "drop"
+        if outcome < self.drop_rate + self.error_rate:
+            return delay, "error"
+        return delay, None
+
+
+class Fixtures():
+    """Documents served by stand-in services
+
+    :ivar genomes: couchDB genome documents by uuid
+    :vartype genomes: Dict[str, Dict]
+    :ivar taxons: couchDB taxon documents by id
+    :vartype taxons: Dict[str, Dict]
+    :ivar occurences: motif-broker documents by sequence
+    :vartype occurences: Dict[str, Dict]
+    :ivar synthetic: Generate documents for sequences missing from occurences, else they are missing from answers too
+    :vartype synthetic: bool
+    """
+
+    def __init__(self, synthetic = True):
+        self.genomes = {}
+        self.taxons = {}
+        self.occurences = {}
+        self.synthetic = synthetic
+
+    def load(self, path, codec = "pow2"):
+        """Add documents of a results.json file or of a stand-in fixture file
+
+        :param codec: codec of indexes results.json sequences were decoded from, they are recoded to twobits, defaults to "pow2"
+        :type codec: twobits|pow2, optional
+        """
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            self.genomes.update(data.get(GENOME_DB, {}))
+            self.taxons.update(data.get(TAXON_DB, {}))
+            self.occurences.update(data.get("occurences", {}))
+            return
+
+        recode = str.maketrans(ALPHABETS[codec].decode(), ALPHABETS["twobits"].decode())
+        sizes = {}
+        for entry in data:
+            doc = self.occurences.setdefault(entry["sequence"].translate(recode), {})
+            for occurence in entry["occurences"]:
+                uuid = genome_uuid(occurence["org"])
+                self.taxons.setdefault(f"taxon_{uuid}", {"_id" : f"taxon_{uuid}", "_rev" : "1-fixture", "name" : occurence["org"]})
+                genome_sizes = sizes.setdefault(uuid, {})
+                for ref in occurence["all_ref"]:
+                    doc.setdefault(uuid, {})[ref["ref"]] = ref["coords"]
+                    ends = [int(match.group(2)) for match in map(COORDS_PATTERN.match, ref["coords"]) if match]
+                    genome_sizes[ref["ref"]] = max([genome_sizes.get(ref["ref"], 0)] + ends)
+
+        for uuid, genome_sizes in sizes.items():
+            genome = self.genomes.setdefault(uuid, {"_id" : uuid, "_rev" : "1-fixture", "taxon" : f"taxon_{uuid}", "size" : {}, "headers" : {}})
+            for ref, end in genome_sizes.items():
+                genome["size"][ref] = max(genome["size"].get(ref, 0), end + 1)
+                genome["headers"][ref] = f"{ref} {self.taxons[genome['taxon']]['name']}"
+
+    def occurence(self, sequence):
+        """Get motif-broker document of a sequence. If synthetic documents are enabled, fixture documents are completed with synthetic occurences in the genomes they lack, a sequence can be in several test/data sets.
+
+        :return: Document, None if sequence is unknown and synthetic documents are disabled
+        :rtype: Dict
+        """
+        fixture = self.occurences.get(sequence)
+        if not self.synthetic:
+            return fixture
+        if fixture is not None and len(fixture) == len(self.genomes):
+            return fixture
+        rng = random.Random(hashlib.md5(sequence.encode()).hexdigest())
+        doc = {}
+        for uuid, genome in self.genomes.items():
+            refs = sorted(genome["size"])
+            doc[uuid] = {}
+            for ref in rng.sample(refs, rng.randint(1, len(refs))):
+                starts = sorted(rng.randrange(max(genome["size"][ref] - FULL_LENGTH, 1)) for _ in range(rng.randint(1, 3)))
+                doc[uuid][ref] = [f"{rng.choice('+-')}({start},{start + FULL_LENGTH - 1})" for start in starts]
+        doc.update(fixture or {})
+        return doc
+
+def genome_uuid(organism):
+    """Genome uuid of an organism name of results.json, its trailing accession if any
+    """
+    last = organism.split()[-1]
+    return last if re.match(r"^GC[AF]_\d+\.\d+$", last) else re.sub(r"\W+", "_", organism)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler shared by services. Subclasses implement answer(method, path, body) returning (code, document, number of requested keys)."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        path = urlparse(self.path).path.strip("/").split("/")
+        body = None
+        if "Content-Length" in self.headers:
+            raw = self.rfile.read(int(self.headers["Content-Length"]))
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                return self._send(400, {"error" : "bad_request", "reason" : "invalid json"})
+        stats = self.server.stats
+        if path == ["_stats"]:
+            with self.server.stats_lock:
+                return self._send(200, dict(stats))
+
+        faults = self.server.faults
+        waited = faults.acquire()
+        try:
+            with self.server.stats_lock:
+                stats["requests"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+                stats["waiting_seconds"] += waited
+            code, doc, nb_keys, headers = self.answer(method, path, body)
+            delay, outcome = faults.draw(nb_keys)
+            time.sleep(delay)
+            with self.server.stats_lock:
+                stats["keys"] += nb_keys
+                if outcome:
+                    stats[f"{outcome}s"] += 1
+            if outcome == "drop":
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            if outcome == "error":
+                return self._send(503, {"error" : "unavailable", "reason" : "injected failure"})
+            self._send(code, doc, headers, method == "HEAD")
+        finally:
+            with self.server.stats_lock:
+                stats["in_flight"] -= 1
+            faults.release()
+
+    def _send(self, code, doc, headers = None, head = False):
+        data = json.dumps(doc).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0" if head else str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+class CouchHandler(_Handler):
+    def answer(self, method, path, body):
+        fixtures = self.server.fixtures
+        dbs = {GENOME_DB : fixtures.genomes, TAXON_DB : fixtures.taxons}
+        not_found = {"error" : "not_found", "reason" : "missing"}
+        if path == [""]:
+            return 200, {"couchdb" : "Welcome", "vendor" : {"name" : "CSTB stand-in"}}, 0, None
+        if path[0] not in dbs:
+            return 404, {"error" : "not_found", "reason" : "Database does not exist."}, 0, None
+        docs = dbs[path[0]]
+        if len(path) == 1 and method == "GET":
+            return 200, {"db_name" : path[0], "doc_count" : len(docs), "update_seq" : f"{len(docs)}-fixture"}, 0, None
+        if path[1:] == ["_all_docs"] and method == "POST":
+            keys = (body or {}).get("keys", [])
+            include_docs = "include_docs=true" in urlparse(self.path).query
+            rows = []
+            for key in keys:
+                doc = docs.get(key)
+                if doc:
+                    rows.append({"id" : key, "key" : key, "value" : {"rev" : doc["_rev"]}, **({"doc" : doc} if include_docs else {})})
+                else:
+                    rows.append({"key" : key, "error" : "not_found"})
+            # offset is null for queries by keys
+            return 200, {"total_rows" : len(docs), "offset" : None, "rows" : rows}, len(keys), None
+        if len(path) == 2 and method in ("GET", "HEAD"):
+            doc = docs.get(path[1])
+            if not doc:
+                return 404, not_found, 1, None
+            return 200, doc, 1, {"ETag" : f'"{doc["_rev"]}"'}
+        return 405, {"error" : "method_not_allowed", "reason" : f"{method} {self.path}"}, 0, None
+
+class MotifBrokerHandler(_Handler):
+    def answer(self, method, path, body):
+        if path == ["handshake"] and method == "GET":
+            return 200, {"handshake" : "ok"}, 0, None
+        if path == ["bulk_request"] and method == "POST":
+            keys = (body or {}).get("keys", [])
+            docs = {key : self.server.fixtures.occurence(key) for key in keys}
+            return 200, {"request" : {key : doc for key, doc in docs.items() if doc is not None}}, len(keys), None
+        return 404, {"error" : "not_found"}, 0, None
+
+
+class StandIn():
+    """couchDB and motif-broker stand-ins running in background threads
+
+    :ivar couch_endpoint: couchDB stand-in url
+    :vartype couch_endpoint: str
+    :ivar motif_broker_endpoint: motif-broker stand-in url
+    :vartype motif_broker_endpoint: str
+    """
+
+    def __init__(self, fixtures, couch_faults = None, motif_broker_faults = None, host = "127.0.0.1", couch_port = 0, motif_broker_port = 0):
+        self.servers = {}
+        for name, handler, faults, port in (("couch", CouchHandler, couch_faults, couch_port), ("motif_broker", MotifBrokerHandler, motif_broker_faults, motif_broker_port)):
+            server = ThreadingHTTPServer((host, port), handler)
+            server.daemon_threads = True
+            server.fixtures = fixtures
+            server.faults = faults if faults else Faults()
+            server.stats = {"requests" : 0, "keys" : 0, "errors" : 0, "drops" : 0, "in_flight" : 0, "max_in_flight" : 0, "waiting_seconds" : 0.0}
+            server.stats_lock = threading.Lock()
+            self.servers[name] = server
+        self.couch_endpoint = f"http://{host}:{self.servers['couch'].server_address[1]}"
+        self.motif_broker_endpoint = f"http://{host}:{self.servers['motif_broker'].server_address[1]}"
+        self._threads = []
+
+    def start(self):
+        for server in self.servers.values():
+            thread = threading.Thread(target = server.serve_forever, daemon = True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        """Counters of each service
+
+        :rtype: Dict[str, Dict]
+        """
+        stats = {}
+        for name, server in self.servers.items():
+            with server.stats_lock:
+                stats[name] = dict(server.stats)
+        return stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description = "couchDB and motif-broker stand-in serving fixture files")
+    parser.add_argument("--fixtures", metavar = "<file>", nargs = "+", help = "results.json or stand-in fixture files", default = sorted(glob.glob(DEFAULT_FIXTURES)))
+    parser.add_argument("--host", metavar = "<str>", help = "Listening address", default = "127.0.0.1")
+    parser.add_argument("--couch_port", metavar = "<int>", help = "couchDB stand-in port, random if 0", default = 5984, type = int)
+    parser.add_argument("--motif_broker_port", metavar = "<int>", help = "motif-broker stand-in port, random if 0", default = 3282, type = int)
+    parser.add_argument("--couch_faults", metavar = "<key=value,...>", help = "Faults injected in couchDB answers", default = "")
+    parser.add_argument("--motif_broker_faults", metavar = "<key=value,...>", help = "Faults injected in motif-broker answers", default = "")
+    parser.add_argument("--fixtures_codec", metavar = "<str>", help = "codec of indexes results.json sequences were decoded from", choices = list(ALPHABETS), default = "pow2")
+    parser.add_argument("--no_synthetic", help = "Leave sequences missing from fixtures out of motif-broker answers", action = "store_true")
+    return parser.parse_args()
+
+def main():
+    PARAM = args_gestion()
+    fixtures = Fixtures(synthetic = not PARAM.no_synthetic)
+    for path in PARAM.fixtures:
+        fixtures.load(path, PARAM.fixtures_codec)
+    stand_in = StandIn(fixtures, Faults.from_spec(PARAM.couch_faults), Faults.from_spec(PARAM.motif_broker_faults), PARAM.host, PARAM.couch_port, PARAM.motif_broker_port)
+    print(f"couchDB stand-in at {stand_in.couch_endpoint}, databases {GENOME_DB} and {TAXON_DB}", file = sys.stderr)
+    print(f"motif-broker stand-in at {stand_in.motif_broker_endpoint}, {len(fixtures.occurences)} fixture sequences", file = sys.stderr)
+    for uuid, genome in sorted(fixtures.genomes.items()):
+        print(f"    {uuid}\t{fixtures.taxons[genome['taxon']]['name']}", file = sys.stderr)
+    stand_in.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    stand_in.stop()
+    print(json.dumps(stand_in.stats(), indent = 1), file = sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
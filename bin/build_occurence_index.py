@@ -0,0 +1,44 @@
+import logging
+logging.basicConfig(filename = "build_occurence_index.log", level = logging.INFO, format='%(asctime)s\t%(levelname)s\t%(message)s')
+import argparse
+import json
+import os
+import pickle
+from CSTB.engine.occurence_index import build_occurence_index
+import CSTB.utils.error as error
+
+def args_gestion():
+    """
+    Take and treat arguments that user gives in command line
+    """
+    parser = argparse.ArgumentParser(description="Export sgRNA occurences of a genome into a memory-mapped occurence index, used by post_processing.py --occurence_index instead of motif-broker")
+    parser.add_argument("--genome", metavar = "<str>", help = "Genome uuid", required = True)
+    source = parser.add_mutually_exclusive_group(required = True)
+    source.add_argument("--fasta", metavar = "<file>", help = "Genome fasta file, sgRNAs are searched in it")
+    source.add_argument("--documents", metavar = "<file>", help = "sgRNA documents of the genome, pickle like reference genomes pickles or json like motif-broker documents")
+    parser.add_argument("--organism", metavar = "<str>", help = "Key of the genome in documents, defaults to --genome")
+    parser.add_argument("--output_dir", metavar = "<dir>", help = "Directory of occurence indexes, index is written in <output_dir>/<genome>", required = True)
+    return parser.parse_args()
+
+def load_documents(path):
+    if path.endswith(".json"):
+        with open(path) as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+if __name__ == '__main__':
+    logging.info("== build_occurence_index.py")
+    ARGS = args_gestion()
+    organism = ARGS.organism if ARGS.organism else ARGS.genome
+    if ARGS.fasta:
+        if not os.path.isfile(ARGS.fasta):
+            raise FileNotFoundError(f"{ARGS.fasta} doesn't exist")
+        from CSTB_core.engine.word_detect import sgRNAfastaSearch
+        documents = sgRNAfastaSearch(ARGS.fasta, organism)
+    else:
+        documents = load_documents(ARGS.documents)
+    if not documents:
+        raise error.ArgumentError(f"No sgRNA found for {ARGS.genome}")
+    os.makedirs(ARGS.output_dir, exist_ok = True)
+    print(build_occurence_index(documents, ARGS.genome, ARGS.output_dir, organism))
@@ -0,0 +1,12 @@
+import logging
+logging.basicConfig(filename = "crispr_workflow.log", level = logging.INFO, format='%(asctime)s\t%(levelname)s\t%(message)s')
+from CSTB.workflow import main
+
+'''Run a CRISPR search job in current directory, in place of crispr_workflow.sh and crispr_workflow_specific.sh.
+Arguments default to the environment variables read by these scripts :
+    python -u crispr_workflow.py all
+    python -u crispr_workflow.py specific
+'''
+
+if __name__ == '__main__':
+    main()
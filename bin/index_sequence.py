@@ -9,6 +9,7 @@ import argparse
 import logging
 logging.basicConfig(filename = "index_sequence.log", level = logging.DEBUG, format='%(levelname)s\t%(message)s')
 import CSTB.utils.error as error
+from CSTB.utils.profiling import Profiler, profile_stage
 
 
 def args_gestion():
@@ -16,6 +17,7 @@ def args_gestion():
     parser.add_argument("-f", "--fasta", metavar = "<file>", help = "Fasta file with sequence", required = True)
     parser.add_argument("-c", "--codec", metavar = "<str>", help = "Encoding mode (twobits or pow2)", default = "twobits")
     parser.add_argument("-o", "--output", metavar = "<file>", help = "Results file with indexes", required = True)
+    parser.add_argument("--profile", metavar = "<dir>", nargs = "?", const = "profile", help = "Profile each stage with cProfile and tracemalloc, profiles are written in this directory, defaults to profile")
 
     args = parser.parse_args()
 
@@ -29,13 +31,17 @@ if __name__ == "__main__":
     ARGS = args_gestion()
     if not (os.path.isfile(ARGS.fasta)):
         raise FileNotFoundError(f"{ARGS.fasta} doesn't exist")
-    sgRNA_seqs = sgRNAfastaSearch(ARGS.fasta, 'gene')
+    profiler = Profiler(ARGS.profile) if ARGS.profile else None
+    with profile_stage(profiler, "search_sgrna"):
+        sgRNA_seqs = sgRNAfastaSearch(ARGS.fasta, 'gene')
     if not sgRNA_seqs:
         error.empty_exit("No sgRNA found in gene")
     logging.info(sgRNA_seqs)
     setEncoding(ARGS.codec)
-    indexData, word_length = indexAndMayOccurence(sgRNA_seqs)
-    sgRNAIndexWriter(indexData, ARGS.output, word_length, ARGS.codec)
+    with profile_stage(profiler, "index"):
+        indexData, word_length = indexAndMayOccurence(sgRNA_seqs)
+    with profile_stage(profiler, "write_index"):
+        sgRNAIndexWriter(indexData, ARGS.output, word_length, ARGS.codec)
     #writeIndexes(indexData, ARGS.output)
     
     
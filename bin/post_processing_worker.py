@@ -0,0 +1,43 @@
+import logging
+logging.basicConfig(filename = "post_processing_worker.log", level = logging.INFO, format='%(asctime)s\t%(levelname)s\t%(message)s')
+import argparse
+import os
+import shutil
+import sys
+from CSTB.worker import serve, submit
+
+def args_gestion():
+    """
+    Take and treat arguments that user gives in command line
+    """
+    parser = argparse.ArgumentParser(description="Long-running post-processing worker and its job submission client")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    parser_serve = subparsers.add_parser("serve", help = "Run post-processing jobs submitted to spool directory")
+    parser_serve.add_argument("--spool", metavar = "<dir>", help = "Spool directory", required = True)
+    parser_serve.add_argument("--max_jobs", metavar = "<int>", help = "Stop after this number of jobs", type = int)
+
+    parser_submit = subparsers.add_parser("submit", help = "Submit a post-processing job, wait for its end and print its json results")
+    parser_submit.add_argument("--spool", metavar = "<dir>", help = "Spool directory", required = True)
+    parser_submit.add_argument("--timeout", metavar = "<float>", help = "Maximum waiting time in seconds", type = float)
+    parser_submit.add_argument("args", nargs = argparse.REMAINDER, help = "post_processing.py arguments, after --")
+    return parser.parse_args()
+
+def main():
+    PARAM = args_gestion()
+    if PARAM.command == "serve":
+        serve(PARAM.spool, PARAM.max_jobs)
+        return
+
+    args = PARAM.args[1:] if PARAM.args[:1] == ["--"] else PARAM.args
+    status = submit(PARAM.spool, args, timeout = PARAM.timeout)
+    # Missing if job working directory couldn't be written, the worker logs why
+    if os.path.exists(status["stdout"]):
+        with open(status["stdout"]) as f:
+            shutil.copyfileobj(f, sys.stdout)
+        os.remove(status["stdout"])
+    sys.exit(status["status"])
+
+
+if __name__ == '__main__':
+    main()
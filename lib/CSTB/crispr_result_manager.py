@@ -1,18 +1,26 @@
+import json
 import logging
+import os
 import pycouch.error
-import re
-from collections import OrderedDict
 from CSTB.engine.crispr_hit import Hit
+from CSTB.engine.hit_table import HitTable
 import CSTB.utils.error as error
-import requests
+from CSTB.utils.metadata_cache import MetadataCache
 import time
 from typing import List, Dict
-from CSTB.engine.crispr_blast import BlastReport
-import motif_broker_request.request as mb_request
+from CSTB.engine.crispr_blast import BlastReport, GeneIndex
+import CSTB.engine.crispr_set_compare as set_compare
+import CSTB.engine.set_compare_engine as set_compare_engine
+from CSTB.utils.occurence_fetcher import OccurenceFetcher, DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS
+import CSTB.utils.tsv_export as tsv_export
 
+ALL_HITS_BATCH_SIZE = 10000
+
+# Ranking values of setCompare hits from their (index, weight[, longer_index]) fields, higher is better
+RANK_KEYS = {
+    "weight" : lambda index, weight, *longer_index : weight
+}
 
-SESSION = requests.Session()
-SESSION.trust_env = False
 
 '''TO DO
 - make module that interrogate CSTB database (function get_taxon_name and get_genomes_size)
@@ -29,13 +37,21 @@ class CrisprResultManager():
         tag (str): tag for result storage
         nb_total_hits (int): Number of hits found by setCompare. Set with parse_set_compare() call.
         nb_treated_hits (int): Number of setCompare hits treated by this manager. Set with parse_set_compare() call.
+        hit_table (HitTable) : Columnar table of setCompare hits. Set with parse_set_compare() or compute_set_compare() call.
+        treated_positions (Container[int]) : Positions in setCompare results of hits in hits_collection. Set with parse_set_compare() or compute_set_compare() call.
+        set_compare_file (str) : setCompare result file. Set with parse_set_compare() call, None with compute_set_compare() call.
+        word_length (int) : sgRNA length without pam. Set with parse_set_compare() call.
         hits_collection (List[Hit]) : List of Hit objects
+        gene_index (GeneIndex) : Index of homolog genes by genome and fasta header. Set with parseBlast() call.
         include_taxon (Dict) : Dict with included genomes uuid as keys and corresponding taxon name as value
         exclude_taxon (Dict) : Dict with included genomes uuid as keys and corresponding taxon name as value
+        metadata_cache (MetadataCache) : Cache of genome and taxon couch documents. Only memoized for this manager if not given.
+        occurence_cache (OccurenceCache) : Cache of motif-broker documents shared across jobs, not used if None.
+        occurence_fetcher (OccurenceFetcher) : motif-broker client shared across jobs, or OccurenceResolver to get occurences from local occurence indexes. A new motif-broker client is created for each search if None.
 
     """
 
-    def __init__(self, pycouch_wrapper, taxondb, genomedb, motif_broker_endpoint, tag, include_taxon = {}, exclude_taxon = {}, nb_total_hits = None, nb_treated_hits = None, hits_collection = [], homolog_genes = []):
+    def __init__(self, pycouch_wrapper, taxondb, genomedb, motif_broker_endpoint, tag, include_taxon = None, exclude_taxon = None, nb_total_hits = None, nb_treated_hits = None, hits_collection = None, homolog_genes = None, metadata_cache = None, occurence_cache = None, occurence_fetcher = None):
         self.wrapper = pycouch_wrapper
         self.motif_broker_endpoint = motif_broker_endpoint
         self.taxondb = taxondb
@@ -43,15 +59,22 @@ class CrisprResultManager():
         self.tag = tag
         self.nb_total_hits = nb_total_hits
         self.nb_treated_hits = nb_treated_hits
-        self.hits_collection = hits_collection
-        self.include_taxon = include_taxon
-        self.exclude_taxon = exclude_taxon
-        self.homolog_genes = homolog_genes
-        mb_request.configure(self.motif_broker_endpoint)
+        self.hits_collection = hits_collection if hits_collection is not None else []
+        self.include_taxon = include_taxon if include_taxon is not None else {}
+        self.exclude_taxon = exclude_taxon if exclude_taxon is not None else {}
+        self.homolog_genes = homolog_genes if homolog_genes is not None else []
+        self.hit_table = None
+        self.treated_positions = None
+        self.set_compare_file = None
+        self.word_length = None
+        self.gene_index = None
+        self.metadata_cache = metadata_cache if metadata_cache else MetadataCache(pycouch_wrapper)
+        self.occurence_cache = occurence_cache
+        self.occurence_fetcher = occurence_fetcher
 
     #Move this in some consumer
     def get_taxon_name(self, list_uuid):
-        """Get taxon names for a list of genome uuid. Will interrogate couchDB genome db and taxon db.
+        """Get taxon names for a list of genome uuid. Will interrogate couchDB genome db and taxon db, with one bulk request for all genomes and one for all their taxons.
         
         Args:
             list_uuid (List[str]): list of genomes uuid
@@ -61,20 +84,31 @@ class CrisprResultManager():
         """
         correspondance_genome_taxon = {}
         logging.debug(f"Get taxon name for {list_uuid}")
+        genomes = self._get_genome_docs(list_uuid)
+        taxons = self.metadata_cache.get_docs(self.taxondb, [genomes[g_uuid]["taxon"] for g_uuid in list_uuid])
         for g_uuid in list_uuid:
-            logging.debug(g_uuid)
-            resp = self.wrapper.couchGetDoc(self.genomedb, g_uuid)
-            if not resp:
-                raise error.CouchNotFound(f"{self.wrapper.end_point}/{self.genomedb}/{g_uuid} not found")
-            taxon_uuid = resp["taxon"]
-
-            resp = self.wrapper.couchGetDoc(self.taxondb, taxon_uuid)
-            if not resp:
+            taxon_uuid = genomes[g_uuid]["taxon"]
+            if not taxons[taxon_uuid]:
                 raise error.CouchNotFound(f"{self.wrapper.end_point}/{self.taxondb}/{taxon_uuid} not found")
-            correspondance_genome_taxon[g_uuid] = resp["name"]
+            correspondance_genome_taxon[g_uuid] = taxons[taxon_uuid]["name"]
 
         return correspondance_genome_taxon
 
+    def _get_genome_docs(self, list_uuid):
+        """Get genome documents for a list of genomes uuid with one bulk request
+        
+        Raises:
+            error.CouchNotFound: Raise when couch document is not found
+
+        Returns:
+            Dict: Dict with genome_uuid as key and genome couch document as value
+        """
+        genomes = self.metadata_cache.get_docs(self.genomedb, list_uuid)
+        for g_uuid in list_uuid:
+            if not genomes[g_uuid]:
+                raise error.CouchNotFound(f"{self.wrapper.end_point}/{self.genomedb}/{g_uuid} not found")
+        return genomes
+
     #Move this in some consumer
     def get_genomes_size(self, list_uuid):
         """ Get genome size for a list of genomes uuid. Interrogate couchDB genome database.
@@ -89,14 +123,20 @@ class CrisprResultManager():
             Dict: Dict with genome_uuid as key and size dict as value. Size dict contains subsequence name as key and list of coordinates as value. 
         """
         sizes = {}
+        genomes = self._get_genome_docs(list_uuid)
         for g_uuid in list_uuid:
-            resp = self.wrapper.couchGetDoc(self.genomedb, g_uuid)
-            if not resp:
-                raise error.CouchNotFound(f"{self.wrapper.end_point}/{self.genomedb}/{g_uuid} not found")
-            size = resp["size"]
+            size = genomes[g_uuid]["size"]
             sizes[g_uuid] = size
         return sizes
 
+    def genome_db_revision(self):
+        """Get current revision of genome database, changed each time a genome is added or updated
+
+        Returns:
+            str: genome database update sequence
+        """
+        return str(self.wrapper.couchGetRequest(self.genomedb)["update_seq"])
+
     def get_fasta_metadata(self, list_uuid):
         """Get metadata for fasta subsequences (sizes and headers) of genomes given in list_uuid
 
@@ -111,10 +151,9 @@ class CrisprResultManager():
             Dict: { genome_uuid : { fasta_subsequence_ref : { "size" : size_value, "header" : header_value } } }. Dictionnary with header and size associated with each fasta subsequence of each genome from given list.
         """
         metadata = {}
+        genomes = self._get_genome_docs(list_uuid)
         for g_uuid in list_uuid:
-            resp = self.wrapper.couchGetDoc(self.genomedb, g_uuid)
-            if not resp:
-                raise error.CouchNotFound(f"{self.wrapper.end_point}/{self.genomedb}/{g_uuid} not found")
+            resp = genomes[g_uuid]
             
             if not resp.get("size"):
                 raise error.FastaMetadataError(f"{self.wrapper.end_point}/{self.genomedb}/{g_uuid} has not 'size' attribute")
@@ -137,40 +176,85 @@ class CrisprResultManager():
     def set_taxon_names(self, include, exclude):
         #type: (List[str], List[str]) -> None
         """
-        Get taxon names for include and exclude genomes uuid. Call get_taxon_name() and set include_taxon and exclude_taxon attributes. 
+        Get taxon names for include and exclude genomes uuid. Call get_taxon_name() once for all genomes and set include_taxon and exclude_taxon attributes. 
 
         :param include: List of include genome uuid
         :param exclude: List of exclude genome uuid
         """
 
+        taxon_names = self.get_taxon_name(include + exclude)
         if include:
-            self.include_taxon = self.get_taxon_name(include)
+            self.include_taxon = {g_uuid : taxon_names[g_uuid] for g_uuid in include}
         if exclude:
-            self.exclude_taxon = self.get_taxon_name(exclude)
+            self.exclude_taxon = {g_uuid : taxon_names[g_uuid] for g_uuid in exclude}
 
-    def search_occurences(self, genomes_include):
-        """Search sgRNA occurences in couchDB with motif broker and complete Hit objects.
+    def search_occurences(self, genomes_include, len_slice = DEFAULT_CHUNK_SIZE, nb_workers = DEFAULT_WORKERS):
+        """Search sgRNA occurences in couchDB with motif broker, or in local occurence indexes if occurence_fetcher is an OccurenceResolver, and complete Hit objects of hits_collection.
         
         :param genomes_include: list of genome uuid
-        :param len_slice: Length of packet to interrogate couchDB, defaults to 2000
+        :param len_slice: Length of packet to interrogate couchDB, defaults to 2000. Not used if occurence_fetcher is set.
+        :param nb_workers: Number of packets requested concurrently, defaults to 4. Not used if occurence_fetcher is set.
 
         :raises error.PingError: Raise when motif-broker can't be reach
+        :raises error.ConsistencyError: Raise when motif-broker doesn't answer for some sequences
         """
-        try:
-            SESSION.get(self.motif_broker_endpoint + "/handshake")
-        except:
-            raise error.PingError(f"Can't handshake motif-broker at {self.motif_broker_endpoint}")
-        
-        all_seqs = [seq for hit in self.hits_collection for seq in hit.to_request_sequences]
+        self._search_hits_occurences(self.hits_collection, genomes_include, len_slice, nb_workers)
 
-        results = mb_request.get(all_seqs)
+    def _search_hits_occurences(self, hits, genomes_include, len_slice, nb_workers):
+        """Search occurences of given hits. Each distinct sequence is requested once, from occurence_cache first if set. Remaining sequences are requested by chunks, several chunks at a time, and each hit stores its occurences as soon as all its sequences are received.
         
-        for hit in self.hits_collection:
-            hit.store_occurences([results[seq] for seq in hit.to_request_sequences], genomes_include)
-            
-           
-
-    def parse_set_compare(self, setCompare_file, word_length, to_keep=None):
+        :param hits: Hits to complete
+        :type hits: List[Hit]
+        """
+        all_seqs = list(dict.fromkeys(seq for hit in hits for seq in hit.to_request_sequences))
+        logging.info(f"{len(all_seqs)} distinct sequences to search")
+
+        # Hits waiting for each sequence, sequences still missing for each hit and number of not stored hits that need each sequence
+        waiting_hits = {}
+        missing_seqs = []
+        nb_needing_hits = {}
+        for i, hit in enumerate(hits):
+            missing_seqs.append(set(hit.to_request_sequences))
+            for seq in missing_seqs[i]:
+                waiting_hits.setdefault(seq, []).append(i)
+                nb_needing_hits[seq] = nb_needing_hits.get(seq, 0) + 1
+        results = {}
+
+        def store_chunk(chunk_results):
+            results.update(chunk_results)
+            for seq in chunk_results:
+                for i in waiting_hits.pop(seq, []):
+                    missing_seqs[i].discard(seq)
+                    if not missing_seqs[i]:
+                        hit = hits[i]
+                        hit.store_occurences([results[hit_seq] for hit_seq in hit.to_request_sequences], genomes_include)
+                        for hit_seq in set(hit.to_request_sequences):
+                            nb_needing_hits[hit_seq] -= 1
+            # Forget documents that no waiting hit needs anymore
+            for seq in chunk_results:
+                if not nb_needing_hits.get(seq):
+                    results.pop(seq, None)
+
+        if self.occurence_cache:
+            cached = self.occurence_cache.get_many(all_seqs)
+            logging.info(f"{len(cached)} sequences found in occurence cache")
+            store_chunk(cached)
+            all_seqs = [seq for seq in all_seqs if seq not in cached]
+
+        def cache_and_store_chunk(chunk_results):
+            self.occurence_cache.put_many(chunk_results)
+            store_chunk(chunk_results)
+
+        if all_seqs:
+            fetcher = self.occurence_fetcher if self.occurence_fetcher else OccurenceFetcher(self.motif_broker_endpoint, len_slice, nb_workers)
+            if not fetcher.handshaked:
+                fetcher.handshake()
+            fetcher.fetch(all_seqs, cache_and_store_chunk if self.occurence_cache else store_chunk)
+
+        if waiting_hits:
+            raise error.ConsistencyError(f"No motif-broker answer for {list(waiting_hits)[:10]}")
+
+    def parse_set_compare(self, setCompare_file, word_length, to_keep=None, rank_by = "weight"):
         """ Parse results from setCompare. Will call a different parsing function for word with size 20 and for shorter words. Separate functions are required because setCompare results format is not the same with with 20-length words and shorter words. Initialize hits_collection and nb_treated_hits
         
         :param setCompare_file: path to setCompare result file 
@@ -179,21 +263,72 @@ class CrisprResultManager():
         :type word_length: int
         :param to_keep: Number of hits to keep
         :type to_keep: int
+        :param rank_by: Key of RANK_KEYS to keep the to_keep best hits, ranked by it, or "file" to keep the to_keep first hits of file, defaults to "weight"
+        :type rank_by: str, optional
         """
         
         
-        self.hits_collection=[]
+        self.hit_table = HitTable()
+        self.set_compare_file = setCompare_file
+        self.word_length = word_length
         logging.info(f"Parse set compare for word length {word_length}")
         if word_length == 20:
-            self._parse_set_compare_20(setCompare_file, to_keep, word_length)
+            self._parse_set_compare_20(setCompare_file, to_keep, word_length, rank_by)
         else:
-            self._parse_set_compare_other(setCompare_file, to_keep, word_length)
+            self._parse_set_compare_other(setCompare_file, to_keep, word_length, rank_by)
+        self.hits_collection = self.hit_table.to_hits(word_length + 3)
         logging.info(f"Nb hits collection {len(self.hits_collection)}")
 
         self.nb_treated_hits = len(self.hits_collection)
+
+    def _fill_hit_table(self, hits, to_keep, rank_by):
+        """Store hits to keep in hit_table and their position in setCompare file in treated_positions
+        
+        :param hits: setCompare hits
+        :type hits: Iterator[Tuple]
+        """
+        if rank_by == "file":
+            for hit in hits:
+                if to_keep and len(self.hit_table) == to_keep: break
+                self.hit_table.append(*hit)
+            self.treated_positions = range(len(self.hit_table))
+            return
+
+        kept = set_compare.top_k(hits, to_keep, RANK_KEYS[rank_by])
+        for position, hit in kept:
+            self.hit_table.append(*hit)
+        self.treated_positions = {position for position, hit in kept}
             
-    def _parse_set_compare_20(self, setCompare_file, to_keep, word_length):
-        """Parse setCompare for word of size 20. 
+    def compute_set_compare(self, index_store, include, exclude, word_length, to_keep = None, query_codes = None):
+        """Compute setCompare results in process from memory-mapped genome indexes, instead of parsing setCompare result file. All hits are kept in hit_table, only to_keep first ones are in hits_collection. They are the to_keep best hits for all RANK_KEYS, results being ordered by decreasing weight. Initialize hits_collection, nb_total_hits and nb_treated_hits like parse_set_compare.
+        
+        :param index_store: Genome index arrays
+        :type index_store: IndexStore
+        :param include: Included genomes uuid
+        :type include: List[str]
+        :param exclude: Excluded genomes uuid
+        :type exclude: List[str]
+        :param word_length: Word length
+        :type word_length: int
+        :param to_keep: Number of hits to keep, all hits if None or 0
+        :type to_keep: int
+        :param query_codes: 23-length words that hits must come from, like setCompare -s option, defaults to None
+        :type query_codes: numpy.ndarray, optional
+        """
+        logging.info(f"Compute set compare for word length {word_length}")
+        self.hit_table = HitTable.from_arrays(*set_compare_engine.set_compare(index_store, include, exclude, word_length, query_codes))
+        self.set_compare_file = None
+        self.word_length = word_length
+        # Same type as parse_set_compare
+        self.nb_total_hits = str(len(self.hit_table)) if word_length == 20 else len(self.hit_table)
+        self.hits_collection = self.hit_table.to_hits(word_length + 3, stop = to_keep if to_keep else None)
+        logging.info(f"Nb hits collection {len(self.hits_collection)}")
+
+        self.nb_treated_hits = len(self.hits_collection)
+        self.treated_positions = range(self.nb_treated_hits)
+
+    def _parse_set_compare_20(self, setCompare_file, to_keep, word_length, rank_by = "weight"):
+        """Parse setCompare for word of size 20 into hit_table. Hits are streamed from the file, only the to_keep best ones are stored.
         
         :param setCompare_file: path to setCompare result file 
         :type setCompare_file: str
@@ -201,47 +336,36 @@ class CrisprResultManager():
         :type to_keep: int
         :param word_length: sgRNA length
         :type word_length: int
+        :param rank_by: Key of RANK_KEYS or "file", defaults to "weight"
+        :type rank_by: str, optional
         """
 
         with open(setCompare_file, "r") as filin:
-            text = filin.readlines()
+            self.nb_total_hits = set_compare.read_nb_hits(filin)
+            if int(self.nb_total_hits) == 0:
+                return
 
-        self.nb_total_hits = re.search("[0-9]+", text[-2]).group()
-        if int(self.nb_total_hits) == 0:
-            return
+            self._fill_hit_table(set_compare.iter_hits_20(filin), to_keep, rank_by)
 
-        index_dic = OrderedDict()
-        i = 0
-        for rank_occ in text[-1].strip().split(","):
-            if to_keep and i == to_keep: break
-            self.hits_collection.append(Hit(rank_occ.split(":")[0],rank_occ.split(":")[1], word_length + 3))
-            #index_dic[int(rank_occ.split(":")[0])] = rank_occ.split(":")[1]
-            i += 1
-
-    def _parse_set_compare_other(self, setCompare_file, to_keep, word_length):
+    def _parse_set_compare_other(self, setCompare_file, to_keep, word_length, rank_by = "weight"):
+        """Parse setCompare for words shorter than 20 into hit_table. Hits are streamed from the file, only the to_keep best ones are stored.
+        
+        :param setCompare_file: path to setCompare result file 
+        :type setCompare_file: str
+        :param to_keep: Number of hits to keep
+        :type to_keep: int
+        :param word_length: sgRNA length
+        :type word_length: int
+        :param rank_by: Key of RANK_KEYS or "file", defaults to "weight"
+        :type rank_by: str, optional
+        """
         logging.debug("parse set compare other")
         with open(setCompare_file, "r") as filin:
-            for line in filin:
-                regex_nb_hits = re.search("^# ([0-9]+)", line)
-                if regex_nb_hits:
-                    self.nb_total_hits = int(regex_nb_hits.group(1))
-
-                    if self.nb_total_hits == 0:
-                        return
-                    break
-
-            index_dic = OrderedDict()
-            i = 0
-            for rank_occ in filin:
-                if (to_keep and i == to_keep) or rank_occ == "\n": break
-                rank_splitted = rank_occ.split(":")
-                
-                index_sgrna = rank_splitted[0]
-                weight = rank_splitted[1].split("[")[0]
-                index_longer_sgrna = [int(index.replace("'","")) for index in rank_occ.split("[")[1].rstrip("]\n").split(",")]
-                self.hits_collection.append(Hit(index_sgrna, weight, word_length + 3, longer_index = index_longer_sgrna))
-                i += 1
-            logging.debug(f"First hit\n{self.hits_collection[0]}")
+            self.nb_total_hits = int(set_compare.read_nb_hits(filin))
+            if self.nb_total_hits == 0:
+                return
+
+            self._fill_hit_table(set_compare.iter_hits_other(filin), to_keep, rank_by)
 
     def generate_json_data(self):
         """Generate json data for client (to display into table) from Hit collection. 
@@ -249,13 +373,18 @@ class CrisprResultManager():
         :return: json data, 
         :rtype: List[Dict]
         """
+        return list(self.iter_json_data())
 
-        results = []
+    def iter_json_data(self):
+        """Generate json data entries one by one, in generate_json_data() order.
+        
+        :return: json data entries
+        :rtype: Iterator[Dict]
+        """
         sorted_hits = sorted(self.hits_collection, key=lambda hit: hit.number_occurences)
         #logging.debug([hit.number_occurences for hit in self.hits_collection])
         for hit in sorted_hits:
-            results.append({"sequence" : hit.sequence, "occurences" : hit.list_occ(self.include_taxon)})
-        return results
+            yield {"sequence" : hit.sequence, "occurences" : hit.list_occ(self.include_taxon)}
 
     def generate_json_data_card(self):
         """Generate json data for client to display genomic card from Hit collection. 
@@ -263,24 +392,28 @@ class CrisprResultManager():
         :return: json data
         :rtype: Dict { organism : { fasta_header : { sgRNA_sequence : List[str] } } }
         """
+        return dict(self.iter_json_data_card())
 
-        def insert_in_data_card(genome_uuid, subseq, sequence, coords):
-            genome_name = self.include_taxon[genome_uuid]
-            if genome_name not in data_card:
-                data_card[genome_name] = {}
-            
-            if subseq not in data_card[genome_name]:
-                data_card[genome_name][subseq] = {}
-            
-            data_card[genome_name][subseq][hit.sequence] = hit.occurences[genome_uuid][subseq]
-
-        data_card = {}
+    def iter_json_data_card(self):
+        """Generate json data card organism by organism, in generate_json_data_card() order.
+        
+        :return: (organism, { fasta_header : { sgRNA_sequence : List[str] } })
+        :rtype: Iterator[Tuple[str, Dict]]
+        """
+        # Hits and genomes to insert in each organism card, in collection order
+        organism_hits = {}
         for hit in self.hits_collection:
             for genome in hit.occurences:
+                organism_hits.setdefault(self.include_taxon[genome], []).append((hit, genome))
+
+        for genome_name, hits in organism_hits.items():
+            organism_card = {}
+            for hit, genome in hits:
                 for subseq in hit.occurences[genome]:
-                    insert_in_data_card(genome, subseq, hit.sequence, hit.occurences[genome][subseq])
-        
-        return data_card
+                    if subseq not in organism_card:
+                        organism_card[subseq] = {}
+                    organism_card[subseq][hit.sequence] = hit.occurences[genome][subseq]
+            yield genome_name, organism_card
 
     def generate_json_size(self):
         """[summary]
@@ -337,19 +470,77 @@ class CrisprResultManager():
 
         return final_json
 
-    def parseBlast(self, blast_xml, identity, included_genomes):
+    def write_results(self, stream, blast = False, data = None, data_card = None):
+        """Write the final json for client, with the same content as format_results(). Everything that can fail is done before the first write, so that stream never gets partial json : metadata are retrieved and genomes of occurences are checked first, then data entries and data card organisms are serialized and written one at a time.
+        
+        :param stream: Text stream to write json to
+        :type stream: TextIO
+        :param blast: Add homolog genes data, defaults to False
+        :type blast: bool, optional
+        :param data: Data entries to write instead of the ones of hits_collection, like merged shards entries, defaults to None
+        :type data: Iterable[Dict], optional
+        :param data_card: Data card organisms to write instead of the ones of hits_collection, defaults to None
+        :type data_card: Iterable[Tuple[str, Dict]], optional
+        :raises error.ConsistencyError: Raise if occurences are in a genome without taxon name
+        """
+        size = self.generate_json_size() #To delete
+        fasta_metadata = self.generate_fasta_metadata()
+        gene = self.generateGeneData() if blast else None
+        if data is None or data_card is None:
+            unnamed = {occ.genome for hit in self.hits_collection for occ in hit.list_occurences} - self.include_taxon.keys()
+            if unnamed:
+                raise error.ConsistencyError(f"Occurences in genomes {sorted(unnamed)} that have no taxon name")
+
+        def write_item(key, value, first = False):
+            stream.write(("" if first else ", ") + json.dumps(key) + ": " + json.dumps(value))
+
+        stream.write("{")
+        write_item("gi", "&".join(list(self.include_taxon.values())), first = True)
+        write_item("not_in", ",".join(list(self.exclude_taxon.values())))
+        write_item("number_hits", self.nb_total_hits)
+        write_item("number_treated_hits", self.nb_treated_hits)
+
+        stream.write(", \"data\": [")
+        for i, entry in enumerate(data if data is not None else self.iter_json_data()):
+            stream.write((", " if i else "") + json.dumps(entry))
+        stream.write("]")
+
+        stream.write(", \"data_card\": {")
+        for i, (genome_name, organism_card) in enumerate(data_card if data_card is not None else self.iter_json_data_card()):
+            write_item(genome_name, organism_card, first = not i)
+        stream.write("}")
+
+        write_item("tag", self.tag)
+        write_item("size", size)
+        write_item("fasta_metadata", fasta_metadata)
+        if blast:
+            write_item("gene", gene)
+        stream.write("}")
+
+    def parseBlast(self, blast_xml, identity, included_genomes, blast_format = "xml"):
         """Take blast xml file and parse it. Just keep homolog genes with more than defined identity and just keep coordinates that maps with homolog genes.
         
-        :param blast_xml: path to blast xml result
+        :param blast_xml: path to blast result
         :type blast_xml: str
         :param identity: minimum identity percentage
         :type identity: int
         :param included_genomes: list of included genomes uuid
         :type included_genomes: List[str]
+        :param blast_format: blast result format, xml (-outfmt 5) or tabular (-outfmt 6/7 with crispr_blast.TABULAR_FIELDS columns), defaults to xml
+        :type blast_format: xml|tabular
+        :raises error.NoBlastHit: Raise if there is no blast hit at all
+        :raises error.NoHomolog: Raise if at least 1 included genome has not an homolog gene.
+        """
+        self.load_blast(blast_xml, identity, included_genomes, blast_format)
+        self.annotate_blast_hits()
+
+    def load_blast(self, blast_xml, identity, included_genomes, blast_format = "xml"):
+        """First step of parseBlast : parse blast result and keep homolog genes. Independent of hits, can run before or during occurences search.
+
         :raises error.NoBlastHit: Raise if there is no blast hit at all
         :raises error.NoHomolog: Raise if at least 1 included genome has not an homolog gene.
         """
-        blast_report = BlastReport(blast_xml, identity, included_genomes)
+        blast_report = BlastReport(blast_xml, identity, included_genomes, blast_format)
         if not blast_report.is_hit():
             raise error.NoBlastHit("No blast hit")
 
@@ -360,9 +551,13 @@ class CrisprResultManager():
             raise error.NoHomolog(set(included_genomes).difference(blast_report.organisms))
 
         self.homolog_genes = blast_report.filterGenes(included_genomes)
-        
+        self.gene_index = GeneIndex(self.homolog_genes)
+
+    def annotate_blast_hits(self):
+        """Second step of parseBlast : store on gene coordinates of hits occurences, once homolog genes are loaded and occurences searched
+        """
         for hit in self.hits_collection:
-            hit.storeOnGeneOccurences(self.homolog_genes)
+            hit.storeOnGeneOccurences(self.gene_index)
 
     def filterOnGeneOccurences(self):
         """Filter results to just keep hits with occurences on Gene. Return a new CrisprResultsManager object with a new hits collection.
@@ -371,7 +566,7 @@ class CrisprResultManager():
         :rtype: CrisprResultManager
         """
         new_hit_collection = [hit for hit in self.hits_collection if hit.on_gene_occurences]
-        new_results = CrisprResultManager(self.wrapper, self.taxondb, self.genomedb, self.motif_broker_endpoint, self.tag, self.include_taxon, self.exclude_taxon, self.nb_total_hits, self.nb_treated_hits, new_hit_collection, self.homolog_genes)
+        new_results = CrisprResultManager(self.wrapper, self.taxondb, self.genomedb, self.motif_broker_endpoint, self.tag, self.include_taxon, self.exclude_taxon, self.nb_total_hits, self.nb_treated_hits, new_hit_collection, self.homolog_genes, self.metadata_cache, self.occurence_cache, self.occurence_fetcher)
         return new_results
 
     def generateGeneData(self):
@@ -392,25 +587,115 @@ class CrisprResultManager():
         
         return json
 
-    def serializeResults(self, file, gene = False):
-        o = open(file,"w")
-        o.write("#SgRNA sequence\tOrganism\tFasta sequence reference\tCoordinates")
-        if gene:
-            o.write("\tOn at least 1 homologous gene")
-        o.write("\n")
-        for hit in self.hits_collection:
-            for org in hit.occurences:
-                org_name = self.include_taxon[org]
-                for fasta_seq in hit.occurences[org]: 
-                    for coord in hit.occurences[org][fasta_seq]["coords"]:
-                        o.write(f"{hit.sequence}\t{org_name}\t{fasta_seq}\t{coord['coord']}")
-                        if gene :
-                            if coord["is_on_gene"]:
-                                o.write("\tTrue")
-                            else:
-                                o.write("\tFalse")
-                        o.write("\n")
-        o.close() 
+    def serializeResults(self, file, gene = False, compression = None, all_hits = False, batch_size = ALL_HITS_BATCH_SIZE, len_slice = DEFAULT_CHUNK_SIZE, nb_workers = DEFAULT_WORKERS, treated_rows = None):
+        """Write tsv report with one row by sgRNA coordinate. Rows are written by batches.
+        
+        :param file: Report path, .gz or .zst extension is added if compressed
+        :type file: str
+        :param gene: Add a column telling if coordinate is on an homolog gene, defaults to False
+        :type gene: bool, optional
+        :param compression: gzip, zstd or None for plain text, defaults to None
+        :type compression: str, optional
+        :param all_hits: Also write setCompare hits that are not in hits_collection. Their occurences are searched by batches of batch_size hits, defaults to False
+        :type all_hits: bool, optional
+        :param batch_size: Number of not treated hits searched at once, defaults to ALL_HITS_BATCH_SIZE
+        :type batch_size: int, optional
+        :param len_slice: Length of packet to interrogate couchDB for not treated hits, defaults to 2000
+        :type len_slice: int, optional
+        :param nb_workers: Number of packets requested concurrently for not treated hits, defaults to 4
+        :type nb_workers: int, optional
+        :param treated_rows: Rows to write instead of the ones of hits_collection, like merged shards rows, defaults to None
+        :type treated_rows: Iterable[str], optional
+        :return: Report path
+        :rtype: str
+        """
+        path = tsv_export.output_path(file, compression)
+        with tsv_export.open_text(path, compression) as o:
+            o.write("#SgRNA sequence\tOrganism\tFasta sequence reference\tCoordinates")
+            if gene:
+                o.write("\tOn at least 1 homologous gene")
+            o.write("\n")
+            tsv_export.write_rows(o, treated_rows if treated_rows is not None else self._iter_tsv_rows(self.hits_collection, gene))
+
+            if all_hits:
+                for hits in self.iter_untreated_hits(batch_size):
+                    self._search_hits_occurences(hits, list(self.include_taxon), len_slice, nb_workers)
+                    if gene and self.gene_index:
+                        for hit in hits:
+                            hit.storeOnGeneOccurences(self.gene_index)
+                    tsv_export.write_rows(o, self._iter_tsv_rows(hits, gene))
+        return path
+
+    def write_shard(self, prefix, first_position = 0, gene = False):
+        """Write partial results of hits_collection, when it's a shard of treated hits : <prefix>.tsv with tsv report rows, then <prefix>.json with data entries and data card. Each data entry is given with the number of occurences and the position of its hit, and entries are sorted by them, to be merged with other shards by CSTB.shards.
+
+        :param prefix: Path of partial results files, without extension
+        :type prefix: str
+        :param first_position: Position of the first hit of hits_collection in treated hits, defaults to 0
+        :type first_position: int, optional
+        :param gene: Add a column telling if coordinate is on an homolog gene to tsv rows, defaults to False
+        :type gene: bool, optional
+        """
+        with open(prefix + ".tsv", "w") as o:
+            tsv_export.write_rows(o, self._iter_tsv_rows(self.hits_collection, gene))
+
+        sorted_hits = sorted(enumerate(self.hits_collection), key = lambda item: item[1].number_occurences)
+        data = [[hit.number_occurences, first_position + i, {"sequence" : hit.sequence, "occurences" : hit.list_occ(self.include_taxon)}] for i, hit in sorted_hits]
+        # json is written last and atomically, its presence tells that shard is done
+        with open(prefix + ".json.tmp", "w") as o:
+            json.dump({"first_position" : first_position, "nb_hits" : len(self.hits_collection), "data" : data, "data_card" : self.generate_json_data_card()}, o)
+        os.replace(prefix + ".json.tmp", prefix + ".json")
+
+    def _iter_tsv_rows(self, hits, gene):
+        """Generate tsv report rows of hits
+        
+        :return: Rows ending with a new line
+        :rtype: Iterator[str]
+        """
+        for hit in hits:
+            occurences = hit.occurences
+            for org in occurences:
+                prefix = f"{hit.sequence}\t{self.include_taxon[org]}\t"
+                for fasta_seq, occ in occurences[org].items():
+                    fasta_prefix = f"{prefix}{fasta_seq}\t"
+                    if gene:
+                        for coord in occ["coords"]:
+                            yield f"{fasta_prefix}{coord['coord']}\t{bool(coord['is_on_gene'])}\n"
+                    else:
+                        for coord in occ["coords"]:
+                            yield f"{fasta_prefix}{coord['coord']}\n"
+
+    def iter_untreated_hits(self, batch_size = ALL_HITS_BATCH_SIZE):
+        """Generate hits that were not kept in hits_collection, by batches. They are read again from setCompare result file, or taken from hit_table if set compare was computed in process. Hits don't have their occurences yet.
+        
+        :param batch_size: Number of hits by batch, defaults to ALL_HITS_BATCH_SIZE
+        :type batch_size: int, optional
+        :return: Batches of hits
+        :rtype: Iterator[List[Hit]]
+        """
+        if self.set_compare_file is None:
+            for start in range(self.nb_treated_hits, len(self.hit_table), batch_size):
+                yield self.hit_table.to_hits(self.word_length + 3, start = start, stop = start + batch_size)
+            return
+
+        with open(self.set_compare_file, "r") as filin:
+            if int(set_compare.read_nb_hits(filin)) == 0:
+                return
+            if self.word_length == 20:
+                hits = set_compare.iter_hits_20(filin)
+            else:
+                hits = set_compare.iter_hits_other(filin)
+
+            table = HitTable()
+            for position, hit in enumerate(hits):
+                if position in self.treated_positions:
+                    continue
+                table.append(*hit)
+                if len(table) == batch_size:
+                    yield table.to_hits(self.word_length + 3)
+                    table = HitTable()
+            if len(table):
+                yield table.to_hits(self.word_length + 3)
 
 
         
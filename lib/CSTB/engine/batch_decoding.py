@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Decode many setCompare integer indexes into nucleotide sequences at once, or encode many words into
+indexes. Indexes are base 4 numbers, most significant digit first, each digit being a letter of the
+codec alphabet. Digits are extracted for all indexes together with shifts and masks and mapped to
+letters with a lookup table.
+Gives the same words and indexes as CSTB_core.engine.wordIntegerIndexing.decode and encode.
+"""
+
+import numpy as np
+
+ALPHABETS = {"twobits" : b"ACTG", "pow2" : b"ATCG"}
+
+
+def decode_batch(indexes, word_length, codec = "twobits"):
+    """Decode integer indexes into words
+
+    :param indexes: setCompare indexes
+    :type indexes: Iterable[int] or numpy.ndarray
+    :param word_length: Word length
+    :type word_length: int
+    :param codec: codec used to encode indexes, defaults to "twobits"
+    :type codec: twobits|pow2, optional
+    :raises TypeError: Raise if codec is unknown
+    :raises ValueError: Raise if words are too long to be encoded on 64 bits or if an index is too big for word_length
+    :return: Words, in indexes order
+    :rtype: List[str]
+    """
+    if codec not in ALPHABETS:
+        raise TypeError(f"Unknown codec \"{codec}\"")
+    if word_length > 32:
+        raise ValueError(f"Word can't be decoded, too long ({word_length}> 32).")
+
+    indexes = np.asarray(indexes, dtype = np.uint64)
+    if not indexes.size:
+        return []
+    if word_length < 32 and int(indexes.max()) >> (2 * word_length):
+        raise ValueError(f"Can't decode {int(indexes.max())}. Specified word length {word_length} is too short")
+
+    lookup = np.frombuffer(ALPHABETS[codec], dtype = np.uint8)
+    letters = np.empty((indexes.size, word_length), dtype = np.uint8)
+    mask = np.uint64(3)
+    for i in range(word_length):
+        shift = np.uint64(2 * (word_length - 1 - i))
+        letters[:, i] = lookup[(indexes >> shift) & mask]
+
+    words = letters.tobytes().decode("ascii")
+    return [words[i:i + word_length] for i in range(0, len(words), word_length)]
+
+def encode_batch(words, codec = "twobits"):
+    """Encode words of same length into integer indexes
+
+    :param words: Words, in uppercase letters of codec alphabet
+    :type words: List[str]
+    :param codec: codec used to encode indexes, defaults to "twobits"
+    :type codec: twobits|pow2, optional
+    :raises TypeError: Raise if codec is unknown
+    :raises ValueError: Raise if words don't have the same length, are too long to be encoded on 64 bits or have letters out of codec alphabet
+    :return: Indexes, in words order
+    :rtype: numpy.ndarray[uint64]
+    """
+    if codec not in ALPHABETS:
+        raise TypeError(f"Unknown codec \"{codec}\"")
+    if not words:
+        return np.zeros(0, dtype = np.uint64)
+    word_length = len(words[0])
+    if word_length > 32:
+        raise ValueError(f"Word can't be encoded, too long ({word_length}> 32).")
+
+    if any(len(word) != word_length for word in words):
+        raise ValueError(f"Words to encode don't all have length {word_length}")
+    letters = np.frombuffer("".join(words).encode("ascii"), dtype = np.uint8)
+    digits = np.full(256, 4, dtype = np.uint8)
+    digits[np.frombuffer(ALPHABETS[codec], dtype = np.uint8)] = np.arange(4, dtype = np.uint8)
+    letters = digits[letters].reshape(len(words), word_length)
+    if (letters == 4).any():
+        raise ValueError(f"Words to encode have letters out of {ALPHABETS[codec].decode()}")
+
+    indexes = np.zeros(len(words), dtype = np.uint64)
+    for i in range(word_length):
+        indexes = (indexes << np.uint64(2)) | letters[:, i].astype(np.uint64)
+    return indexes
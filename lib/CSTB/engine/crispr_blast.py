@@ -5,9 +5,11 @@ contains only hits for organism which are in a given list, here the included gen
 hits which have a percentage identity superior to a given percentage identity, by default 70.
 The BlastReport contains a dictionary of organism with references which contains BlastHit object
 This object contains the coordinates of the hit and its length.
+Blastn output is read incrementally, from xml (-outfmt 5) or from tabular (-outfmt 6/7) format.
 """
 
 import argparse
+import bisect
 import pickle
 import re
 import xml.etree.ElementTree as ET
@@ -16,58 +18,108 @@ import logging
 
 REGEX_ID = [re.compile("^GCF_[0-9]{9}.[0-9]{1}$"), re.compile("CP[0-9]{6}.[0-9]{1}")]
 
+# Columns expected in tabular blast output, to use as blastn -outfmt "6 stitle qlen nident length sstart send"
+TABULAR_FIELDS = "stitle qlen nident length sstart send"
+
 #class ResumeSeq():
 
 
 class BlastHit(object):
     """docstring for BlastHit."""
-    def __init__(self, org_uuid, fasta_header, hsp):
+    __slots__ = ("org_uuid", "fasta_header", "start", "end", "len")
+
+    def __init__(self, org_uuid, fasta_header, hit_from, hit_to, align_len):
+        """Initialize a BlastHit from blast hsp values
+
+        :param org_uuid: genome uuid
+        :type org_uuid: str
+        :param fasta_header: fasta subsequence reference
+        :type fasta_header: str
+        :param hit_from: hsp start on subject, 1-based as written by blast
+        :type hit_from: int
+        :param hit_to: hsp end on subject, 1-based as written by blast
+        :type hit_to: int
+        :param align_len: hsp alignment length
+        :type align_len: int
+        """
         self.org_uuid = org_uuid
         self.fasta_header = fasta_header
-        hsp_from = int(hsp.find("Hsp_hit-from").text) - 1
-        hsp_to = int(hsp.find("Hsp_hit-to").text) - 1
+        hsp_from = int(hit_from) - 1
+        hsp_to = int(hit_to) - 1
         self.start = min(hsp_from, hsp_to)
         self.end = max(hsp_from, hsp_to)
-        self.len = int(hsp.find("Hsp_align-len").text)
+        self.len = int(align_len)
 
     #def __repr__(self):
     #    return "\nStart : {}\nEnd : {}\nLength aln : {}".format(self.start, self.end, self.len)
 
 
 class BlastReport(object):
-    """docstring for BlastHit."""
-    def __init__(self, f_name, id_min, genomes_in):
-        tree = ET.parse(f_name)
-        self.root = tree.getroot()
-        self.homolog_genes = self._parse_(id_min, genomes_in) if self.is_hit() else {}
+    """Homolog genes from a blastn output, read as a stream. Only hsps on included genomes and with identity above id_min are kept.
+    Blastn output can be xml (-outfmt 5) or tabular (-outfmt 6 or 7) with TABULAR_FIELDS columns.
+    """
+    def __init__(self, f_name, id_min, genomes_in, blast_format = "xml"):
+        self.hit_found = False
+        if blast_format == "xml":
+            self.homolog_genes = self._parse_xml(f_name, id_min, genomes_in)
+        elif blast_format == "tabular":
+            self.homolog_genes = self._parse_tabular(f_name, id_min, genomes_in)
+        else:
+            raise ValueError(f"Unknown blast format \"{blast_format}\"")
 
     def __getitem__(self, k):
         return [gene for gene in self.homolog_genes if gene.org_uuid == k]
 
-    def _parse_(self, id_min, genomes_in):
+    def _parse_xml(self, f_name, id_min, genomes_in):
+        """Parse blast xml output incrementally. Each Hit element is filtered when it is closed and then dropped from the tree.
+        """
         list_hits = []
-        len_query = int(self.root.find("BlastOutput_query-len").text)
-        for hit in self.root.iter(tag="Hit"):
-            org_uuid = hit.find("Hit_def").text.split("|")[0]
-            fasta_header = hit.find("Hit_def").text.split("|")[1].split(" ")[0] #Maybe have a way to identify this properly ?
-            if org_uuid in genomes_in:
-                #Check hsp and store if %id is superior to id_min
-                for hsp in hit.iter(tag="Hsp"):
-                    if (int(hsp.find("Hsp_identity").text)/ len_query) * 100 > id_min:
-                        # Create a list of BlastHit object for the reference
-                        list_hits.append(BlastHit(org_uuid, fasta_header, hsp))
-        
+        len_query = None
+        self.hit_found = True
+        parents = []
+        for event, elem in ET.iterparse(f_name, events=("start", "end")):
+            if event == "start":
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag == "BlastOutput_query-len":
+                len_query = int(elem.text)
+            elif elem.tag == "Iteration_message":
+                self.hit_found = False
+            elif elem.tag == "Hit":
+                org_uuid, fasta_header = _parse_hit_def(elem.find("Hit_def").text)
+                if org_uuid in genomes_in:
+                    #Check hsp and store if %id is superior to id_min
+                    for hsp in elem.iter(tag="Hsp"):
+                        if (int(hsp.find("Hsp_identity").text)/ len_query) * 100 > id_min:
+                            # Create a list of BlastHit object for the reference
+                            list_hits.append(BlastHit(org_uuid, fasta_header, hsp.find("Hsp_hit-from").text, hsp.find("Hsp_hit-to").text, hsp.find("Hsp_align-len").text))
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+        return list_hits if self.hit_found else []
+
+    def _parse_tabular(self, f_name, id_min, genomes_in):
+        """Parse blast tabular output, with or without comment lines.
+        """
+        list_hits = []
+        with open(f_name) as filin:
+            for line in filin:
+                if line.startswith("#") or not line.strip():
+                    continue
+                self.hit_found = True
+                hit_def, len_query, identity, align_len, hit_from, hit_to = line.rstrip("\n").split("\t")
+                org_uuid, fasta_header = _parse_hit_def(hit_def)
+                if org_uuid in genomes_in and (int(identity) / int(len_query)) * 100 > id_min:
+                    list_hits.append(BlastHit(org_uuid, fasta_header, hit_from, hit_to, align_len))
         return list_hits
 
     def is_hit(self):
         """
         Return true if there are hits else return False
         """
-        msg = self.root.find("./BlastOutput_iterations/Iteration/Iteration_message")
-        if not hasattr(msg, "text"):
-            return True
-        msg = msg.text
-        return False
+        return self.hit_found
     
     @property
     def organisms(self):
@@ -91,4 +143,71 @@ class BlastReport(object):
         if fasta_header:
             return [gene for gene in filtered_genes if gene.fasta_header == fasta_header]
         
-        return filtered_genes
\ No newline at end of file
+        return filtered_genes
+
+
+def _parse_hit_def(hit_def):
+    """Split blast subject definition "genome_uuid|fasta_header description" into genome uuid and fasta header
+    """
+    org_uuid = hit_def.split("|")[0]
+    fasta_header = hit_def.split("|")[1].split(" ")[0] #Maybe have a way to identify this properly ?
+    return org_uuid, fasta_header
+
+
+class GeneIndex(object):
+    """Index of homolog genes by genome and fasta header, to find genes containing sgRNA coordinates with a binary search on gene starts.
+    Genes are identified like in specific gene results, "homolog_gene_<n>" where n is the gene rank among the genes of its genome.
+    """
+    def __init__(self, genes):
+        """Build the index
+
+        :param genes: Homolog genes, in gene identifiers order (see BlastReport.filterGenes)
+        :type genes: List[BlastHit]
+        """
+        self._index = {}
+        nb_homolog = {}
+        by_fasta = {}
+        for gene in genes:
+            nb_homolog[gene.org_uuid] = nb_homolog.get(gene.org_uuid, 0) + 1
+            by_fasta.setdefault((gene.org_uuid, gene.fasta_header), []).append((gene.start, gene.end, f"homolog_gene_{nb_homolog[gene.org_uuid]}"))
+
+        for key, fasta_genes in by_fasta.items():
+            fasta_genes.sort(key=lambda gene:gene[0])
+            starts = [gene[0] for gene in fasta_genes]
+            ends = [gene[1] for gene in fasta_genes]
+            ids = [gene[2] for gene in fasta_genes]
+            # Highest end among genes up to each position, to stop the backward scan as soon as no gene can contain the coordinate
+            max_ends = []
+            for end in ends:
+                max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+            self._index[key] = (starts, ends, max_ends, ids)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def genesContaining(self, org_uuid, fasta_header, start, end):
+        """Give identifiers of genes that contain [start, end] on the given genome fasta subsequence
+
+        :param org_uuid: genome uuid
+        :type org_uuid: str
+        :param fasta_header: fasta subsequence reference
+        :type fasta_header: str
+        :param start: sgRNA start
+        :type start: int
+        :param end: sgRNA end
+        :type end: int
+        :return: Gene identifiers, by gene start
+        :rtype: List[str]
+        """
+        fasta_index = self._index.get((org_uuid, fasta_header))
+        if not fasta_index:
+            return []
+        starts, ends, max_ends, ids = fasta_index
+        genes_ids = []
+        i = bisect.bisect_right(starts, start) - 1
+        while i >= 0 and max_ends[i] >= end:
+            if ends[i] >= end:
+                genes_ids.append(ids[i])
+            i -= 1
+        genes_ids.reverse()
+        return genes_ids
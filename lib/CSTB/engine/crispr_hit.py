@@ -3,16 +3,34 @@
 import CSTB_core.engine.wordIntegerIndexing as decoding
 import logging
 import CSTB.utils.error as error
-import operator
 import re
-import copy
+import sys
+
+REGEX_COORD = re.compile(r"^([+-])\(([0-9]+),([0-9]+)\)$")
 
 class Occurence():
+    """Occurences of a sgRNA in one fasta subsequence of one genome
+
+    :ivar coords: sgRNA coordinates as (strand, start, end), parsed from strings like "+(48781,48803)"
+    :vartype coords: List[Tuple[str, int, int]]
+    :ivar on_gene: Homolog gene ids by position of the coordinate in coords. None until a coordinate is found on gene.
+    :vartype on_gene: Dict { int : List[str] } or None
+    """
+    __slots__ = ("sgRNA", "genome", "fasta_header", "coords", "on_gene")
+
     def __init__(self, sgRNA, genome, fasta_header, coords):
         self.sgRNA = sgRNA
-        self.genome = genome
-        self.fasta_header = fasta_header
+        self.genome = sys.intern(genome)
+        self.fasta_header = sys.intern(fasta_header)
         self.coords = coords
+        self.on_gene = None
+
+    @property
+    def formated_coords(self):
+        """Coordinates as dictionnaries for output, like {"coord" : "+(48781,48803)", "is_on_gene" : ["homolog_gene_1"]}
+        """
+        on_gene = self.on_gene or {}
+        return [{"coord" : formatCoord(coord), "is_on_gene" : on_gene.get(i, [])} for i, coord in enumerate(self.coords)]
 
     def keepOnGene(self, genes):
         """Keep coordinates from occurence that are on corresponding homolog gene. Return None if occurence is not on gene.
@@ -38,28 +56,29 @@ class Occurence():
                 list_new_occurences.append(Occurence(self.sgRNA, self.genome, self.fasta_header, new_coords))
         return list_new_occurences
 
-    def storeOnGene(self, genes):
-        homolog_genes = [ gene for gene in genes if gene.org_uuid == self.genome ]
-        for coord_obj in self.coords:
-            nb_homolog = 0
-            for homolog_gene in homolog_genes:
-                nb_homolog += 1
-                gene_id = f"homolog_gene_{nb_homolog}"
-                if isOnGene(coord_obj["coord"], homolog_gene):
-                    coord_obj["is_on_gene"].append(gene_id)
+    def storeOnGene(self, gene_index):
+        """Store homolog genes that contain each coordinate
+        
+        :param gene_index: Index of homolog genes for included genomes
+        :type gene_index: GeneIndex
+        """
+        if (self.genome, self.fasta_header) not in gene_index:
+            return
+        for i, (strand, start, end) in enumerate(self.coords):
+            genes_ids = gene_index.genesContaining(self.genome, self.fasta_header, start, end)
+            if genes_ids:
+                if self.on_gene is None:
+                    self.on_gene = {}
+                self.on_gene[i] = genes_ids
 
     def updateCoords(self, bp_to_del:int):
-        def replace_coord(regex, op_func, coord, offset):
-            sgrna_start = int(re.search(regex, coord).group(1))
-            new_coord = coord.replace(str(sgrna_start), str(op_func(sgrna_start, offset)))
-            return new_coord
+        """Shorten coordinates of 23-length words to sgRNA length by removing bp_to_del bases on the 5' side : start is moved forward on + strand and end is moved backward on - strand.
 
-        coords_save = copy.deepcopy(self.coords)
-        self.coords = []
-        for coord_obj in coords_save: 
-            coord = coord_obj["coord"]
-            new_coord = replace_coord("[+-]\(([0-9]*),", operator.add, coord, bp_to_del) if coord[0] == "+" else replace_coord(",([0-9]*)", operator.sub, coord, bp_to_del)
-            self.coords.append({"coord":new_coord, "is_on_gene":[]})
+        :param bp_to_del: Number of bases to remove
+        :type bp_to_del: int
+        """
+        self.coords = [(strand, start + bp_to_del, end) if strand == "+" else (strand, start, end - bp_to_del) for strand, start, end in self.coords]
+        self.on_gene = None
 
 
 class Hit():
@@ -79,31 +98,40 @@ class Hit():
     :vartype codec: twobits|pow2
    
     """
+    __slots__ = ("index", "weight", "sequence", "list_occurences", "len_sgrna", "longer_index", "to_request_sequences", "formated_occurences", "_nb_occurences")
     
-    def __init__(self, index, weight, len_sgrna, longer_index = [], codec = "twobits"):
+    def __init__(self, index, weight, len_sgrna, longer_index = [], codec = "twobits", sequence = None, longer_sequences = None):
         """ Initialize an Hit object
         
         :param index: setCompare index
         :type index: int
         :param weight: setCompare weight, correspond to number of sgRNA occurences in all genomes
         :type weight: int
+        :param sequence: Already decoded sequence of index, decoded here if None
+        :type sequence: str, optional
+        :param longer_sequences: Already decoded sequences of longer_index, decoded here if None
+        :type longer_sequences: List[str], optional
         """
         self.index = int(index)
         self.weight = weight
-        self.sequence = self.decode(len_sgrna, codec)
+        self.sequence = sequence if sequence is not None else self.decode(len_sgrna, codec)
         self.list_occurences = []
         #self.on_gene_occurences = []
         self.len_sgrna = len_sgrna
         self.longer_index = longer_index
-        self.to_request_sequences = self.decode_longer(codec) if self.longer_index else [self.sequence]
-        self.on_gene = []
-        self.not_on_gene = []
+        if not self.longer_index:
+            self.to_request_sequences = [self.sequence]
+        else:
+            self.to_request_sequences = longer_sequences if longer_sequences is not None else self.decode_longer(codec)
+        self.formated_occurences = None
+        self._nb_occurences = None
 
     @property
     def occurences(self): #This dictionnary will be {"organism": {"subsequence" : coords[]}}
-        """A way to keep old comportment for the creation of output dictionnaries.
+        """A way to keep old comportment for the creation of output dictionnaries. Built once and kept until occurences change.
         """
-        self._format_occurences()
+        if self.formated_occurences is None:
+            self._format_occurences()
         return self.formated_occurences
 
     def _format_occurences(self):
@@ -112,10 +140,17 @@ class Hit():
             if occ.genome not in occurences: 
                 occurences[occ.genome] = {}
             
-            dic = {'coords' : occ.coords}
+            dic = {'coords' : occ.formated_coords}
             occurences[occ.genome][occ.fasta_header] = dic
             
         self.formated_occurences = occurences
+        self._nb_occurences = sum(len(occurences[genome][subseq]["coords"]) for genome in occurences for subseq in occurences[genome])
+
+    def _invalidate_occurences(self):
+        """Drop formated occurences and occurences count, to be called each time list_occurences or its coordinates change.
+        """
+        self.formated_occurences = None
+        self._nb_occurences = None
 
     def _list_ref(self, org_name):
         """Format occurences for an organism 
@@ -139,11 +174,9 @@ class Hit():
         :return: Total number of hit occurences
         :rtype: int
         """
-        nb_occ = 0
-        for genome in self.occurences:
-            for subseq in self.occurences[genome]:
-                nb_occ += len(self.occurences[genome][subseq]["coords"])
-        return nb_occ
+        if self._nb_occurences is None:
+            self._format_occurences()
+        return self._nb_occurences
 
     def __str__(self):
         return f"index:{self.index}\nweight:{self.weight}\nsequence:{self.sequence}\noccurences:{self.occurences}\nindex_longer:{self.longer_index}\nto_request_sequences:{self.to_request_sequences}"
@@ -151,13 +184,13 @@ class Hit():
     def store_occurences(self, list_couch_doc, genomes_in):
         """Set occurences attributes from couch document
         
-        :param list_couch_doc: couch responses
+        :param list_couch_doc: couch responses, or documents of OccurenceResolver with (strand, start, end) coordinates
         :type couch_doc: List[Dict]
         :param genomes_in: list of genomes uuid
         :type genomes_in: List[str]
         :raises error.ConsistencyError: Raise if at least 1 given genome is not in couch document. 
         """
-        logging.debug(f"Store couch doc\n {list_couch_doc}")
+        logging.debug("Store couch doc\n %s", list_couch_doc)
 
         # If we have more than 1 couch document, merge into one
         if len(list_couch_doc) > 1:
@@ -166,7 +199,7 @@ class Hit():
             couch_doc = list_couch_doc[0]
         
        
-        logging.debug(f"After merge :\n{couch_doc}")
+        logging.debug("After merge :\n%s", couch_doc)
 
         db_genomes = set(couch_doc.keys())
         if not set(genomes_in).issubset(db_genomes):
@@ -174,18 +207,21 @@ class Hit():
 
         for genome in genomes_in:  
             for fasta_header in couch_doc[genome]:
-                formated_coords = []
-                for coord in couch_doc[genome][fasta_header]:
-                    formated_coords.append({"coord":coord, "is_on_gene":[]})
-                self.list_occurences.append(Occurence(self, genome, fasta_header, formated_coords))
+                coords = couch_doc[genome][fasta_header]
+                # Occurence indexes give coordinates already parsed
+                if coords and isinstance(coords[0], str):
+                    coords = [parseCoord(coord) for coord in coords]
+                self.list_occurences.append(Occurence(self.sequence, genome, fasta_header, coords))
 
         if self.longer_index:
             self._update_coords()
+        self._invalidate_occurences()
 
     def _update_coords(self):
         offset = 23 - self.len_sgrna
         for occ in self.list_occurences:
             occ.updateCoords(offset)
+        self._invalidate_occurences()
 
     def merge_occurences(self, list_couchdoc):
         """Merge a list of couch document into one
@@ -228,14 +264,15 @@ class Hit():
         return [decoding.decode(index, len_seq, codec) for index in self.longer_index]
 
 
-    def storeOnGeneOccurences(self, genes):
-        """Fill on gene occurences. From current occurences, just keep the occurences that are on gene with just corresponding coordinates.
+    def storeOnGeneOccurences(self, gene_index):
+        """Fill on gene occurences. For each coordinate of current occurences, store the homolog genes it is on.
         
-        :param genes: List of blast hits corresponding to homolog genes of included genomes.
-        :type genes: List[BlastHit]
+        :param gene_index: Index of homolog genes of included genomes.
+        :type gene_index: GeneIndex
         """
         for occ in self.list_occurences:
-            occ.storeOnGene(genes)
+            occ.storeOnGene(gene_index)
+        self._invalidate_occurences()
 
 def write_to_file(genomes_in, genomes_not_in, dic_hits, pam, non_pam_motif_length, workdir, nb_top, hit_obj, list_ordered):
     """
@@ -270,7 +307,24 @@ def write_to_file(genomes_in, genomes_not_in, dic_hits, pam, non_pam_motif_lengt
         output.write(to_write + '\n')
     output.close()
 
+def parseCoord(coord):
+    """Parse a coordinate string like "+(48781,48803)"
+
+    :param coord: coordinate string
+    :type coord: str
+    :raises ValueError: Raise if coordinate string has not the expected format
+    :return: (strand, start, end)
+    :rtype: Tuple[str, int, int]
+    """
+    regex_coord = REGEX_COORD.match(coord)
+    if not regex_coord:
+        raise ValueError(f"Irregular coordinate \"{coord}\"")
+    return (regex_coord.group(1), int(regex_coord.group(2)), int(regex_coord.group(3)))
+
+def formatCoord(coord):
+    """Format a (strand, start, end) coordinate into a string like "+(48781,48803)"
+    """
+    return f"{coord[0]}({coord[1]},{coord[2]})"
+
 def isOnGene(coord, gene):
-    start = int(re.search("[+-]\(([0-9]*),", coord).group(1))
-    end = int(re.search(",([0-9]*)", coord).group(1))
-    return gene.start <= start and gene.end >= end
\ No newline at end of file
+    return gene.start <= coord[1] and gene.end >= coord[2]
\ No newline at end of file
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Streaming readers for setCompare result files. setCompare writes a short header ending with a
+"# <nb_hits> items set" line, followed by the hits in one of two formats :
+    - 20-length words : one single line of comma-separated index:weight pairs
+    - shorter words : one index:weight[longer_index,...] entry per line, ended by an empty line
+The whole hit list can be huge, so hits are tokenized incrementally from a buffered reader and
+never loaded at once.
+"""
+
+import heapq
+import re
+
+CHUNK_SIZE = 1 << 16
+
+REGEX_NB_HITS = re.compile("^# ([0-9]+)")
+
+
+def read_nb_hits(filin):
+    """Read setCompare header lines until the number of hits line. The file position is left at the beginning of hits.
+
+    :param filin: setCompare result file opened in text mode
+    :type filin: TextIO
+    :raises ValueError: Raise if there is no number of hits line in the header
+    :return: Number of hits as written in setCompare header
+    :rtype: str
+    """
+    while True:
+        line = filin.readline()
+        if not line:
+            raise ValueError("No number of hits line in setCompare header")
+        regex_nb_hits = REGEX_NB_HITS.search(line)
+        if regex_nb_hits:
+            return regex_nb_hits.group(1)
+
+def iter_hits_20(filin, chunk_size = CHUNK_SIZE):
+    """Iterate over hits from the comma-separated line of 20-length words format. The line is read by chunks of chunk_size characters.
+
+    :param filin: setCompare result file opened in text mode, positioned after the header
+    :type filin: TextIO
+    :param chunk_size: Number of characters read at once, defaults to CHUNK_SIZE
+    :type chunk_size: int, optional
+    :return: Generator of (index, weight)
+    :rtype: Iterator[Tuple[int, int]]
+    """
+    remainder = ""
+    while True:
+        chunk = filin.read(chunk_size)
+        end_of_line = not chunk or "\n" in chunk
+        if end_of_line:
+            chunk = chunk.split("\n", 1)[0]
+        tokens = (remainder + chunk).split(",")
+        remainder = "" if end_of_line else tokens.pop()
+        for rank_occ in tokens:
+            if rank_occ:
+                yield _parse_rank_occ(rank_occ)
+        if end_of_line:
+            return
+
+def iter_hits_other(filin):
+    """Iterate over hits from the one hit per line format of shorter words. Stop at the first empty line.
+
+    :param filin: setCompare result file opened in text mode, positioned after the header
+    :type filin: TextIO
+    :return: Generator of (index, weight, longer_index)
+    :rtype: Iterator[Tuple[int, int, List[int]]]
+    """
+    for rank_occ in filin:
+        if rank_occ == "\n":
+            return
+        rank_weight, _, longer = rank_occ.rstrip("]\n").partition("[")
+        index, weight = _parse_rank_occ(rank_weight)
+        yield index, weight, [int(longer_index.replace("'", "")) for longer_index in longer.split(",")]
+
+def top_k(hits, k, key):
+    """Select the k hits with the highest key from a stream of hits, with a heap of at most k hits. Ties are broken by position in stream.
+
+    :param hits: Hits, as generated by iter_hits_20 or iter_hits_other
+    :type hits: Iterator[Tuple]
+    :param k: Number of hits to select, all hits are kept if None or 0
+    :type k: int
+    :param key: Function giving the ranking value of a hit from its fields
+    :type key: Callable
+    :return: Selected (position in stream, hit), ranked by decreasing key then increasing position
+    :rtype: List[Tuple[int, Tuple]]
+    """
+    heap = []
+    for position, hit in enumerate(hits):
+        rank = (key(*hit), -position)
+        if not k or len(heap) < k:
+            heapq.heappush(heap, (rank, hit))
+        elif rank > heap[0][0]:
+            heapq.heapreplace(heap, (rank, hit))
+    return [(-rank[1], hit) for rank, hit in sorted(heap, key = lambda item: item[0], reverse = True)]
+
+def _parse_rank_occ(rank_occ):
+    index, _, weight = rank_occ.partition(":")
+    return int(index), int(weight)
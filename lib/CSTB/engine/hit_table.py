@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Columnar storage of setCompare hits. Indexes, weights and longer indexes of all parsed hits are kept
+in typed arrays, Hit objects are only created for the hits that are treated.
+"""
+
+from array import array
+import numpy as np
+from CSTB.engine.crispr_hit import Hit
+from CSTB.engine.batch_decoding import decode_batch
+
+
+class HitTable():
+    """Columnar table of setCompare hits
+
+    :ivar indexes: setCompare indexes
+    :vartype indexes: array[int]
+    :ivar weights: setCompare weights
+    :vartype weights: array[int]
+    :ivar longer_offsets: Boundaries of each hit longer indexes in longer_indexes. Longer indexes of hit i are longer_indexes[longer_offsets[i]:longer_offsets[i + 1]]
+    :vartype longer_offsets: array[int]
+    :ivar longer_indexes: Concatenated setCompare indexes for 20-length words of all hits
+    :vartype longer_indexes: array[int]
+    """
+    __slots__ = ("indexes", "weights", "longer_offsets", "longer_indexes")
+
+    def __init__(self):
+        self.indexes = array("Q")
+        self.weights = array("Q")
+        self.longer_offsets = array("Q", [0])
+        self.longer_indexes = array("Q")
+
+    @classmethod
+    def from_arrays(cls, indexes, weights, longer_offsets = None, longer_indexes = None):
+        """Create a table from integer arrays, like the ones of set_compare_engine.set_compare()
+
+        :param indexes: setCompare indexes
+        :type indexes: numpy.ndarray
+        :param weights: setCompare weights
+        :type weights: numpy.ndarray
+        :param longer_offsets: Boundaries of each hit longer indexes, defaults to None for 20-length words
+        :type longer_offsets: numpy.ndarray, optional
+        :param longer_indexes: Concatenated longer indexes, defaults to None for 20-length words
+        :type longer_indexes: numpy.ndarray, optional
+        :return: New table
+        :rtype: HitTable
+        """
+        table = cls()
+        table.indexes.frombytes(np.ascontiguousarray(indexes, dtype = np.uint64).tobytes())
+        table.weights.frombytes(np.ascontiguousarray(weights, dtype = np.uint64).tobytes())
+        if longer_offsets is None:
+            table.longer_offsets = array("Q", bytes(8 * (len(indexes) + 1)))
+        else:
+            table.longer_offsets = array("Q", np.ascontiguousarray(longer_offsets, dtype = np.uint64).tobytes())
+            table.longer_indexes.frombytes(np.ascontiguousarray(longer_indexes, dtype = np.uint64).tobytes())
+        return table
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def append(self, index, weight, longer_index = None):
+        """Add a hit at the end of the table
+
+        :param index: setCompare index
+        :type index: int
+        :param weight: setCompare weight
+        :type weight: int
+        :param longer_index: setCompare indexes for 20-length words, defaults to None
+        :type longer_index: List[int], optional
+        """
+        self.indexes.append(index)
+        self.weights.append(weight)
+        if longer_index:
+            self.longer_indexes.extend(longer_index)
+        self.longer_offsets.append(len(self.longer_indexes))
+
+    def slice(self, start = 0, stop = None):
+        """Copy hits of the table from start to stop into a new table
+
+        :param start: Position of first hit, defaults to 0
+        :type start: int, optional
+        :param stop: Position after last hit, defaults to None for the end of table
+        :type stop: int, optional
+        :return: New table
+        :rtype: HitTable
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        offsets = np.frombuffer(self.longer_offsets, dtype = np.uint64)[start:stop + 1]
+        return HitTable.from_arrays(np.frombuffer(self.indexes, dtype = np.uint64)[start:stop], np.frombuffer(self.weights, dtype = np.uint64)[start:stop],
+            offsets - offsets[0], np.frombuffer(self.longer_indexes, dtype = np.uint64)[int(offsets[0]):int(offsets[-1])])
+
+    def longer_index(self, i):
+        """Give setCompare indexes for 20-length words of hit i
+
+        :param i: Hit position in table
+        :type i: int
+        :return: List of longer indexes, empty for 20-length words hits
+        :rtype: List[int]
+        """
+        return self.longer_indexes[self.longer_offsets[i]:self.longer_offsets[i + 1]].tolist()
+
+    def to_hits(self, len_sgrna, codec = "twobits", start = 0, stop = None):
+        """Create Hit objects for hits of the table from start to stop, in table order. Indexes and longer indexes of all hits are decoded in one batch each.
+
+        :param len_sgrna: Length of sgRNA with pam
+        :type len_sgrna: int
+        :param codec: codec used to encode indexes, defaults to "twobits"
+        :type codec: twobits|pow2, optional
+        :param start: Position of first hit, defaults to 0
+        :type start: int, optional
+        :param stop: Position after last hit, defaults to None for the end of table
+        :type stop: int, optional
+        :return: List of Hit objects
+        :rtype: List[Hit]
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return []
+        offsets = self.longer_offsets
+        sequences = decode_batch(np.frombuffer(self.indexes, dtype = np.uint64)[start:stop], len_sgrna, codec)
+        longer_sequences = decode_batch(np.frombuffer(self.longer_indexes, dtype = np.uint64)[offsets[start]:offsets[stop]], 23, codec)
+        first = offsets[start]
+        return [Hit(self.indexes[i], self.weights[i], len_sgrna, longer_index = self.longer_index(i), codec = codec, sequence = sequences[i - start], longer_sequences = longer_sequences[offsets[i] - first:offsets[i + 1] - first]) for i in range(start, stop)]
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Local occurence index of genomes, to resolve sgRNA coordinates without motif-broker requests. Occurences
+of a genome are static, they are exported once by build_occurence_index.py in a directory named after
+the genome uuid :
+    - codes.npy : sorted distinct 23-length words codes, twobits codec
+    - offsets.npy : occurences of codes[i] are records[offsets[i]:offsets[i + 1]]
+    - records.npy : occurences packed on 64 bits as fasta_id << 33 | strand << 32 | start, strand 1 for -
+    - metadata.json : genome uuid, codec, word length and fasta headers by fasta_id
+Arrays are memory-mapped, so that an index is opened without reading it and shared by the processes
+using it. Sequences of a batch are looked up in each genome with one searchsorted. OccurenceResolver
+answers motif-broker documents, with coordinates already parsed as (strand, start, end) tuples, it can
+replace OccurenceFetcher in CrisprResultManager.
+"""
+
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from CSTB.engine.batch_decoding import encode_batch
+from CSTB.engine.crispr_hit import parseCoord
+from CSTB.utils.occurence_fetcher import DEFAULT_CHUNK_SIZE
+
+WORD_LENGTH = 23
+CODEC = "twobits"
+CODES_FILE = "codes.npy"
+OFFSETS_FILE = "offsets.npy"
+RECORDS_FILE = "records.npy"
+METADATA_FILE = "metadata.json"
+STRAND_SHIFT = 32
+FASTA_SHIFT = 33
+START_MASK = (1 << STRAND_SHIFT) - 1
+
+
+def build_occurence_index(documents, genome, location, organism = None):
+    """Export occurences of a genome into its index directory <location>/<genome>. An existing index is replaced.
+
+    :param documents: sgRNA documents, like construct_in pickles or motif-broker documents
+    :type documents: Dict {sequence(str) : {organism(str) : {fasta_header(str) : coords(List[str]) } } }
+    :param genome: Genome uuid, name of index directory
+    :type genome: str
+    :param location: Directory of occurence indexes
+    :type location: str
+    :param organism: Key of the genome in documents, defaults to genome
+    :type organism: str, optional
+    :raises ValueError: Raise if a coordinate is irregular or is not a 23-length word coordinate
+    :return: Index directory
+    :rtype: str
+    """
+    organism = organism if organism else genome
+    fasta_ids = {}
+    sequences = []
+    nb_records = []
+    records = []
+    nb_skipped = 0
+    for sequence, document in documents.items():
+        occurences = document.get(organism)
+        if not occurences:
+            continue
+        if len(sequence) != WORD_LENGTH or sequence.strip("ACGT"):
+            nb_skipped += 1
+            continue
+        nb = 0
+        for fasta_header, coords in occurences.items():
+            fasta_id = fasta_ids.setdefault(fasta_header, len(fasta_ids))
+            for coord in coords:
+                strand, start, end = parseCoord(coord)
+                if end - start != WORD_LENGTH - 1 or start > START_MASK:
+                    raise ValueError(f"Coordinate {coord} of {sequence} is not a {WORD_LENGTH}-length word coordinate")
+                records.append(fasta_id << FASTA_SHIFT | (strand == "-") << STRAND_SHIFT | start)
+            nb += len(coords)
+        sequences.append(sequence)
+        nb_records.append(nb)
+    if nb_skipped:
+        logging.warning(f"{nb_skipped} sequences of {genome} are not {WORD_LENGTH}-length words of ACGT letters, they are not indexed")
+
+    codes = encode_batch(sequences, CODEC)
+    records = np.array(records, dtype = np.uint64)
+    nb_records = np.array(nb_records, dtype = np.int64)
+    starts = np.zeros(len(codes), dtype = np.int64)
+    np.cumsum(nb_records[:-1], out = starts[1:])
+
+    # Sort codes, and records with them
+    order = np.argsort(codes, kind = "stable")
+    codes, starts, nb_records = codes[order], starts[order], nb_records[order]
+    offsets = np.zeros(len(codes) + 1, dtype = np.uint64)
+    np.cumsum(nb_records, out = offsets[1:])
+    records = records[_gather(starts, offsets, nb_records)]
+
+    directory = os.path.join(location, genome)
+    tmp_directory = f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(tmp_directory)
+    np.save(os.path.join(tmp_directory, CODES_FILE), codes)
+    np.save(os.path.join(tmp_directory, OFFSETS_FILE), offsets)
+    np.save(os.path.join(tmp_directory, RECORDS_FILE), records)
+    with open(os.path.join(tmp_directory, METADATA_FILE), "w") as o:
+        json.dump({"genome" : genome, "codec" : CODEC, "word_length" : WORD_LENGTH, "nb_sequences" : len(codes), "nb_occurences" : len(records), "fasta_headers" : list(fasta_ids)}, o)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+    logging.info(f"Occurence index of {genome} : {len(codes)} sequences, {len(records)} occurences in {directory}")
+    return directory
+
+def _gather(starts, offsets, lengths):
+    """Positions of the records of each code, concatenated in codes order
+    """
+    return np.repeat(starts - offsets[:-1].astype(np.int64), lengths) + np.arange(int(offsets[-1]))
+
+
+class GenomeOccurenceIndex():
+    """Memory-mapped occurence index of one genome
+
+    Attributes:
+        genome (str): Genome uuid
+        codes (numpy.ndarray[uint64]): Sorted distinct 23-length words codes
+        offsets (numpy.ndarray[uint64]): Start of each code records, and end of last one
+        records (numpy.ndarray[uint64]): Packed occurences
+        fasta_headers (List[str]): Fasta headers by fasta_id
+    """
+
+    def __init__(self, directory):
+        """Open index directory
+
+        :raises FileNotFoundError: Raise if directory is not an occurence index
+        :raises ValueError: Raise if index words are not encoded like this module
+        """
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        if metadata["codec"] != CODEC or metadata["word_length"] != WORD_LENGTH:
+            raise ValueError(f"Occurence index {directory} has {metadata['word_length']}-length words with {metadata['codec']} codec, expected {WORD_LENGTH} and {CODEC}")
+        self.genome = metadata["genome"]
+        self.fasta_headers = metadata["fasta_headers"]
+        self.codes = np.load(os.path.join(directory, CODES_FILE), mmap_mode = "r")
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode = "r")
+        self.records = np.load(os.path.join(directory, RECORDS_FILE), mmap_mode = "r")
+
+    def lookup(self, codes):
+        """Find records of codes
+
+        :param codes: 23-length words codes
+        :type codes: numpy.ndarray[uint64]
+        :return: Start and end of records of each code, both 0 for codes absent from genome
+        :rtype: Tuple[numpy.ndarray[int64], numpy.ndarray[int64]]
+        """
+        if not len(self.codes):
+            return np.zeros(len(codes), dtype = np.int64), np.zeros(len(codes), dtype = np.int64)
+        positions = np.searchsorted(self.codes, codes)
+        positions[positions == len(self.codes)] = 0
+        found = self.codes[positions] == codes
+        starts = np.where(found, self.offsets[positions], 0).astype(np.int64)
+        ends = np.where(found, self.offsets[positions + 1], 0).astype(np.int64)
+        return starts, ends
+
+    def occurences(self, codes):
+        """Occurences of codes in genome
+
+        :param codes: 23-length words codes
+        :type codes: numpy.ndarray[uint64]
+        :return: Occurences of each code as (fasta_header, strand, start, end), None for codes absent from genome
+        :rtype: List[List[Tuple[str, str, int, int]]]
+        """
+        starts, ends = self.lookup(codes)
+        lengths = ends - starts
+        offsets = np.zeros(len(codes) + 1, dtype = np.uint64)
+        np.cumsum(lengths, out = offsets[1:])
+        records = self.records[_gather(starts, offsets, lengths)]
+        fasta_ids = (records >> np.uint64(FASTA_SHIFT)).tolist()
+        minus = ((records >> np.uint64(STRAND_SHIFT)) & np.uint64(1)).tolist()
+        coord_starts = (records & np.uint64(START_MASK)).tolist()
+
+        results = []
+        position = 0
+        for length in lengths.tolist():
+            if not length:
+                results.append(None)
+                continue
+            results.append([(self.fasta_headers[fasta_ids[i]], "-" if minus[i] else "+", coord_starts[i], coord_starts[i] + WORD_LENGTH - 1)
+                for i in range(position, position + length)])
+            position += length
+        return results
+
+
+class OccurenceResolver():
+    """Local replacement of OccurenceFetcher : motif-broker documents of sgRNAs are made from occurence indexes of genomes, opened at first use and kept for next jobs
+
+    Attributes:
+        location (str): Directory with one occurence index directory by genome uuid
+        genomes (List[str]): Genomes whose occurences are resolved, documents don't have other genomes
+        chunk_size (int): Number of sequences looked up at once
+        nb_requests (int): Number of motif-broker requests, always 0
+        nb_lookups (int): Number of looked up sequences
+        handshaked (bool): True once indexes of genomes are opened
+    """
+
+    def __init__(self, location, genomes = None, chunk_size = DEFAULT_CHUNK_SIZE):
+        self.location = location
+        self.genomes = genomes if genomes is not None else []
+        self.chunk_size = chunk_size
+        self.nb_requests = 0
+        self.nb_lookups = 0
+        self.handshaked = False
+        self._indexes = {}
+
+    def index_directory(self, genome):
+        return os.path.join(self.location, genome)
+
+    def missing(self, genomes):
+        """Genomes without occurence index
+
+        :rtype: List[str]
+        """
+        return [genome for genome in genomes if not os.path.isfile(os.path.join(self.index_directory(genome), METADATA_FILE))]
+
+    def set_genomes(self, genomes):
+        """Resolve occurences of other genomes, their indexes are opened at next handshake
+        """
+        if genomes != self.genomes:
+            self.genomes = genomes
+            self.handshaked = False
+
+    def handshake(self):
+        """Open indexes of genomes, like OccurenceFetcher.handshake() checks that motif-broker can be reached
+
+        :raises FileNotFoundError: Raise if a genome has no occurence index
+        """
+        for genome in self.genomes:
+            if genome not in self._indexes:
+                self._indexes[genome] = GenomeOccurenceIndex(self.index_directory(genome))
+        self.handshaked = True
+
+    def fetch(self, sequences, on_chunk = None):
+        """Get motif-broker documents for sequences, with occurences of genomes. Coordinates are (strand, start, end) tuples instead of strings. Like OccurenceFetcher.fetch(), on_chunk is called with the documents of each chunk.
+
+        :param sequences: 23-length sgRNA sequences
+        :type sequences: List[str]
+        :param on_chunk: Function called with the documents of each chunk, defaults to None
+        :type on_chunk: Callable[[Dict[str, Dict]], None], optional
+        :return: Dict with sequences as keys and motif-broker documents as values. Empty if on_chunk is given.
+        :rtype: Dict[str, Dict]
+        """
+        if not self.handshaked:
+            self.handshake()
+        results = {}
+        for i in range(0, len(sequences), self.chunk_size):
+            chunk = sequences[i:i + self.chunk_size]
+            codes = encode_batch(chunk, CODEC)
+            documents = {seq : {} for seq in chunk}
+            for genome in self.genomes:
+                for seq, occurences in zip(chunk, self._indexes[genome].occurences(codes)):
+                    if occurences:
+                        genome_document = documents[seq][genome] = {}
+                        for fasta_header, strand, start, end in occurences:
+                            genome_document.setdefault(fasta_header, []).append((strand, start, end))
+            self.nb_lookups += len(chunk)
+            if on_chunk:
+                on_chunk(documents)
+            else:
+                results.update(documents)
+        return results
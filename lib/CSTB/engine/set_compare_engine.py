@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+In-process alternative to the setCompare binary. sgRNA sets are computed from the same per-genome
+index files ("# <nb_words> <word_length> <codec>" header, then one "<code> <occurences>" line by 23-length word,
+twobits codec only)
+with vectorized operations on sorted integer arrays :
+    - words present in all included genomes, weighted by their total number of occurences
+    - minus words present in at least one excluded genome
+Shorter words are the last length letters of 23-length words (sgRNA end and pam), so their code is the
+23-length code masked with (1 << 2 * length) - 1. Each shorter word keeps the 23-length words of included
+genomes it comes from.
+Text index files are converted once to NumPy arrays, memory-mapped at load and kept by IndexStore, so
+that several jobs can compute their sets against the same arrays. Results are ordered like setCompare
+output, by decreasing weight then increasing code.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+import numpy as np
+
+FULL_LENGTH = 23
+CODEC = "twobits"
+CODES_SUFFIX = ".codes.npy"
+OCCURENCES_SUFFIX = ".occ.npy"
+DEFAULT_MAX_TRUNCATED = 64
+
+
+def read_index(index_file):
+    """Read a text index file into sorted arrays. Words without occurences column count for one occurence.
+
+    :param index_file: Path to index file
+    :type index_file: str
+    :raises IOError: Raise if header line is irregular
+    :raises ValueError: Raise if words are not encoded with CODEC, shorter words and hits would be decoded wrongly
+    :return: Sorted distinct codes and their number of occurences
+    :rtype: Tuple[numpy.ndarray[uint64], numpy.ndarray[uint64]]
+    """
+    with open(index_file, "rb") as filin:
+        header = filin.readline().decode()
+        if not header.startswith("#") or len(header.split()) != 4:
+            raise IOError(f"Irregular header line in index file \"{header.strip()}\"")
+        codec = header.split()[3]
+        if codec != CODEC:
+            raise ValueError(f"Index file {index_file} is encoded with {codec} codec, only {CODEC} is supported")
+        position = filin.tell()
+        nb_columns = len(filin.readline().split())
+        filin.seek(position)
+        values = np.fromfile(filin, dtype = np.uint64, sep = " ")
+
+    if nb_columns == 2:
+        codes, occurences = values[0::2], values[1::2]
+    else:
+        codes, occurences = values, np.ones(len(values), dtype = np.uint64)
+    return _merge_sorted(codes, occurences)
+
+def _merge_sorted(codes, occurences):
+    """Sort codes and sum occurences of identical codes
+    """
+    order = np.argsort(codes, kind = "stable")
+    codes, occurences = codes[order], occurences[order]
+    distinct_codes, starts = np.unique(codes, return_index = True)
+    if len(distinct_codes) == len(codes):
+        return codes, occurences
+    return distinct_codes, np.add.reduceat(occurences, starts)
+
+def truncate(codes, occurences, length):
+    """Convert 23-length words into their last length letters
+
+    :param codes: 23-length words codes
+    :type codes: numpy.ndarray[uint64]
+    :param occurences: Number of occurences of each word
+    :type occurences: numpy.ndarray[uint64]
+    :param length: Shorter words length, with pam
+    :type length: int
+    :return: Sorted distinct shorter words codes, with the total number of occurences of the 23-length words they come from
+    :rtype: Tuple[numpy.ndarray[uint64], numpy.ndarray[uint64]]
+    """
+    return _merge_sorted(np.asarray(codes) & np.uint64((1 << (2 * length)) - 1), np.asarray(occurences, dtype = np.uint64))
+
+def _find(codes, sorted_codes):
+    """Positions of codes in sorted_codes and mask of found codes
+    """
+    if not len(sorted_codes):
+        return np.zeros(len(codes), dtype = np.int64), np.zeros(len(codes), dtype = bool)
+    positions = np.searchsorted(sorted_codes, codes)
+    positions[positions == len(sorted_codes)] = 0
+    return positions, sorted_codes[positions] == codes
+
+
+class IndexStore():
+    """Per-genome index arrays, memory-mapped from NumPy files converted from text index files at first use
+
+    :ivar location: Directory with index files, named <genome>.<extension>
+    :vartype location: str
+    :ivar extension: Index files extension
+    :vartype extension: str
+    :ivar cache_dir: Directory where converted arrays are written, index files directory if None
+    :vartype cache_dir: str
+    :ivar max_truncated: Number of genome truncations to shorter words kept in memory
+    :vartype max_truncated: int
+    """
+
+    def __init__(self, location, extension = "index", cache_dir = None, max_truncated = DEFAULT_MAX_TRUNCATED):
+        self.location = location
+        self.extension = extension
+        self.cache_dir = cache_dir
+        self.max_truncated = max_truncated
+        self._arrays = {}
+        self._truncated = OrderedDict()
+
+    def index_path(self, genome):
+        return os.path.join(self.location, f"{genome}.{self.extension}")
+
+    def get(self, genome, length = FULL_LENGTH):
+        """Get sorted codes and occurences of a genome words
+
+        :param genome: Genome uuid
+        :type genome: str
+        :param length: Words length with pam, defaults to 23
+        :type length: int, optional
+        :raises FileNotFoundError: Raise if genome has no index file
+        :return: Sorted distinct codes and their number of occurences
+        :rtype: Tuple[numpy.ndarray[uint64], numpy.ndarray[uint64]]
+        """
+        if genome not in self._arrays:
+            self._arrays[genome] = self._load(genome)
+        if length == FULL_LENGTH:
+            return self._arrays[genome]
+
+        key = (genome, length)
+        if key not in self._truncated:
+            self._truncated[key] = truncate(*self._arrays[genome], length)
+            if len(self._truncated) > self.max_truncated:
+                self._truncated.popitem(last = False)
+        self._truncated.move_to_end(key)
+        return self._truncated[key]
+
+    def _load(self, genome):
+        index_file = self.index_path(genome)
+        if not os.path.isfile(index_file):
+            raise FileNotFoundError(f"No index file for {genome} : {index_file}")
+        prefix = os.path.join(self.cache_dir if self.cache_dir else self.location, os.path.basename(index_file))
+        codes_path, occurences_path = prefix + CODES_SUFFIX, prefix + OCCURENCES_SUFFIX
+
+        index_mtime = os.path.getmtime(index_file)
+        if not all(os.path.isfile(path) and os.path.getmtime(path) >= index_mtime for path in (codes_path, occurences_path)):
+            logging.info(f"Convert {index_file} to NumPy arrays")
+            codes, occurences = read_index(index_file)
+            try:
+                _save_array(codes_path, codes)
+                _save_array(occurences_path, occurences)
+            except OSError as e:
+                logging.warning(f"Can't write converted arrays of {index_file} ({e}), they are kept in memory")
+                return codes, occurences
+        return np.load(codes_path, mmap_mode = "r"), np.load(occurences_path, mmap_mode = "r")
+
+def _save_array(path, array):
+    """Write array in NumPy format through a temporary file, so that concurrent readers never load it partially written
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as o:
+        np.save(o, array)
+    os.replace(tmp_path, path)
+
+def set_compare(store, include, exclude, word_length = 20, query_codes = None):
+    """Compute words present in all included genomes and absent from all excluded genomes
+
+    :param store: Index arrays of genomes
+    :type store: IndexStore
+    :param include: Included genomes uuid
+    :type include: List[str]
+    :param exclude: Excluded genomes uuid
+    :type exclude: List[str]
+    :param word_length: sgRNA length without pam, defaults to 20
+    :type word_length: int, optional
+    :param query_codes: 23-length words that results must also come from, like setCompare -s index. Don't count in weights. Defaults to None
+    :type query_codes: numpy.ndarray[uint64], optional
+    :raises ValueError: Raise if there is no included genome
+    :return: indexes and weights in setCompare order, longer indexes offsets and concatenated longer indexes. Longer arrays are None for 20-length words.
+    :rtype: Tuple[numpy.ndarray[uint64], numpy.ndarray[uint64], numpy.ndarray[uint64], numpy.ndarray[uint64]]
+    """
+    if not include:
+        raise ValueError("At least one included genome is needed")
+    length = word_length + 3
+    include_sets = sorted((store.get(genome, length) for genome in include), key = lambda genome_set: len(genome_set[0]))
+    codes, weights = np.array(include_sets[0][0]), np.array(include_sets[0][1], dtype = np.uint64)
+    for other_codes, other_occurences in include_sets[1:]:
+        positions, found = _find(codes, other_codes)
+        codes, weights = codes[found], weights[found] + other_occurences[positions[found]]
+
+    if query_codes is not None:
+        query_codes = truncate(query_codes, np.ones(len(query_codes), dtype = np.uint64), length)[0] if length != FULL_LENGTH else np.unique(query_codes)
+        found = _find(codes, query_codes)[1]
+        codes, weights = codes[found], weights[found]
+
+    for genome in exclude:
+        found = _find(codes, store.get(genome, length)[0])[1]
+        codes, weights = codes[~found], weights[~found]
+
+    order = np.lexsort((codes, -weights.astype(np.int64)))
+    codes, weights = codes[order], weights[order]
+    if length == FULL_LENGTH:
+        return codes, weights, None, None
+
+    longer_codes = np.unique(np.concatenate([store.get(genome)[0] for genome in include]))
+    shorter_codes = longer_codes & np.uint64((1 << (2 * length)) - 1)
+    kept = _find(shorter_codes, np.sort(codes))[1]
+    longer_codes, shorter_codes = longer_codes[kept], shorter_codes[kept]
+    longer_order = np.lexsort((longer_codes, shorter_codes))
+    longer_codes, shorter_codes = longer_codes[longer_order], shorter_codes[longer_order]
+
+    starts = np.searchsorted(shorter_codes, codes, "left")
+    lengths = np.searchsorted(shorter_codes, codes, "right") - starts
+    longer_offsets = np.zeros(len(codes) + 1, dtype = np.uint64)
+    np.cumsum(lengths, out = longer_offsets[1:])
+    gather = np.repeat(starts - longer_offsets[:-1].astype(np.int64), lengths) + np.arange(int(longer_offsets[-1]))
+    return codes, weights, longer_offsets, longer_codes[gather]
@@ -0,0 +1,560 @@
+"""
+Post-processing pipeline of setCompare results : retrieve organisms metadata, parse setCompare results, search sgRNA occurences, parse blast and write results json and tsv report.
+run() can be called once by post_processing.py, or for each job of a long-running worker with a shared PostProcessingContext that keeps connections and caches warm between jobs.
+Each stage is measured, metrics are written in <tag>_metrics.json, even if job fails.
+With a result cache, results of a job already run against the same databases revisions are restored instead of being computed again.
+With shards, treated hits are split and processed in a process pool, or on separate nodes with --shard, then their partial results are merged (see CSTB.shards).
+"""
+
+import logging
+import argparse
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import sys
+from CSTB.crispr_result_manager import CrisprResultManager, RANK_KEYS
+import CSTB.engine.set_compare_engine as set_compare_engine
+from CSTB.engine.set_compare_engine import IndexStore
+from CSTB.engine.occurence_index import OccurenceResolver
+from CSTB.engine.crispr_blast import GeneIndex
+from CSTB.utils.metadata_cache import MetadataCache, DEFAULT_TTL
+from CSTB.utils.occurence_fetcher import OccurenceFetcher, DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS
+from CSTB.utils.occurence_cache import OccurenceCache, DEFAULT_MAX_ENTRIES as OCCURENCE_CACHE_SIZE
+from CSTB.utils.result_cache import ResultCache, DEFAULT_MAX_BYTES as RESULT_CACHE_SIZE, database_revisions, fasta_sequence_hash, job_key
+import CSTB.utils.tsv_export as tsv_export
+import CSTB.shards as shards_merge
+from CSTB.utils.metrics import Metrics, HttpCounter
+from CSTB.utils.profiling import Profiler
+from CSTB.utils.stage_graph import Stage, run_sequence, run_graph
+import CSTB.utils.occurence_fetcher
+import pycouch.wrapper as couch_wrapper
+import CSTB.utils.error as error
+from CSTB.utils.error import empty_exit, error_exit
+
+def args_gestion(argv = None):
+    """
+    Take and treat arguments that user gives in command line, or argv if given
+    """
+    # Argparsing
+    parser = argparse.ArgumentParser(prog = "post_processing.py", description="Post-processing results")
+    parser.add_argument("--exclude", metavar="<str>",
+                        help="The organisms to search exclusion from",
+                        required=True)
+    parser.add_argument("--include", metavar="<str>",
+                        help="The organisms to search inclusion in.",
+                        required=True)
+    parser.add_argument("--couch_endpoint", metavar="<str>",
+                        help="The end point of the taxon and tree database",
+                        required=True)
+    parser.add_argument("--taxon_db", metavar="<str>",
+                        help="The name of the taxon database",
+                        required=True)
+    parser.add_argument("--genome_db", metavar="<str>",
+                        help="The name of the genome database",
+                        required=True)
+    set_compare_source = parser.add_mutually_exclusive_group(required = True)
+    set_compare_source.add_argument("--set_compare", metavar="<path>", help="setCompare result file")
+    set_compare_source.add_argument("--index_dir", metavar="<dir>", help="Directory with genomes <uuid>.index files, to compute setCompare results in process instead of reading --set_compare file")
+    parser.add_argument("--index_cache_dir", metavar="<dir>", help="Directory where NumPy arrays converted from index files are written, defaults to --index_dir")
+    parser.add_argument("--to_keep", metavar="<int>", help="Number of hits to treat, 0 to treat all hits", default=1000, type=int)
+    parser.add_argument("--rank_by", metavar="<str>", help="Treat the best hits by this key, or the first hits of setCompare file with \"file\"", choices=list(RANK_KEYS) + ["file"], default="weight")
+    parser.add_argument("--query_index", metavar="<file>", help="Index file of sgRNAs that hits must come from, like setCompare -s option. Only with --index_dir")
+    parser.add_argument("--length", metavar="<int>", help = "sgRNA length (exclude pam)", required = True, type=int)
+    parser.add_argument("--motif_broker_endpoint", metavar="<url>", help = "Motif broker endpoint", required = True)
+    parser.add_argument("--tag", metavar = "<str>", help = "tag for outputs", required = True)
+    parser.add_argument("--blast", metavar = "<file>", help = "Blast results if specific gene")
+    parser.add_argument("--output", metavar = "<file>", help = "Write results json to this file instead of standard output")
+    parser.add_argument("--tsv_compression", metavar = "<str>", help = "Compress tsv report, .gz or .zst extension is added. zstd needs the zstandard package", choices = ["gzip", "zstd"])
+    parser.add_argument("--tsv_all_hits", help = "Write all setCompare hits in tsv report, not only the treated ones", action = "store_true")
+    parser.add_argument("--blast_format", metavar = "<str>", help = "Blast results format : xml (-outfmt 5) or tabular (-outfmt \"6 stitle qlen nident length sstart send\")", choices = ["xml", "tabular"], default = "xml")
+    parser.add_argument("--p_id", metavar="<float>", help="Identify percentage for blast post-processing", default=70, type=float)
+    parser.add_argument("--mb_chunk_size", metavar="<int>", help="Number of sequences sent in one motif-broker request", default=DEFAULT_CHUNK_SIZE, type=int)
+    parser.add_argument("--mb_workers", metavar="<int>", help="Number of concurrent motif-broker requests", default=DEFAULT_WORKERS, type=int)
+    parser.add_argument("--occurence_index", metavar="<dir>", help="Directory with genomes occurence indexes built by build_occurence_index.py, to resolve sgRNA occurences locally instead of requesting motif-broker. motif-broker is still used if an included genome has no index")
+    parser.add_argument("--occurence_cache", metavar="<file>", help="sqlite file to share motif-broker documents cache across jobs")
+    parser.add_argument("--occurence_cache_size", metavar="<int>", help="Maximum number of motif-broker documents kept in cache", default=OCCURENCE_CACHE_SIZE, type=int)
+    parser.add_argument("--result_cache", metavar="<dir>", help="Directory of results cache shared across jobs, results of a job already run with the same genomes, options and databases revisions are restored from it")
+    parser.add_argument("--result_cache_size", metavar="<int>", help="Maximum size of results cache in bytes", default=RESULT_CACHE_SIZE, type=int)
+    parser.add_argument("--query_fasta", metavar="<file>", help="Fasta file of specific gene query, to identify its results in results cache. Results of jobs with --blast or --query_index are not cached without it")
+    parser.add_argument("--metadata_cache", metavar="<file>", help="sqlite file to share genome and taxon documents cache across jobs")
+    parser.add_argument("--metadata_cache_ttl", metavar="<int>", help="Number of seconds a cached genome or taxon document is used without checking its revision", default=DEFAULT_TTL, type=int)
+    parser.add_argument("--metrics", metavar="<file>", help="Job metrics json file, defaults to <tag>_metrics.json")
+    parser.add_argument("--metrics_prometheus", metavar="<file>", help="Also write job metrics in Prometheus text format, for node_exporter textfile collector")
+    parser.add_argument("--concurrent", help="Run independent stages concurrently : taxon names, setCompare and blast parsing, then occurences search as soon as hits are parsed. Stages metrics then overlap", action="store_true")
+    parser.add_argument("--profile", metavar="<dir>", nargs="?", const="profile", help="Profile each stage with cProfile and tracemalloc, profiles are written in this directory, defaults to profile. Not available with --concurrent")
+    parser.add_argument("--shards", metavar="<int>", help="Split treated hits in this number of shards, whose occurences search, blast annotation and formatting run in a process pool before their partial results are merged", default=1, type=int)
+    parser.add_argument("--shard", metavar="<int>", help="Only process this shard of --shards, from 0, and write its partial results in --shard_dir, to run shards on separate nodes", type=int)
+    parser.add_argument("--merge_shards", help="Write results from the partial results of --shards shards already written in --shard_dir, instead of processing shards", action="store_true")
+    parser.add_argument("--shard_dir", metavar="<dir>", help="Directory of shards partial results, defaults to <tag>_shards")
+    args = parser.parse_args(argv)
+    # Checked before running, not when the tsv report is written at the end of job
+    if args.tsv_compression and not tsv_export.compression_available(args.tsv_compression):
+        parser.error(f"--tsv_compression {args.tsv_compression} needs the zstandard package")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        parser.error(f"--shard must be between 0 and {args.shards - 1}")
+    if args.shard is not None and args.merge_shards:
+        parser.error("--shard and --merge_shards can't be used together")
+    # Only one cProfile profiler can be active at once from python 3.12
+    if args.profile and args.concurrent:
+        parser.error("--profile and --concurrent can't be used together")
+    return args
+
+class PostProcessingContext():
+    """Connections and caches shared by the post-processing jobs of one process. Each one is created at first use for a given configuration and reused by following jobs.
+
+    Attributes:
+        wrappers (Dict[str, pycouch.wrapper.Wrapper]): Pinged pycouch wrappers by couch endpoint
+        metadata_caches (Dict[Tuple, MetadataCache]): Genome and taxon documents caches by couch endpoint, store path and ttl
+        occurence_caches (Dict[Tuple, OccurenceCache]): motif-broker documents caches by store path and size
+        occurence_fetchers (Dict[Tuple, OccurenceFetcher]): motif-broker clients by endpoint, chunk size and number of workers
+        occurence_resolvers (Dict[Tuple, OccurenceResolver]): Local occurence indexes by directory and chunk size
+        index_stores (Dict[Tuple, IndexStore]): Memory-mapped genome indexes by index directory and arrays directory
+        result_caches (Dict[Tuple, ResultCache]): Job results caches by directory and size
+    """
+
+    def __init__(self):
+        self.wrappers = {}
+        self.metadata_caches = {}
+        self.occurence_caches = {}
+        self.occurence_fetchers = {}
+        self.occurence_resolvers = {}
+        self.index_stores = {}
+        self.result_caches = {}
+
+    def get_wrapper(self, couch_endpoint):
+        """Get pycouch wrapper for couch_endpoint, couchDB is only pinged the first time
+
+        :return: pycouch wrapper, None if couchDB can't be pinged
+        :rtype: pycouch.wrapper.Wrapper
+        """
+        if couch_endpoint not in self.wrappers:
+            wrapper = couch_wrapper.Wrapper(couch_endpoint)
+            if not wrapper.couchPing():
+                return None
+            self.wrappers[couch_endpoint] = wrapper
+        return self.wrappers[couch_endpoint]
+
+    def get_metadata_cache(self, wrapper, store_path, ttl):
+        """Get genome and taxon documents cache for the couchDB of wrapper
+        """
+        key = (wrapper.end_point, store_path, ttl)
+        if key not in self.metadata_caches:
+            self.metadata_caches[key] = MetadataCache(wrapper, store_path, ttl)
+        return self.metadata_caches[key]
+
+    def get_occurence_fetcher(self, motif_broker_endpoint, chunk_size, workers):
+        """Get motif-broker client, motif-broker is handshaked at its first request
+        """
+        key = (motif_broker_endpoint, chunk_size, workers)
+        if key not in self.occurence_fetchers:
+            self.occurence_fetchers[key] = OccurenceFetcher(motif_broker_endpoint, chunk_size, workers)
+        return self.occurence_fetchers[key]
+
+    def get_occurence_resolver(self, location, chunk_size):
+        """Get local occurence indexes, genome indexes stay open between jobs
+        """
+        key = (location, chunk_size)
+        if key not in self.occurence_resolvers:
+            self.occurence_resolvers[key] = OccurenceResolver(location, chunk_size = chunk_size)
+        return self.occurence_resolvers[key]
+
+    def get_occurence_cache(self, store_path, revision, max_entries):
+        """Get motif-broker documents cache, set to the current genome database revision
+        """
+        key = (store_path, max_entries)
+        if key not in self.occurence_caches:
+            self.occurence_caches[key] = OccurenceCache(store_path, revision, max_entries)
+        self.occurence_caches[key].revision = revision
+        return self.occurence_caches[key]
+
+    def get_index_store(self, location, cache_dir):
+        """Get genome indexes arrays, kept memory-mapped between jobs
+        """
+        key = (location, cache_dir)
+        if key not in self.index_stores:
+            self.index_stores[key] = IndexStore(location, cache_dir = cache_dir)
+        return self.index_stores[key]
+
+    def get_result_cache(self, directory, max_bytes):
+        """Get job results cache
+        """
+        key = (directory, max_bytes)
+        if key not in self.result_caches:
+            self.result_caches[key] = ResultCache(directory, max_bytes)
+        return self.result_caches[key]
+
+def get_occurence_fetcher(PARAM, context, include):
+    """Get occurence indexes of included genomes if PARAM.occurence_index has them all, else motif-broker client
+
+    :param PARAM: Job arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param context: Connections and caches to reuse
+    :type context: PostProcessingContext
+    :param include: Included genomes uuid
+    :type include: List[str]
+    :rtype: OccurenceResolver or OccurenceFetcher
+    """
+    if PARAM.occurence_index:
+        resolver = context.get_occurence_resolver(PARAM.occurence_index, PARAM.mb_chunk_size)
+        missing = resolver.missing(include)
+        if not missing:
+            resolver.set_genomes(include)
+            return resolver
+        logging.warning(f"No occurence index for {missing}, occurences are requested to motif-broker")
+    return context.get_occurence_fetcher(PARAM.motif_broker_endpoint, PARAM.mb_chunk_size, PARAM.mb_workers)
+
+def result_cache_key(PARAM, wrapper):
+    """Key of job results in results cache, from job arguments and current revisions of taxon and genome databases
+
+    :param PARAM: Job arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param wrapper: pycouch wrapper of couch_endpoint
+    :type wrapper: pycouch.wrapper.Wrapper
+    :return: Key and hashed inputs, (None, None) if job results can't be identified
+    :rtype: Tuple[str, Dict]
+    """
+    if (PARAM.blast or PARAM.query_index) and not PARAM.query_fasta:
+        return None, None
+    include = PARAM.include.split("&")
+    exclude = PARAM.exclude.split("&") if PARAM.exclude else []
+    query_hash = fasta_sequence_hash(PARAM.query_fasta) if PARAM.query_fasta else None
+    options = {"to_keep" : PARAM.to_keep, "rank_by" : PARAM.rank_by, "tsv_all_hits" : PARAM.tsv_all_hits, "set_compare" : "index" if PARAM.index_dir else "file", "blast" : bool(PARAM.blast)}
+    return job_key(include, exclude, PARAM.length, database_revisions(wrapper, [PARAM.taxon_db, PARAM.genome_db]), query_hash, PARAM.p_id, options)
+
+def restore_cached_results(PARAM, result_cache, key):
+    """Write cached results like the job would do : json to standard output or PARAM.output and tsv report to <tag>_results.tsv
+
+    :param PARAM: Job arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param result_cache: Job results cache
+    :type result_cache: ResultCache
+    :param key: Job key, from result_cache_key()
+    :type key: str
+    :return: True if results were cached
+    :rtype: bool
+    """
+    tsv_path = tsv_export.output_path(PARAM.tag + "_results.tsv", PARAM.tsv_compression)
+    if PARAM.output:
+        tmp_output = PARAM.output + ".tmp"
+        with open(tmp_output, "w") as o:
+            restored = result_cache.restore(key, PARAM.tag, o, tsv_path, PARAM.tsv_compression)
+        if restored:
+            os.replace(tmp_output, PARAM.output)
+        else:
+            os.remove(tmp_output)
+        return restored
+    if result_cache.restore(key, PARAM.tag, sys.stdout, tsv_path, PARAM.tsv_compression):
+        sys.stdout.write("\n")
+        return True
+    return False
+
+def run(PARAM, context = None):
+    """Run post-processing for one job. Results json is written to standard output, or to PARAM.output. Like the other steps errors, ends with SystemExit from error.error_exit or error.empty_exit if job fails or has no result. Job metrics are written in any case.
+
+    :param PARAM: Job arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param context: Connections and caches to reuse, a new one is created if None
+    :type context: PostProcessingContext, optional
+    """
+    if context is None:
+        context = PostProcessingContext()
+
+    http = HttpCounter({PARAM.couch_endpoint : "couch", PARAM.motif_broker_endpoint : "motif_broker"})
+    http.install([couch_wrapper.SESSION, CSTB.utils.occurence_fetcher.SESSION])
+    metrics = Metrics(PARAM.tag, http, Profiler(PARAM.profile) if PARAM.profile else None)
+    try:
+        _run(PARAM, context, metrics)
+        metrics.status = "ok"
+    except error.EmptyExit:
+        metrics.status = "empty"
+        raise
+    except BaseException:
+        metrics.status = "error"
+        raise
+    finally:
+        http.uninstall()
+        try:
+            metrics.write_json(PARAM.metrics if PARAM.metrics else f"{PARAM.tag}_metrics.json")
+            if PARAM.metrics_prometheus:
+                metrics.write_prometheus(PARAM.metrics_prometheus)
+        except OSError as e:
+            logging.warning(f"Can't write job metrics : {e}")
+
+def _run(PARAM, context, metrics):
+    """Post-processing stages of run(), measured in metrics
+    """
+
+    #Get genomes uuid from args
+    include = PARAM.include.split("&")
+    exclude = PARAM.exclude.split("&") if PARAM.exclude else []
+
+    logging.debug(PARAM.include)
+    logging.debug(PARAM.exclude)
+
+    logging.info(f"Include genomes : {include} ({len(include)})\nExclude genomes : {exclude} ({len(exclude)})\n")
+
+    #Initialize pycouch wrapper
+    logging.info("= Initialize pycouch wrapper")
+    with metrics.stage("initialize"):
+        wrapper = context.get_wrapper(PARAM.couch_endpoint)
+        if not wrapper:
+            error_exit("Can't ping couch database", PARAM.tag)
+
+        metadata_cache = context.get_metadata_cache(wrapper, PARAM.metadata_cache, PARAM.metadata_cache_ttl)
+        occurence_fetcher = get_occurence_fetcher(PARAM, context, include)
+        results = CrisprResultManager(wrapper, PARAM.taxon_db, PARAM.genome_db, PARAM.motif_broker_endpoint, PARAM.tag, metadata_cache = metadata_cache, occurence_fetcher = occurence_fetcher)
+
+        # Local occurences are not worth caching
+        if PARAM.occurence_cache and not isinstance(occurence_fetcher, OccurenceResolver):
+            try:
+                results.occurence_cache = context.get_occurence_cache(PARAM.occurence_cache, results.genome_db_revision(), PARAM.occurence_cache_size)
+            except:
+                error_exit("Error while open occurence cache", PARAM.tag)
+
+    cached = None
+    # A shard job only writes partial results
+    if PARAM.result_cache and PARAM.shard is None:
+        logging.info("= Search results in result cache")
+        with metrics.stage("result_cache"):
+            try:
+                result_cache = context.get_result_cache(PARAM.result_cache, PARAM.result_cache_size)
+                key, inputs = result_cache_key(PARAM, wrapper)
+            except Exception as e:
+                logging.warning(f"Result cache is not used : {e}")
+                key = None
+            if key and restore_cached_results(PARAM, result_cache, key):
+                logging.info(f"Results restored from result cache entry {key}")
+                metrics.set("result_cache_hit", 1)
+                return
+            metrics.set("result_cache_hit", 0)
+            if key:
+                cached = (result_cache, key, inputs)
+
+    # Caches are shared between jobs of a worker, count this job hits only
+    metadata_start = (metadata_cache.hits, metadata_cache.misses)
+    occurence_start = (results.occurence_cache.hits, results.occurence_cache.misses) if results.occurence_cache else None
+    try:
+        _run_stages(PARAM, results, include, exclude, context, metrics, cached)
+    finally:
+        metrics.set("include_genomes", len(include))
+        metrics.set("exclude_genomes", len(exclude))
+        if results.nb_total_hits is not None:
+            metrics.set("total_hits", int(results.nb_total_hits))
+        metrics.set("treated_hits", len(results.hits_collection))
+        metrics.set("motif_broker_requests", occurence_fetcher.nb_requests)
+        metrics.set("local_occurences", int(isinstance(occurence_fetcher, OccurenceResolver)))
+        metrics.set_cache("metadata_cache", metadata_cache, *metadata_start)
+        if occurence_start:
+            metrics.set_cache("occurence_cache", results.occurence_cache, *occurence_start)
+
+class _Tee():
+    """Text stream writing to several text streams"""
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, text):
+        for stream in self.streams:
+            stream.write(text)
+
+def _exit_with(tag, message, empty_messages = None):
+    """Error handler of a stage : empty_exit with the message of raised exception type in empty_messages, else error_exit with message
+    """
+    def on_error(exception):
+        for exception_type, empty_message in (empty_messages or {}).items():
+            if isinstance(exception, exception_type):
+                empty_exit(empty_message, tag)
+        error_exit(message, tag)
+    return on_error
+
+_SHARD_CONTEXT = None
+
+def process_shard(PARAM, context, include, include_taxon, homolog_genes, occurence_revision, table, first_position, prefix):
+    """Search occurences of a shard of treated hits, annotate them with homolog genes if PARAM.blast and write their partial results with CrisprResultManager.write_shard()
+
+    :param PARAM: Job arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param context: Connections and caches to reuse
+    :type context: PostProcessingContext
+    :param include: Included genomes uuid
+    :type include: List[str]
+    :param include_taxon: Included genomes names by uuid
+    :type include_taxon: Dict[str, str]
+    :param homolog_genes: Homolog genes of blast results
+    :type homolog_genes: List[BlastHit]
+    :param occurence_revision: Genome database revision for occurence cache, not used without PARAM.occurence_cache
+    :type occurence_revision: str
+    :param table: Treated hits of the shard
+    :type table: HitTable
+    :param first_position: Position of the first hit of the shard in treated hits
+    :type first_position: int
+    :param prefix: Path of shard partial results files, without extension
+    :type prefix: str
+    :return: Number of motif-broker requests
+    :rtype: int
+    """
+    occurence_fetcher = get_occurence_fetcher(PARAM, context, include)
+    nb_requests = occurence_fetcher.nb_requests
+    results = CrisprResultManager(None, PARAM.taxon_db, PARAM.genome_db, PARAM.motif_broker_endpoint, PARAM.tag, include_taxon, hits_collection = table.to_hits(PARAM.length + 3), homolog_genes = homolog_genes, occurence_fetcher = occurence_fetcher)
+    if PARAM.occurence_cache and not isinstance(occurence_fetcher, OccurenceResolver):
+        results.occurence_cache = context.get_occurence_cache(PARAM.occurence_cache, occurence_revision, PARAM.occurence_cache_size)
+
+    results.search_occurences(include, PARAM.mb_chunk_size, PARAM.mb_workers)
+    if PARAM.blast:
+        results.gene_index = GeneIndex(homolog_genes)
+        results.annotate_blast_hits()
+    results.write_shard(prefix, first_position, bool(PARAM.blast))
+    return occurence_fetcher.nb_requests - nb_requests
+
+def _pool_process_shard(*args):
+    """process_shard() in a shards pool process, with connections and caches kept for the next shards of the process
+    """
+    global _SHARD_CONTEXT
+    if _SHARD_CONTEXT is None:
+        _SHARD_CONTEXT = PostProcessingContext()
+    return process_shard(args[0], _SHARD_CONTEXT, *args[1:])
+
+def _run_stages(PARAM, results, include, exclude, context, metrics, cached = None):
+    """Run job stages. With cached (result_cache, key, inputs), results are also stored in result cache at the end.
+    """
+    tsv_path = tsv_export.output_path(PARAM.tag + "_results.tsv", PARAM.tsv_compression)
+    # Results json is written to PARAM.output, or to standard output and to this file if results are cached
+    json_path = PARAM.output if PARAM.output else f".{PARAM.tag}_results.json"
+
+    def taxon_names():
+        logging.info("= Interrogate couchDB to retrieve taxon name")
+        results.set_taxon_names(include, exclude)
+
+    def set_compare():
+        if PARAM.index_dir:
+            logging.info("= Compute setCompare")
+            query_codes = set_compare_engine.read_index(PARAM.query_index)[0] if PARAM.query_index else None
+            index_store = context.get_index_store(PARAM.index_dir, PARAM.index_cache_dir)
+            results.compute_set_compare(index_store, include, exclude, PARAM.length, PARAM.to_keep, query_codes)
+        else:
+            logging.info("= Parse setCompare")
+            results.parse_set_compare(PARAM.set_compare, PARAM.length, PARAM.to_keep, PARAM.rank_by)
+        if not results.hits_collection:
+            raise error.NoHit("No hits")
+
+    def search_occurences():
+        logging.info("= Search sgrna occurences in " + ("occurence indexes" if isinstance(results.occurence_fetcher, OccurenceResolver) else "couchDB"))
+        results.search_occurences(include, PARAM.mb_chunk_size, PARAM.mb_workers)
+
+    def load_blast():
+        logging.info("= Parse Blast")
+        results.load_blast(PARAM.blast, PARAM.p_id, include, PARAM.blast_format)
+        metrics.set("homolog_genes", len(results.homolog_genes))
+
+    def serialize_results():
+        logging.info("= Serialize results")
+        gene = True if PARAM.blast else False
+        treated_rows = shards_merge.iter_merged_rows(prefixes) if sharded else None
+        results.serializeResults(PARAM.tag + "_results.tsv", gene, PARAM.tsv_compression, PARAM.tsv_all_hits, len_slice = PARAM.mb_chunk_size, nb_workers = PARAM.mb_workers, treated_rows = treated_rows)
+
+    def write_results():
+        logging.info("= Write results")
+        blast = False
+        if PARAM.blast:
+            blast = True
+        data, data_card = (shards_merge.iter_merged_data(shards), shards_merge.iter_merged_data_card(shards)) if sharded else (None, None)
+        # Results are streamed to standard output as they are written, and teed into the file to cache
+        to_file = PARAM.output or cached
+        tmp_output = json_path + ".tmp"
+        try:
+            with (open(tmp_output, "w") if to_file else contextlib.nullcontext()) as o:
+                if PARAM.output:
+                    results.write_results(o, blast, data, data_card)
+                else:
+                    results.write_results(_Tee(sys.stdout, o) if o else sys.stdout, blast, data, data_card)
+                    sys.stdout.write("\n")
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_output)
+            raise
+        # Removed by cache_results once cached
+        if to_file:
+            os.replace(tmp_output, json_path)
+
+    set_compare_message = "Error while compute setCompare" if PARAM.index_dir else "Error while parse setCompare"
+    stages = [Stage("taxon_names", taxon_names, on_error = _exit_with(PARAM.tag, "Error while set taxon names")),
+        Stage("set_compare", set_compare, on_error = _exit_with(PARAM.tag, set_compare_message, {error.NoHit : "No hits"}))]
+    if PARAM.blast:
+        stages.append(Stage("load_blast", load_blast, on_error = _exit_with(PARAM.tag, "Error while parse blast", {error.NoBlastHit : "No blast hit for your gene.", error.NoHomolog : "Some organisms don't have homolog gene."})))
+
+    sharded = PARAM.shards > 1 or PARAM.shard is not None or PARAM.merge_shards
+    if sharded:
+        shard_dir = PARAM.shard_dir if PARAM.shard_dir else PARAM.tag + "_shards"
+        prefixes = [shards_merge.shard_prefix(shard_dir, PARAM.tag, i, PARAM.shards) for i in range(PARAM.shards)]
+        shards = []
+
+        def run_shards():
+            nb_hits = len(results.hits_collection)
+            revision = results.occurence_cache.revision if results.occurence_cache else None
+            jobs = []
+            for i in range(PARAM.shards):
+                if PARAM.merge_shards or PARAM.shard not in (None, i):
+                    continue
+                start, stop = shards_merge.shard_bounds(nb_hits, PARAM.shards, i)
+                jobs.append((PARAM, include, results.include_taxon, results.homolog_genes, revision, results.hit_table.slice(start, stop), start, prefixes[i]))
+            if jobs:
+                os.makedirs(shard_dir, exist_ok = True)
+            if PARAM.shard is not None:
+                logging.info(f"= Process shard {PARAM.shard} of {PARAM.shards}")
+                nb_requests = [process_shard(PARAM, context, *jobs[0][1:])]
+            elif jobs:
+                logging.info(f"= Process {PARAM.shards} shards")
+                # Shards processes are spawned, not forked from this process and its threads
+                with concurrent.futures.ProcessPoolExecutor(min(PARAM.shards, os.cpu_count() or 1), multiprocessing.get_context("spawn")) as executor:
+                    nb_requests = list(executor.map(_pool_process_shard, *zip(*jobs)))
+            else:
+                nb_requests = []
+            metrics.set("processed_shards", len(jobs))
+            metrics.set("shards_motif_broker_requests", sum(nb_requests))
+            if PARAM.shard is None:
+                logging.info(f"= Merge {PARAM.shards} shards")
+                shards.extend(shards_merge.load_shards(prefixes))
+                shards_merge.check_shards(shards, nb_hits)
+
+        def remove_shards():
+            shards_merge.remove_shards(prefixes)
+            with contextlib.suppress(OSError):
+                os.rmdir(shard_dir)
+
+        # Shards need taxon names for data card and homolog genes, they replace occurences search and blast annotation
+        stages.append(Stage("run_shards", run_shards, [stage.name for stage in stages], _exit_with(PARAM.tag, "Error while process shards")))
+    else:
+        stages.append(Stage("search_occurences", search_occurences, ["set_compare"], _exit_with(PARAM.tag, "Error while search sgRNA occurences in couchDB")))
+        if PARAM.blast:
+            stages.append(Stage("annotate_blast", results.annotate_blast_hits, ["search_occurences", "load_blast"], _exit_with(PARAM.tag, "Error while parse blast")))
+
+    def cache_results():
+        logging.info("= Store results in result cache")
+        result_cache, key, inputs = cached
+        try:
+            result_cache.put(key, json_path, tsv_path, PARAM.tsv_compression, inputs)
+        except OSError as e:
+            logging.warning(f"Can't store results in result cache : {e}")
+        finally:
+            if not PARAM.output:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(json_path)
+
+    # A shard job only writes partial results, they are merged into results by --merge_shards
+    if PARAM.shard is None:
+        last_stages = [stage.name for stage in stages]
+        stages += [Stage("serialize_results", serialize_results, last_stages, _exit_with(PARAM.tag, "Error while serialize results")),
+            Stage("write_results", write_results, ["serialize_results"], _exit_with(PARAM.tag, "Error while format results"))]
+        if cached:
+            stages.append(Stage("cache_results", cache_results, ["write_results"]))
+        # Partial results merged by --merge_shards are kept, they may come from other nodes
+        if sharded and not PARAM.merge_shards:
+            stages.append(Stage("remove_shards", remove_shards, ["write_results"]))
+
+    if PARAM.concurrent:
+        run_graph(stages, metrics.stage)
+    else:
+        run_sequence(stages, metrics.stage)
@@ -0,0 +1,104 @@
+"""
+Sharded post-processing. Treated hits are split in contiguous shards, and each shard searches its hits
+occurences, annotates them with homolog genes and formats its part of results, in a process pool or on
+separate nodes. Partial results of shard i of n are written in <shard_dir>/<tag>.shard-<i>-of-<n>.tsv and
+.json (CrisprResultManager.write_shard()), then merged in hits order so that results are the same as
+without shards :
+    - data entries are sorted by number of occurences, ties in hits order : each shard sorts its entries
+      by (number of occurences, hit position) and sorted shards are merged on the same key
+    - data card organisms, fasta headers and sgRNAs keep their order of first appearance, shards being
+      merged in hits order
+    - tsv rows are concatenated in shards order
+Headers of results, like number_hits, number_treated_hits and genomes metadata, are set by the process that
+merges shards.
+"""
+
+import heapq
+import json
+import os
+
+
+def shard_bounds(nb_hits, nb_shards, index):
+    """Treated hits of a shard, shards sizes differ by one hit at most
+
+    :param nb_hits: Number of treated hits
+    :type nb_hits: int
+    :param nb_shards: Number of shards
+    :type nb_shards: int
+    :param index: Shard index, from 0
+    :type index: int
+    :return: Position of first hit and position after last hit
+    :rtype: Tuple[int, int]
+    """
+    return index * nb_hits // nb_shards, (index + 1) * nb_hits // nb_shards
+
+def shard_prefix(shard_dir, tag, index, nb_shards):
+    """Path of shard partial results files, without extension
+    """
+    return os.path.join(shard_dir, f"{tag}.shard-{index}-of-{nb_shards}")
+
+def load_shards(prefixes):
+    """Load partial results of shards
+
+    :param prefixes: Shards partial results paths, in shards order
+    :type prefixes: List[str]
+    :raises FileNotFoundError: Raise if a shard is not done
+    :return: Partial results of each shard
+    :rtype: List[Dict]
+    """
+    shards = []
+    for prefix in prefixes:
+        with open(prefix + ".json") as f:
+            shards.append(json.load(f))
+    return shards
+
+def check_shards(shards, nb_hits):
+    """Check that shards cover all treated hits, each one once
+
+    :raises ValueError: Raise if shards overlap or miss hits
+    """
+    position = 0
+    for shard in shards:
+        if shard["first_position"] != position:
+            raise ValueError(f"Shards don't cover treated hits, expected a shard starting at {position}, got {shard['first_position']}")
+        position += shard["nb_hits"]
+    if position != nb_hits:
+        raise ValueError(f"Shards have {position} hits, {nb_hits} are treated")
+
+def iter_merged_data(shards):
+    """Data entries of all shards, sorted by number of occurences then hit position
+
+    :rtype: Iterator[Dict]
+    """
+    for _, _, entry in heapq.merge(*(shard["data"] for shard in shards), key = lambda item: (item[0], item[1])):
+        yield entry
+
+def iter_merged_data_card(shards):
+    """Data card of all shards, organism by organism
+
+    :rtype: Iterator[Tuple[str, Dict]]
+    """
+    data_card = {}
+    for shard in shards:
+        for genome_name, organism_card in shard["data_card"].items():
+            merged_card = data_card.setdefault(genome_name, {})
+            for fasta_header, sgrnas in organism_card.items():
+                merged_card.setdefault(fasta_header, {}).update(sgrnas)
+    return iter(data_card.items())
+
+def iter_merged_rows(prefixes):
+    """tsv report rows of all shards, in shards order
+
+    :rtype: Iterator[str]
+    """
+    for prefix in prefixes:
+        with open(prefix + ".tsv") as f:
+            yield from f
+
+def remove_shards(prefixes):
+    """Remove partial results files of shards
+    """
+    for prefix in prefixes:
+        for extension in (".json", ".tsv"):
+            if os.path.exists(prefix + extension):
+                os.remove(prefix + extension)
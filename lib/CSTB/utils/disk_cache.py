@@ -0,0 +1,107 @@
+"""
+On-disk key-value store shared across jobs, backed by sqlite. Values are json-serializable objects.
+Least recently used entries are evicted when the store holds more than max_entries.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class SqliteLRUStore():
+    """Key-value store in a sqlite file, with least recently used eviction
+
+    Attributes:
+        path (str): sqlite file path
+        max_entries (int): Maximum number of entries kept, no limit if None
+    """
+
+    def __init__(self, path, max_entries = None):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout = 30, check_same_thread = False, isolation_level = None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, stored_at REAL, accessed_at REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key):
+        """Get a value and mark it as recently used
+
+        :param key: entry key
+        :type key: str
+        :return: (value, stored_at) or None if key is not in store
+        :rtype: Tuple[Any, float]
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Get several values and mark them as recently used
+
+        :param keys: entries keys
+        :type keys: List[str]
+        :return: Dict with found keys and (value, stored_at) as values
+        :rtype: Dict[str, Tuple[Any, float]]
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                packet = keys[i:i + 500]
+                rows = self.connection.execute(f"SELECT key, value, stored_at FROM cache WHERE key IN ({','.join('?' * len(packet))})", packet).fetchall()
+                for key, value, stored_at in rows:
+                    found[key] = (json.loads(value), stored_at)
+                self.connection.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?", [(now, key) for key, _, _ in rows])
+        return found
+
+    def put(self, key, value):
+        """Store a value
+
+        :param key: entry key
+        :type key: str
+        :param value: json-serializable value
+        :type value: Any
+        """
+        self.put_many({key : value})
+
+    def put_many(self, items):
+        """Store several values, then evict least recently used entries if needed
+
+        :param items: Dict of key and json-serializable values
+        :type items: Dict[str, Any]
+        """
+        now = time.time()
+        with self._lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT OR REPLACE INTO cache (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)", [(key, json.dumps(value), now, now) for key, value in items.items()])
+            self.connection.execute("COMMIT")
+            self._evict()
+
+    def touch(self, key):
+        """Reset storage time of an entry, when its value has been checked as still valid
+
+        :param key: entry key
+        :type key: str
+        """
+        now = time.time()
+        with self._lock:
+            self.connection.execute("UPDATE cache SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+
+    def delete(self, key):
+        with self._lock:
+            self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        nb_entries = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if nb_entries > self.max_entries:
+            self.connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at ASC LIMIT ?)", (nb_entries - self.max_entries,))
+
+    def close(self):
+        self.connection.close()
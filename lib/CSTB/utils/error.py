@@ -16,6 +16,11 @@ class NoHomolog(Exception):
 class NoBlastHit(Exception):
     pass
 
+class NoHit(Exception):
+    """Raise if setCompare gives no hit
+    """
+    pass
+
 class FastaMetadataError(Exception):
     """Raise if fasta metadata has wrong format
     """
@@ -26,6 +31,16 @@ class ArgumentError(Exception):
     """
     pass
 
+class EmptyExit(SystemExit):
+    """Raised by empty_exit() once the emptySearch json is printed : job ends normally without result. Exits with status 0 like sys.exit()
+    """
+    pass
+
+class ErrorExit(SystemExit):
+    """Raised by error_exit() once the error json and traceback are printed : job failed. Also exits with status 0, failure is only told by the printed json
+    """
+    pass
+
 def empty_exit(message, job_number):
     """Print json with emptySearch key and exit
     
@@ -34,7 +49,7 @@ def empty_exit(message, job_number):
     """
     json_dic = {"emptySearch" : message, "tag":job_number}
     print(json.dumps(json_dic))
-    exit()
+    raise EmptyExit()
 
 def error_exit(message, job_number): 
     """Print json with error key, traceback error and exit
@@ -45,4 +60,4 @@ def error_exit(message, job_number):
     json_dic = {"error" : message + f"\n Contact support with the job number {job_number} : cstb-support@ibcp.fr", "tag" : job_number}
     print(json.dumps(json_dic)) #Need to be json dumped
     traceback.print_exc()
-    exit()
\ No newline at end of file
+    raise ErrorExit()
\ No newline at end of file
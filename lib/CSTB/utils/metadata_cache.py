@@ -0,0 +1,174 @@
+"""
+Cache for couchDB metadata documents (genomes and taxons), in front of the pycouch wrapper.
+Documents are memoized in process and can also be kept in an on-disk store shared across jobs.
+A cached document older than ttl seconds is revalidated against its current couchDB revision
+with an _all_docs request, and fetched again only if its revision changed.
+Several documents can be retrieved at once with get_docs, which uses one _all_docs request
+for revalidation and one for missing documents. All requests go through the pycouch wrapper.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+import pycouch.error
+import requests
+from CSTB.utils.disk_cache import SqliteLRUStore
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class MetadataCache():
+    """Cache of couchDB documents
+
+    Attributes:
+        wrapper (pycouch.wrapper.Wrapper): pycouch wrapper to interrogate couchDB
+        store (SqliteLRUStore): On-disk store shared across jobs, None if only in-process memo is used
+        ttl (float): Number of seconds a cached document is used without checking its revision
+        max_entries (int): Maximum number of documents memoized in process and kept on disk
+        hits (int): Number of documents served from cache
+        misses (int): Number of documents fetched from couchDB
+        revalidations (int): Number of revision checks of expired documents
+    """
+
+    def __init__(self, wrapper, store_path = None, ttl = DEFAULT_TTL, max_entries = DEFAULT_MAX_ENTRIES):
+        self.wrapper = wrapper
+        self.store = SqliteLRUStore(store_path, max_entries) if store_path else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get_doc(self, db, doc_id):
+        """Get a couchDB document, from cache if possible
+
+        :param db: database name
+        :type db: str
+        :param doc_id: document id
+        :type doc_id: str
+        :return: couch document, None if it doesn't exist
+        :rtype: Dict
+        """
+        key = f"{db}/{doc_id}"
+        cached = self._memo.get(key)
+        if not cached and self.store is not None:
+            cached = self.store.get(key)
+
+        if cached:
+            doc, stored_at = cached
+            if time.time() - stored_at < self.ttl:
+                self.hits += 1
+                self._memoize(key, doc, stored_at)
+                return doc
+            self.revalidations += 1
+            if self._current_revs(db, [doc_id]).get(doc_id) == doc.get("_rev"):
+                logging.debug(f"Metadata cache : {key} is still at revision {doc.get('_rev')}")
+                self.hits += 1
+                if self.store is not None:
+                    self.store.touch(key)
+                self._memoize(key, doc, time.time())
+                return doc
+
+        self.misses += 1
+        doc = self.wrapper.couchGetDoc(db, doc_id)
+        if doc:
+            self._store(key, doc)
+        return doc
+
+    def get_docs(self, db, doc_ids):
+        """Get several documents of the same database, from cache if possible. Expired cached documents are revalidated with one _all_docs request and all other documents are fetched with one _all_docs?include_docs=true request.
+
+        :param db: database name
+        :type db: str
+        :param doc_ids: documents ids
+        :type doc_ids: List[str]
+        :return: Dict with documents id as keys and couch documents as values. Value is None if document doesn't exist.
+        :rtype: Dict[str, Dict]
+        """
+        docs = {}
+        expired = {}
+        unique_ids = list(OrderedDict.fromkeys(doc_ids))
+        keys = {doc_id : f"{db}/{doc_id}" for doc_id in unique_ids}
+
+        cached = {doc_id : self._memo[keys[doc_id]] for doc_id in unique_ids if keys[doc_id] in self._memo}
+        if self.store is not None:
+            not_memoized = [keys[doc_id] for doc_id in unique_ids if doc_id not in cached]
+            if not_memoized:
+                stored = self.store.get_many(not_memoized)
+                cached.update({doc_id : stored[keys[doc_id]] for doc_id in unique_ids if keys[doc_id] in stored})
+
+        now = time.time()
+        for doc_id, (doc, stored_at) in cached.items():
+            if now - stored_at < self.ttl:
+                self.hits += 1
+                self._memoize(keys[doc_id], doc, stored_at)
+                docs[doc_id] = doc
+            else:
+                expired[doc_id] = doc
+
+        if expired:
+            self.revalidations += len(expired)
+            current_revs = self._current_revs(db, list(expired))
+            for doc_id, doc in expired.items():
+                if current_revs.get(doc_id) == doc.get("_rev"):
+                    self.hits += 1
+                    if self.store is not None:
+                        self.store.touch(keys[doc_id])
+                    self._memoize(keys[doc_id], doc, now)
+                    docs[doc_id] = doc
+
+        missing = [doc_id for doc_id in unique_ids if doc_id not in docs]
+        if missing:
+            self.misses += len(missing)
+            fetched = self._all_docs(db, missing, include_docs = True)
+            for doc_id in missing:
+                row = fetched.get(doc_id)
+                docs[doc_id] = row.get("doc") if row else None
+            self._store_many({keys[doc_id] : docs[doc_id] for doc_id in missing if docs[doc_id]})
+
+        return docs
+
+    def _all_docs(self, db, doc_ids, include_docs = False):
+        """Request _all_docs view for given keys
+
+        :raises pycouch.error.CouchWrapperError: Raise if couchDB answers with an error
+        :return: Dict with documents id as keys and rows as values. Missing and deleted documents are not in dict.
+        :rtype: Dict[str, Dict]
+        """
+        path = f"{db}/_all_docs" + ("?include_docs=true" if include_docs else "")
+        resp = self.wrapper.couchPostRequest(path, {"keys" : doc_ids})
+        if "error" in resp:
+            raise pycouch.error.CouchWrapperError(resp)
+        return {row["id"] : row for row in resp["rows"] if "error" not in row and not row["value"].get("deleted")}
+
+    def _current_revs(self, db, doc_ids):
+        """Get current revisions of several documents, without downloading them
+
+        :return: Dict with documents id as keys and revisions as values. Missing documents are not in dict.
+        :rtype: Dict[str, str]
+        """
+        try:
+            rows = self._all_docs(db, doc_ids)
+        except (requests.RequestException, ValueError, pycouch.error.CouchWrapperError):
+            return {}
+        return {doc_id : row["value"]["rev"] for doc_id, row in rows.items()}
+
+    def _store(self, key, doc):
+        self._store_many({key : doc})
+
+    def _store_many(self, docs):
+        if not docs:
+            return
+        if self.store is not None:
+            self.store.put_many(docs)
+        now = time.time()
+        for key, doc in docs.items():
+            self._memoize(key, doc, now)
+
+    def _memoize(self, key, doc, stored_at):
+        self._memo[key] = (doc, stored_at)
+        self._memo.move_to_end(key)
+        if self.max_entries and len(self._memo) > self.max_entries:
+            self._memo.popitem(last = False)
@@ -0,0 +1,164 @@
+"""
+Per-stage instrumentation of post-processing jobs. Each stage records its wall time, CPU time, process
+peak RSS and the HTTP requests sent to couchDB and motif-broker, counted by response hooks on the
+requests sessions of CSTB clients. Job counters (hits, cache hits and misses) are added by the pipeline.
+Metrics are written as json, and optionally in Prometheus textfile collector format.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from CSTB.utils.profiling import profile_stage
+
+PROMETHEUS_PREFIX = "cstb_post_processing"
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class HttpCounter():
+    """Count requests and bytes exchanged with each service, through response hooks of requests sessions
+
+    Attributes:
+        services (Dict[str, str]): Service names by endpoint, requests to other urls are counted as "other"
+        counts (Dict[str, Dict[str, int]]): requests, bytes_sent and bytes_received by service
+    """
+
+    def __init__(self, services):
+        self.services = services
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    def install(self, sessions):
+        """Add counting hook to sessions
+        """
+        for session in sessions:
+            session.hooks["response"].append(self._hook)
+            self._sessions.append(session)
+
+    def uninstall(self):
+        """Remove counting hook from sessions it was added to
+        """
+        for session in self._sessions:
+            with contextlib.suppress(ValueError):
+                session.hooks["response"].remove(self._hook)
+        self._sessions = []
+
+    def snapshot(self):
+        with self._lock:
+            return {service : dict(counts) for service, counts in self.counts.items()}
+
+    def _hook(self, response, *args, **kwargs):
+        service = next((name for endpoint, name in self.services.items() if endpoint and response.url.startswith(endpoint)), "other")
+        body = response.request.body
+        sent = len(body) if body else 0
+        received = len(response.content) if response.content else 0
+        with self._lock:
+            counts = self.counts.setdefault(service, {"requests" : 0, "bytes_sent" : 0, "bytes_received" : 0})
+            counts["requests"] += 1
+            counts["bytes_sent"] += sent
+            counts["bytes_received"] += received
+
+
+class Metrics():
+    """Metrics of one post-processing job
+
+    Attributes:
+        tag (str): Job tag
+        http (HttpCounter): HTTP requests counter, None to not count requests
+        profiler (Profiler): Profiler of stages, None to not profile them
+        stages (List[Dict]): Measures of each stage, in execution order
+        counters (Dict[str, float]): Job counters, like number of hits
+        status (str): Job end, "ok", "empty" for empty search or "error"
+    """
+
+    def __init__(self, tag, http = None, profiler = None):
+        self.tag = tag
+        self.http = http
+        self.profiler = profiler
+        self.stages = []
+        self.counters = {}
+        self.status = None
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure the stage run in with block, also when it fails. Stage is also profiled if profiler is set, measures then include profiling overhead.
+        """
+        http_start = self.http.snapshot() if self.http else {}
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            with profile_stage(self.profiler, name):
+                yield
+        finally:
+            measure = {"stage" : name, "wall_seconds" : time.perf_counter() - start, "cpu_seconds" : time.process_time() - cpu_start, "peak_rss_bytes" : peak_rss()}
+            if self.http:
+                for service, counts in self.http.snapshot().items():
+                    previous = http_start.get(service, {})
+                    measure[service] = {key : value - previous.get(key, 0) for key, value in counts.items()}
+            self.stages.append(measure)
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def set_cache(self, name, cache, hits_start = 0, misses_start = 0):
+        """Set hits, misses and hit rate of a cache with hits and misses attributes, since given starting values
+        """
+        hits, misses = cache.hits - hits_start, cache.misses - misses_start
+        self.counters[f"{name}_hits"] = hits
+        self.counters[f"{name}_misses"] = misses
+        self.counters[f"{name}_hit_rate"] = hits / (hits + misses) if hits + misses else 0
+
+    def to_dict(self):
+        return {"tag" : self.tag, "status" : self.status,
+            "wall_seconds" : time.perf_counter() - self._start, "cpu_seconds" : time.process_time() - self._cpu_start, "peak_rss_bytes" : peak_rss(),
+            "http" : self.http.snapshot() if self.http else {}, "counters" : self.counters, "stages" : self.stages}
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.to_dict(), indent = 1) + "\n")
+
+    def write_prometheus(self, path):
+        """Write metrics in Prometheus text format, for node_exporter textfile collector
+        """
+        data = self.to_dict()
+        lines = []
+        def gauge(name, value, **labels):
+            labels_text = ",".join(f'{label}="{label_value}"' for label, label_value in {"tag" : self.tag, **labels}.items())
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{labels_text}}} {value}")
+
+        gauge("status", 1, status = data["status"])
+        for key in ("wall_seconds", "cpu_seconds", "peak_rss_bytes"):
+            gauge(key, data[key])
+        for service, counts in data["http"].items():
+            for key, value in counts.items():
+                gauge(f"http_{key}", value, service = service)
+        for name, value in data["counters"].items():
+            gauge(name, value)
+        for measure in data["stages"]:
+            for key, value in measure.items():
+                if key == "stage":
+                    continue
+                if isinstance(value, dict):
+                    for http_key, http_value in value.items():
+                        gauge(f"stage_http_{http_key}", http_value, stage = measure["stage"], service = key)
+                else:
+                    gauge(f"stage_{key}", value, stage = measure["stage"])
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+def _write_atomic(path, content):
+    """Write through a temporary file, so that collectors never read a partial file
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as o:
+        o.write(content)
+    os.replace(tmp_path, path)
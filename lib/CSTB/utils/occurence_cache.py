@@ -0,0 +1,50 @@
+"""
+On-disk cache of motif-broker sgRNA occurence documents, shared across jobs. Documents are keyed by
+sequence and by genome database revision, so that adding or updating genomes invalidates them.
+"""
+
+from CSTB.utils.disk_cache import SqliteLRUStore
+
+DEFAULT_MAX_ENTRIES = 1000000
+
+
+class OccurenceCache():
+    """Cache of motif-broker documents
+
+    Attributes:
+        store (SqliteLRUStore): On-disk store
+        revision (str): Genome database revision the documents belong to
+        hits (int): Number of documents served from cache
+        misses (int): Number of documents not in cache
+    """
+
+    def __init__(self, store_path, revision, max_entries = DEFAULT_MAX_ENTRIES):
+        self.store = SqliteLRUStore(store_path, max_entries)
+        self.revision = revision
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, sequence):
+        return f"{self.revision}:{sequence}"
+
+    def get_many(self, sequences):
+        """Get cached documents
+
+        :param sequences: sgRNA sequences
+        :type sequences: List[str]
+        :return: Dict with found sequences as keys and motif-broker documents as values
+        :rtype: Dict[str, Dict]
+        """
+        stored = self.store.get_many([self._key(seq) for seq in sequences])
+        found = {seq : stored[self._key(seq)][0] for seq in sequences if self._key(seq) in stored}
+        self.hits += len(found)
+        self.misses += len(sequences) - len(found)
+        return found
+
+    def put_many(self, documents):
+        """Store motif-broker documents
+
+        :param documents: Dict with sequences as keys and motif-broker documents as values
+        :type documents: Dict[str, Dict]
+        """
+        self.store.put_many({self._key(seq) : doc for seq, doc in documents.items()})
@@ -0,0 +1,124 @@
+"""
+Retrieve sgRNA occurences from motif-broker. Sequences are sent by chunks, several chunks are requested
+concurrently over a shared keep-alive session and each chunk is retried with exponential backoff.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+import CSTB.utils.error as error
+
+DEFAULT_CHUNK_SIZE = 2000
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 1
+
+SESSION = requests.Session()
+SESSION.trust_env = False
+
+# Connection pools mounted on SESSION by endpoint, shared by all fetchers of the endpoint
+_ADAPTERS = {}
+_ADAPTERS_LOCK = threading.Lock()
+
+
+def _mount_adapter(endpoint, workers):
+    """Mount a connection pool of at least workers connections for endpoint on SESSION. The pool of an endpoint is only replaced by a bigger one, fetchers with less workers keep using it.
+
+    :return: Connection pool of endpoint
+    :rtype: requests.adapters.HTTPAdapter
+    """
+    with _ADAPTERS_LOCK:
+        pool_size = max(workers, 1)
+        adapter, adapter_size = _ADAPTERS.get(endpoint, (None, 0))
+        if adapter_size < pool_size:
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+            SESSION.mount(endpoint, adapter)
+            _ADAPTERS[endpoint] = (adapter, pool_size)
+        return adapter
+
+
+class OccurenceFetcher():
+    """Chunked and concurrent client for motif-broker bulk requests
+
+    Attributes:
+        motif_broker_endpoint (str): motif-broker endpoint
+        chunk_size (int): Number of sequences sent in one request
+        workers (int): Number of concurrent requests
+        max_retries (int): Number of retries of a failing chunk before giving up
+        backoff (float): Waiting time before first retry in seconds, doubled at each retry
+        nb_requests (int): Number of bulk requests sent
+        handshaked (bool): True once motif-broker has answered handshake
+    """
+
+    def __init__(self, motif_broker_endpoint, chunk_size = DEFAULT_CHUNK_SIZE, workers = DEFAULT_WORKERS, max_retries = DEFAULT_MAX_RETRIES, backoff = DEFAULT_BACKOFF):
+        self.motif_broker_endpoint = motif_broker_endpoint
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.nb_requests = 0
+        self.handshaked = False
+        self._lock = threading.Lock()
+        _mount_adapter(motif_broker_endpoint, workers)
+
+    def handshake(self):
+        """Check that motif-broker can be reached
+
+        :raises error.PingError: Raise when motif-broker can't be reach
+        """
+        try:
+            SESSION.get(self.motif_broker_endpoint + "/handshake")
+        except requests.RequestException:
+            raise error.PingError(f"Can't handshake motif-broker at {self.motif_broker_endpoint}")
+        self.handshaked = True
+
+    def fetch(self, sequences, on_chunk = None):
+        """Get motif-broker documents for sequences. Chunks are requested concurrently and on_chunk is called in the calling thread as soon as each chunk is received.
+
+        :param sequences: sgRNA sequences
+        :type sequences: List[str]
+        :param on_chunk: Function called with the documents of each received chunk, defaults to None
+        :type on_chunk: Callable[[Dict[str, Dict]], None], optional
+        :return: Dict with sequences as keys and motif-broker documents as values. Empty if on_chunk is given, documents are only passed to on_chunk.
+        :rtype: Dict[str, Dict]
+        """
+        chunks = [sequences[i:i + self.chunk_size] for i in range(0, len(sequences), self.chunk_size)]
+        logging.debug(f"Request motif-broker for {len(sequences)} sequences in {len(chunks)} chunks")
+        results = {}
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            futures = [executor.submit(self._request_chunk, chunk) for chunk in chunks]
+            try:
+                for future in as_completed(futures):
+                    chunk_results = future.result()
+                    if on_chunk:
+                        on_chunk(chunk_results)
+                    else:
+                        results.update(chunk_results)
+            except:
+                for future in futures:
+                    future.cancel()
+                raise
+        return results
+
+    def _request_chunk(self, chunk):
+        """Send one bulk request, retried with exponential backoff
+
+        :raises error.PingError: Raise if chunk still fails after max_retries retries
+        """
+        attempt = 0
+        while True:
+            try:
+                with self._lock:
+                    self.nb_requests += 1
+                resp = SESSION.post(self.motif_broker_endpoint + "/bulk_request", json = {"keys" : chunk})
+                resp.raise_for_status()
+                return resp.json()["request"]
+            except (requests.RequestException, ValueError, KeyError) as e:
+                if attempt >= self.max_retries:
+                    raise error.PingError(f"Can't interrogate motif-broker at {self.motif_broker_endpoint} after {self.max_retries} retries : {e}")
+                wait = self.backoff * 2 ** attempt
+                logging.warning(f"motif-broker request failed ({e}), retry in {wait}s")
+                time.sleep(wait)
+                attempt += 1
@@ -0,0 +1,97 @@
+"""
+Opt-in profiling of pipeline stages, to investigate slow or memory-hungry jobs from their own inputs.
+Each stage is run under cProfile, its statistics are dumped in pstats format (readable with pstats,
+snakeviz, gprof2dot or flameprof), and tracemalloc snapshots taken before and after the stage give its
+peak traced memory and top allocation sites. Only the thread running the stage is profiled by cProfile,
+motif-broker requests threads are not. Stages must be profiled one at a time : from python 3.12, enabling
+a cProfile profiler while another one is active raises ValueError, so post_processing refuses --profile
+with --concurrent.
+Without profiler, profile_stage() is a null context, so that disabled profiling costs nothing.
+"""
+
+import cProfile
+import contextlib
+import os
+import re
+import threading
+import tracemalloc
+
+DEFAULT_TOP = 30
+DEFAULT_NFRAMES = 10
+
+
+class Profiler():
+    """Profiles of pipeline stages, written in a directory
+
+    Attributes:
+        directory (str): Directory where profiles are written, created at first stage
+        top (int): Number of allocation sites reported by stage
+        nframes (int): Number of frames stored by tracemalloc for each allocation
+        nb_stages (int): Number of profiled stages, used to number profile files in stages order
+    """
+
+    def __init__(self, directory, top = DEFAULT_TOP, nframes = DEFAULT_NFRAMES):
+        self.directory = directory
+        self.top = top
+        self.nframes = nframes
+        self.nb_stages = 0
+        self._lock = threading.Lock()
+        self._active = 0
+        self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Profile the stage run in with block. Writes <nb>_<name>.pstats and <nb>_<name>.alloc.txt.
+        """
+        os.makedirs(self.directory, exist_ok = True)
+        file_name = re.sub(r"[^\w.-]", "_", name)
+        with self._lock:
+            self.nb_stages += 1
+            prefix = os.path.join(self.directory, f"{self.nb_stages:02d}_{file_name}")
+            # Tracing is started by first active stage and stopped by last one
+            if not self._active:
+                self._started_tracing = not tracemalloc.is_tracing()
+                if self._started_tracing:
+                    tracemalloc.start(self.nframes)
+            self._active += 1
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                self._active -= 1
+                if not self._active and self._started_tracing:
+                    tracemalloc.stop()
+            profile.dump_stats(prefix + ".pstats")
+            self._write_allocations(prefix + ".alloc.txt", name, before, after, current, peak)
+
+    def _write_allocations(self, path, name, before, after, current, peak):
+        ignored = [tracemalloc.Filter(False, path) for path in (tracemalloc.__file__, cProfile.__file__, contextlib.__file__, __file__)]
+        before, after = before.filter_traces(ignored), after.filter_traces(ignored)
+        with open(path, "w") as o:
+            o.write(f"Stage {name}\nPeak traced memory : {peak / 1e6:.3f} MB\nTraced memory at end : {current / 1e6:.3f} MB\n")
+            o.write(f"\nTop {self.top} allocation sites by memory still allocated at end of stage\n")
+            for stat in after.compare_to(before, "lineno")[:self.top]:
+                o.write(f"{stat}\n")
+            o.write(f"\nTop {self.top} allocation tracebacks\n")
+            for stat in after.compare_to(before, "traceback")[:self.top]:
+                o.write(f"\n{stat}\n")
+                for line in stat.traceback.format():
+                    o.write(f"{line}\n")
+
+def profile_stage(profiler, name):
+    """Profile stage with profiler if it's set
+
+    :param profiler: Stages profiler, None if profiling is disabled
+    :type profiler: Profiler
+    :param name: Stage name
+    :type name: str
+    :return: Context manager profiling the stage, or doing nothing
+    """
+    return profiler.stage(name) if profiler else contextlib.nullcontext()
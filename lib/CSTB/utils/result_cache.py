@@ -0,0 +1,186 @@
+"""
+Content-addressed cache of complete job results, shared across jobs. A job is identified by a hash of
+what its results depend on : sorted included and excluded genomes, sgRNA length, specific gene query and
+identity percentage, post-processing options and revisions of taxon and genome databases, so that adding
+or updating genomes gives new keys. Results json and tsv report of a job are stored gzip-compressed in
+<directory>/<key[:2]>/<key>, with the hashed inputs in key.json. Reading an entry updates its modification
+time, and least recently used entries are evicted when the cache is bigger than max_bytes.
+Results json holds the job tag, it's replaced by the tag of the job that reads it.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import CSTB.utils.tsv_export as tsv_export
+
+VERSION = 1
+DEFAULT_MAX_BYTES = 1 << 30
+JSON_FILE = "results.json.gz"
+TSV_FILE = "results.tsv.gz"
+KEY_FILE = "key.json"
+
+
+def sequence_hash(sequence):
+    """Hash of a nucleotide sequence, whatever its case and line breaks
+    """
+    return hashlib.sha256("".join(sequence.split()).upper().encode()).hexdigest()
+
+def fasta_sequence_hash(fasta_file):
+    """Hash of the sequence of a single sequence fasta file
+    """
+    with open(fasta_file) as f:
+        return sequence_hash("".join(line for line in f if not line.startswith(">")))
+
+def database_revisions(wrapper, databases):
+    """Get current revision of couch databases
+
+    :param wrapper: pycouch wrapper
+    :type wrapper: pycouch.wrapper.Wrapper
+    :param databases: Databases names
+    :type databases: List[str]
+    :return: Update sequence by database name
+    :rtype: Dict[str, str]
+    """
+    return {database : str(wrapper.couchGetRequest(database)["update_seq"]) for database in databases}
+
+def job_key(include, exclude, length, revisions, query_hash = None, p_id = None, options = None):
+    """Key of job results
+
+    :param include: Included genomes uuid
+    :type include: List[str]
+    :param exclude: Excluded genomes uuid
+    :type exclude: List[str]
+    :param length: sgRNA length without pam
+    :type length: int
+    :param revisions: Revisions of databases results come from, by database name
+    :type revisions: Dict[str, str]
+    :param query_hash: Hash of specific gene query, defaults to None
+    :type query_hash: str, optional
+    :param p_id: Identity percentage of homolog genes, only used with query_hash, defaults to None
+    :type p_id: float, optional
+    :param options: Other options that change results, defaults to None
+    :type options: Dict, optional
+    :return: Key and hashed inputs
+    :rtype: Tuple[str, Dict]
+    """
+    inputs = {"version" : VERSION, "include" : sorted(include), "exclude" : sorted(exclude), "length" : int(length), "revisions" : revisions,
+        "query" : query_hash, "p_id" : float(p_id) if query_hash and p_id is not None else None, "options" : options if options else {}}
+    return hashlib.sha256(json.dumps(inputs, sort_keys = True).encode()).hexdigest(), inputs
+
+
+class ResultCache():
+    """On-disk cache of job results
+
+    Attributes:
+        directory (str): Cache directory
+        max_bytes (int): Maximum size of stored entries, no limit if None
+        hits (int): Number of restored results
+        misses (int): Number of results not in cache
+    """
+
+    def __init__(self, directory, max_bytes = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok = True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def restore(self, key, tag, stream, tsv_path, tsv_compression = None):
+        """Write cached results json to stream and tsv report to tsv_path, marking entry as recently used
+
+        :param key: Job key, from job_key()
+        :type key: str
+        :param tag: Tag of the job, replaces cached one in results json
+        :type tag: str
+        :param stream: Text stream to write json to
+        :type stream: TextIO
+        :param tsv_path: tsv report path
+        :type tsv_path: str
+        :param tsv_compression: tsv report compression, gzip, zstd or None, defaults to None
+        :type tsv_compression: str, optional
+        :return: True if results were cached and written
+        :rtype: bool
+        """
+        entry = self.entry_path(key)
+        try:
+            os.utime(entry)
+            with gzip.open(os.path.join(entry, JSON_FILE), "rt") as f:
+                results = json.load(f)
+            with gzip.open(os.path.join(entry, TSV_FILE), "rt") as f, tsv_export.open_text(tsv_path, tsv_compression) as o:
+                shutil.copyfileobj(f, o)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't read cached results {entry} ({e}), they are removed")
+            shutil.rmtree(entry, ignore_errors = True)
+            self.misses += 1
+            return False
+
+        results["tag"] = tag
+        stream.write(json.dumps(results))
+        self.hits += 1
+        return True
+
+    def put(self, key, json_path, tsv_path, tsv_compression = None, inputs = None):
+        """Store job results, then evict least recently used entries if cache is too big. An entry already stored by another job is kept.
+
+        :param key: Job key, from job_key()
+        :type key: str
+        :param json_path: Results json file
+        :type json_path: str
+        :param tsv_path: tsv report path
+        :type tsv_path: str
+        :param tsv_compression: tsv report compression, gzip, zstd or None, defaults to None
+        :type tsv_compression: str, optional
+        :param inputs: Hashed inputs, written in entry for inspection, defaults to None
+        :type inputs: Dict, optional
+        """
+        entry = self.entry_path(key)
+        tmp_entry = f"{entry}.{os.getpid()}.tmp"
+        os.makedirs(tmp_entry)
+        try:
+            with open(json_path, "rb") as f, gzip.open(os.path.join(tmp_entry, JSON_FILE), "wb") as o:
+                shutil.copyfileobj(f, o)
+            with tsv_export.open_text_reader(tsv_path, tsv_compression) as f, gzip.open(os.path.join(tmp_entry, TSV_FILE), "wt") as o:
+                shutil.copyfileobj(f, o)
+            with open(os.path.join(tmp_entry, KEY_FILE), "w") as o:
+                json.dump(inputs if inputs else {}, o)
+            os.replace(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors = True)
+            if not os.path.isdir(entry):
+                raise
+        self._evict()
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name.endswith(".tmp"):
+                    continue
+                entry = os.path.join(prefix_dir, name)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, file_name)) for file_name in os.listdir(entry))
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except OSError: # Evicted by another job
+                    continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info(f"Evict cached results {entry}")
+            shutil.rmtree(entry, ignore_errors = True)
+            total -= size
@@ -0,0 +1,105 @@
+"""
+Pipeline stages run in sequence, or as a dependency graph where independent stages overlap in a thread
+pool (network waits of one stage with local parsing of another).
+Stages are given in their sequential order, and a stage can only depend on previous ones. Failures keep
+sequential semantics : once a stage fails, only stages before it are still started, and the error
+handler of the first failed stage in sequential order is called, like if stages had run one after the other.
+"""
+
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage():
+    """A pipeline stage
+
+    Attributes:
+        name (str): Stage name
+        work (Callable[[], None]): Stage function
+        after (List[str]): Names of stages that must be done before this one
+        on_error (Callable[[BaseException], None]): Called in except block when work raises, usually exits with error.error_exit or error.empty_exit. Exception is raised again if it returns.
+    """
+
+    def __init__(self, name, work, after = None, on_error = None):
+        self.name = name
+        self.work = work
+        self.after = after if after is not None else []
+        self.on_error = on_error
+
+def _measured(stage, measure):
+    return measure(stage.name) if measure else contextlib.nullcontext()
+
+def _handle_error(stage, exception):
+    try:
+        raise exception
+    except BaseException as e:
+        if stage.on_error:
+            stage.on_error(e)
+        raise
+
+def run_sequence(stages, measure = None):
+    """Run stages one after the other
+
+    :param stages: Stages in execution order
+    :type stages: List[Stage]
+    :param measure: Context manager factory called with stage name around each stage, like Metrics.stage, defaults to None
+    :type measure: Callable[[str], ContextManager], optional
+    """
+    for stage in stages:
+        try:
+            with _measured(stage, measure):
+                stage.work()
+        except BaseException as e:
+            _handle_error(stage, e)
+
+def run_graph(stages, measure = None, max_workers = None):
+    """Run each stage as soon as the stages it depends on are done, independent stages concurrently
+
+    :param stages: Stages in sequential order
+    :type stages: List[Stage]
+    :param measure: Context manager factory called with stage name around each stage, like Metrics.stage, defaults to None
+    :type measure: Callable[[str], ContextManager], optional
+    :param max_workers: Number of stages run at the same time, defaults to None for number of stages
+    :type max_workers: int, optional
+    :raises ValueError: Raise if a stage depends on a stage not given before it
+    """
+    position = {}
+    for i, stage in enumerate(stages):
+        unknown = [name for name in stage.after if name not in position]
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on {unknown}, which are not previous stages")
+        position[stage.name] = i
+
+    def run_stage(stage):
+        with _measured(stage, measure):
+            stage.work()
+
+    pending = list(stages)
+    done = set()
+    failures = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers = max_workers if max_workers else max(len(stages), 1)) as executor:
+        while True:
+            # After a failure, stages after it in sequential order would not have run
+            limit = min(failures, default = len(stages))
+            for stage in [stage for stage in pending if position[stage.name] < limit and all(name in done for name in stage.after)]:
+                pending.remove(stage)
+                running[executor.submit(run_stage, stage)] = stage
+            if not running:
+                break
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                if future.cancelled():
+                    continue
+                if future.exception() is not None:
+                    failures[position[stage.name]] = (stage, future.exception())
+                    # Stages after it that are submitted but not started yet, when workers are fewer than stages
+                    for other_future, other in running.items():
+                        if position[other.name] > position[stage.name]:
+                            other_future.cancel()
+                else:
+                    done.add(stage.name)
+
+    if failures:
+        _handle_error(*failures[min(failures)])
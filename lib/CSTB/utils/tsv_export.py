@@ -0,0 +1,96 @@
+"""
+Write tsv reports by batches of rows, as plain text or compressed with gzip or zstd, and open them back for reading.
+zstd compression needs the zstandard package.
+"""
+
+import gzip
+import importlib.util
+import io
+
+COMPRESSIONS = {None : "", "gzip" : ".gz", "zstd" : ".zst"}
+ROWS_BATCH_SIZE = 4096
+
+
+def output_path(path, compression = None):
+    """Give report path with the extension of compression
+
+    :param path: Uncompressed report path
+    :type path: str
+    :param compression: gzip, zstd or None for plain text, defaults to None
+    :type compression: str, optional
+    :return: path with .gz or .zst extension if compressed
+    :rtype: str
+    """
+    return path + COMPRESSIONS[compression]
+
+def compression_available(compression):
+    """Tell if reports can be compressed with compression, zstd needs the zstandard package
+
+    :param compression: gzip, zstd or None for plain text
+    :type compression: str
+    :rtype: bool
+    """
+    if compression == "zstd":
+        return importlib.util.find_spec("zstandard") is not None
+    return compression in COMPRESSIONS
+
+def open_text(path, compression = None):
+    """Open a report for text writing
+
+    :param path: Report path, extension is not added
+    :type path: str
+    :param compression: gzip, zstd or None for plain text, defaults to None
+    :type compression: str, optional
+    :raises ValueError: Raise if compression is unknown
+    :raises ImportError: Raise if zstd compression is asked and zstandard is not installed
+    :return: Text stream
+    :rtype: TextIO
+    """
+    if compression is None:
+        return open(path, "w")
+    if compression == "gzip":
+        return gzip.open(path, "wt", compresslevel = 6)
+    if compression == "zstd":
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd = True))
+    raise ValueError(f"Unknown compression \"{compression}\"")
+
+def open_text_reader(path, compression = None):
+    """Open a report for text reading
+
+    :param path: Report path, extension is not added
+    :type path: str
+    :param compression: gzip, zstd or None for plain text, defaults to None
+    :type compression: str, optional
+    :raises ValueError: Raise if compression is unknown
+    :raises ImportError: Raise if zstd compression is asked and zstandard is not installed
+    :return: Text stream
+    :rtype: TextIO
+    """
+    if compression is None:
+        return open(path, "r")
+    if compression == "gzip":
+        return gzip.open(path, "rt")
+    if compression == "zstd":
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd = True))
+    raise ValueError(f"Unknown compression \"{compression}\"")
+
+def write_rows(stream, rows, batch_size = ROWS_BATCH_SIZE):
+    """Write rows by batches of batch_size rows
+
+    :param stream: Text stream to write to
+    :type stream: TextIO
+    :param rows: Rows, each one ending with a new line
+    :type rows: Iterable[str]
+    :param batch_size: Number of rows written at once, defaults to ROWS_BATCH_SIZE
+    :type batch_size: int, optional
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            stream.write("".join(batch))
+            batch.clear()
+    if batch:
+        stream.write("".join(batch))
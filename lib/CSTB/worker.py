@@ -0,0 +1,164 @@
+"""
+Long-running post-processing worker, to avoid interpreter startup, imports and couchDB and motif-broker
+handshakes for each job. Jobs are submitted through a spool directory : a job is a json file with
+post_processing.py arguments and working directory, dropped in <spool>/incoming. A worker claims a job
+by moving it to <spool>/running, runs it in its working directory with a PostProcessingContext kept
+between jobs, then writes job status in <spool>/done. Several workers can serve the same spool directory.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+import uuid
+
+INCOMING = "incoming"
+RUNNING = "running"
+DONE = "done"
+POLL_INTERVAL = 0.05
+
+
+def init_spool(spool):
+    """Create spool subdirectories if they don't exist
+    """
+    for directory in (INCOMING, RUNNING, DONE):
+        os.makedirs(os.path.join(spool, directory), exist_ok = True)
+
+def _write_json(path, data):
+    """Write json file atomically, so that it's never read partially written
+    """
+    tmp_path = os.path.join(os.path.dirname(os.path.dirname(path)), f".{os.path.basename(path)}.tmp")
+    with open(tmp_path, "w") as o:
+        json.dump(data, o)
+    os.replace(tmp_path, path)
+
+def submit(spool, args, cwd = None, timeout = None, poll_interval = POLL_INTERVAL):
+    """Submit a post-processing job and wait for its end
+
+    :param spool: Spool directory served by workers
+    :type spool: str
+    :param args: post_processing.py arguments
+    :type args: List[str]
+    :param cwd: Job working directory, where logs and results are written, defaults to current directory
+    :type cwd: str, optional
+    :param timeout: Maximum waiting time in seconds, defaults to None for no limit
+    :type timeout: float, optional
+    :raises TimeoutError: Raise if job is not done after timeout seconds
+    :return: Job status, with "status" exit code and "stdout" path of file with job standard output
+    :rtype: Dict
+    """
+    init_spool(spool)
+    job_id = uuid.uuid4().hex
+    cwd = os.path.abspath(cwd if cwd else os.getcwd())
+    job = {"id" : job_id, "args" : args, "cwd" : cwd,
+        "stdout" : os.path.join(cwd, f".post_processing_{job_id}.out"),
+        "stderr" : os.path.join(cwd, "post_processing.err")}
+    incoming_path = os.path.join(spool, INCOMING, f"{job_id}.json")
+    _write_json(incoming_path, job)
+
+    done_path = os.path.join(spool, DONE, f"{job_id}.json")
+    start = time.time()
+    while not os.path.exists(done_path):
+        if timeout and time.time() - start > timeout:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(incoming_path)
+            raise TimeoutError(f"Post-processing job {job_id} not done after {timeout}s")
+        time.sleep(poll_interval)
+
+    with open(done_path) as f:
+        status = json.load(f)
+    os.remove(done_path)
+    return status
+
+def serve(spool, max_jobs = None, poll_interval = POLL_INTERVAL):
+    """Run jobs of spool directory, oldest first, until max_jobs jobs are done
+
+    :param spool: Spool directory
+    :type spool: str
+    :param max_jobs: Number of jobs to run before returning, defaults to None to run forever
+    :type max_jobs: int, optional
+    """
+    from CSTB.post_processing import PostProcessingContext
+    init_spool(spool)
+    context = PostProcessingContext()
+    logging.info(f"Serve post-processing jobs from {spool}")
+    nb_jobs = 0
+    while max_jobs is None or nb_jobs < max_jobs:
+        job_path = _claim_job(spool)
+        if not job_path:
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(spool, job_path, context)
+        except Exception:
+            logging.exception(f"Can't run job {job_path}")
+        nb_jobs += 1
+
+def _claim_job(spool):
+    """Move oldest incoming job to running directory
+
+    :return: Path of claimed job, None if there is no job to claim
+    :rtype: str
+    """
+    incoming_dir = os.path.join(spool, INCOMING)
+    entries = []
+    for name in os.listdir(incoming_dir):
+        with contextlib.suppress(FileNotFoundError):
+            entries.append((os.stat(os.path.join(incoming_dir, name)).st_mtime, name))
+    for _, name in sorted(entries):
+        running_path = os.path.join(spool, RUNNING, name)
+        try:
+            os.rename(os.path.join(incoming_dir, name), running_path)
+        except FileNotFoundError: # Claimed by another worker
+            continue
+        return running_path
+    return None
+
+def run_job(spool, job_path, context):
+    """Run one job like post_processing.py would do in job working directory : standard output and error are redirected to job files and logs are added to post_processing.log. Job exit or failure doesn't stop the worker, job status is written even if job files can't be opened.
+
+    :param spool: Spool directory
+    :type spool: str
+    :param job_path: Path of claimed job
+    :type job_path: str
+    :param context: Connections and caches shared between jobs
+    :type context: PostProcessingContext
+    """
+    from CSTB.post_processing import args_gestion, run
+    with open(job_path) as f:
+        job = json.load(f)
+    logging.info(f"Run job {job['id']} in {job['cwd']}")
+
+    status = 1
+    start = time.time()
+    previous_cwd = os.getcwd()
+    log_handler = None
+    try:
+        # Fails like job files if working directory is missing or not writable, job status is still written
+        log_handler = logging.FileHandler(os.path.join(job["cwd"], "post_processing.log"))
+        log_handler.setFormatter(logging.Formatter('%(levelname)s\t%(message)s'))
+        logging.getLogger().addHandler(log_handler)
+        with open(job["stdout"], "w") as out, open(job["stderr"], "a") as err, contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                os.chdir(job["cwd"])
+                logging.info("== post_processing.py")
+                run(args_gestion(job["args"]), context)
+                status = 0
+            except SystemExit as e:
+                if isinstance(e.code, int) or e.code is None:
+                    status = e.code or 0
+                else:
+                    print(e.code, file = sys.stderr)
+            except Exception:
+                traceback.print_exc()
+    finally:
+        os.chdir(previous_cwd)
+        if log_handler:
+            logging.getLogger().removeHandler(log_handler)
+            log_handler.close()
+        _write_json(os.path.join(spool, DONE, f"{job['id']}.json"), {"id" : job["id"], "status" : status, "stdout" : job["stdout"]})
+        os.remove(job_path)
+    logging.info(f"Job {job['id']} done with status {status} in {round(time.time() - start, 3)}s")
@@ -0,0 +1,398 @@
+"""
+Job workflows of the CRISPR web service, run in the job directory, replacing crispr_workflow.sh and crispr_workflow_specific.sh :
+    - all genomes : setCompare, then post_processing.py
+    - specific gene : index_sequence.py and blastn, setCompare once the query is indexed, then post_processing.py
+Each step is an external command, with its command line written in <step>.cmd and its outputs in the same
+files as the shell workflows. Independent steps run concurrently : blastn only needs query.fasta, so it
+overlaps indexing and setCompare. Steps can be limited in time. Failures are reported like the shell
+workflows, with an error or emptySearch json on standard output, and post_processing.py prints results
+json itself. Steps timings are written in workflow_timings.json and total running time in running_time.txt.
+With a results cache, results of a job already run are restored from it before running any step.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+import CSTB.utils.error as error
+from CSTB.utils.stage_graph import Stage, run_graph, run_sequence
+
+SUPPORT_MESSAGE = "Contact support with this job number : cstb-support@ibcp.fr"
+SET_COMPARE_EMPTY = "intersect size is zero"
+BLAST_OUTFMT = "6 stitle qlen nident length sstart send"
+TIMINGS_FILE = "workflow_timings.json"
+POLL_INTERVAL = 0.05
+
+
+def error_json(message):
+    """Print json with error key, like workflow scripts, and end workflow
+    """
+    print(json.dumps({"error" : message}), flush = True)
+    raise error.ErrorExit()
+
+def empty_json(message):
+    """Print json with emptySearch key, like workflow scripts, and end workflow
+    """
+    print(json.dumps({"emptySearch" : message}), flush = True)
+    raise error.EmptyExit()
+
+def _is_filled(path):
+    """Like shell test -s : file exists and is not empty
+    """
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+class StepFailed(Exception):
+    """Raise if a step command exits with non zero status, or writes on its error output when it's checked
+    """
+    pass
+
+class StepTimeout(StepFailed):
+    """Raise if a step command is still running after its timeout
+    """
+    pass
+
+class StepCancelled(Exception):
+    """Raise if a step command is stopped because a previous step failed
+    """
+    pass
+
+
+class Step():
+    """External command of a workflow
+
+    Attributes:
+        name (str): Step name
+        args (List[str]): Command line
+        stdout (str): Standard output file, None to use workflow standard output
+        stderr (str): Error output file
+        stderr_mode (str): "w" to overwrite error output file, "a" to append to it
+        check_stderr (bool): Step fails if its error output is not empty, like workflow scripts checks
+        timeout (float): Maximum running time in seconds, None for no limit
+        status (str): pending, running, ok, failed, timeout or cancelled
+        returncode (int): Command exit status
+        start (float): Start time, relative to workflow start
+        seconds (float): Running time
+    """
+
+    def __init__(self, name, args, stdout, stderr, stderr_mode = "w", check_stderr = True, timeout = None):
+        self.name = name
+        self.args = args
+        self.stdout = stdout
+        self.stderr = stderr
+        self.stderr_mode = stderr_mode
+        self.check_stderr = check_stderr
+        self.timeout = timeout
+        self.status = "pending"
+        self.returncode = None
+        self.start = None
+        self.seconds = None
+
+    def run(self, origin, cancelled):
+        """Run command, write it in <name>.cmd before
+
+        :param origin: Workflow start time, from time.perf_counter()
+        :type origin: float
+        :param cancelled: Tell if step has to stop
+        :type cancelled: Callable[[], bool]
+        :raises StepFailed: Raise if command fails, StepTimeout if it's too long
+        :raises StepCancelled: Raise if command is stopped by cancelled
+        """
+        with open(f"{self.name}.cmd", "w") as o:
+            o.write(shlex.join(self.args) + "\n")
+        logging.info(f"Run {self.name} : {shlex.join(self.args)}")
+        self.status = "running"
+        start = time.perf_counter()
+        self.start = start - origin
+        try:
+            with open(self.stderr, self.stderr_mode) as err, (open(self.stdout, "w") if self.stdout else contextlib.nullcontext()) as out:
+                # Own process group, so that a stopped step also stops commands it started
+                process = subprocess.Popen(self.args, stdout = out, stderr = err, start_new_session = True)
+                while True:
+                    try:
+                        self.returncode = process.wait(timeout = POLL_INTERVAL)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if self.timeout and time.perf_counter() - start > self.timeout:
+                            self.status = "timeout"
+                        elif cancelled():
+                            self.status = "cancelled"
+                        else:
+                            continue
+                        os.killpg(process.pid, signal.SIGKILL)
+                        self.returncode = process.wait()
+                        break
+        finally:
+            self.seconds = time.perf_counter() - start
+        logging.info(f"{self.name} {self.status if self.status != 'running' else 'done'} in {round(self.seconds, 3)}s, status {self.returncode}")
+
+        if self.status == "timeout":
+            raise StepTimeout(f"{self.name} still running after {self.timeout}s")
+        if self.status == "cancelled":
+            raise StepCancelled(f"{self.name} stopped after a previous step failure")
+        if self.returncode != 0 or (self.check_stderr and _is_filled(self.stderr)):
+            self.status = "failed"
+            raise StepFailed(self.error_output())
+        self.status = "ok"
+
+    def error_output(self):
+        with open(self.stderr, errors = "replace") as f:
+            return f.read()
+
+    def to_dict(self):
+        return {"name" : self.name, "args" : self.args, "status" : self.status, "returncode" : self.returncode, "start" : self.start, "seconds" : self.seconds, "timeout" : self.timeout}
+
+
+class Workflow():
+    """Steps of a job, run as a dependency graph. A step failure stops running steps that come after it in sequential order.
+
+    Attributes:
+        steps (List[Step]): Steps in sequential order
+        concurrent (bool): Run independent steps concurrently, else one after the other
+        post_processing_args (List[str]): post_processing.py arguments of the job, to search its results in results cache
+        cached (bool): True if job results were restored from results cache instead of running steps
+    """
+
+    def __init__(self, concurrent = True):
+        self.steps = []
+        self.concurrent = concurrent
+        self.post_processing_args = []
+        self.cached = False
+        self._stages = []
+        self._failed = None
+        self._lock = threading.Lock()
+        self._origin = None
+
+    def add(self, step, after = None, on_error = None, check = None):
+        """Add a step
+
+        :param step: Step to run
+        :type step: Step
+        :param after: Names of steps that must be done before, defaults to None
+        :type after: List[str], optional
+        :param on_error: Called with step exception, usually error_json or empty_json, defaults to None
+        :type on_error: Callable[[BaseException], None], optional
+        :param check: Called before step, can raise to make step fail without running it, defaults to None
+        :type check: Callable[[], None], optional
+        """
+        position = len(self._stages)
+
+        def work():
+            try:
+                if check:
+                    check()
+                step.run(self._origin, lambda: self._failed is not None and self._failed < position)
+            except BaseException:
+                with self._lock:
+                    self._failed = position if self._failed is None else min(self._failed, position)
+                raise
+
+        self.steps.append(step)
+        self._stages.append(Stage(step.name, work, after, on_error))
+
+    def run(self):
+        """Run steps, error or emptySearch json is printed by failing step error handler
+
+        :return: Total running time in seconds
+        :rtype: float
+        """
+        self._origin = time.perf_counter()
+        try:
+            if self.concurrent:
+                run_graph(self._stages)
+            else:
+                run_sequence(self._stages)
+        except (error.ErrorExit, error.EmptyExit):
+            pass
+        return time.perf_counter() - self._origin
+
+    def write_timings(self, path, total):
+        with open(path, "w") as o:
+            json.dump({"seconds" : total, "concurrent" : self.concurrent, "cached" : self.cached, "steps" : [step.to_dict() for step in self.steps]}, o, indent = 1)
+
+
+def _exit_with(message, empty_message = None, empty_output = None):
+    """Step error handler : empty_json with empty_message if step was not run because there is nothing to search (error.NoHit) or if its error output starts with empty_output, else error_json with message
+    """
+    def on_error(exception):
+        if empty_message and (isinstance(exception, error.NoHit) or (empty_output and isinstance(exception, StepFailed) and str(exception).startswith(empty_output))):
+            empty_json(empty_message)
+        error_json(message)
+    return on_error
+
+def _require_filled(path):
+    def check():
+        if not _is_filled(path):
+            raise error.NoHit(f"{path} is empty")
+    return check
+
+def _set_compare_args(PARAM, set_compare_file, query_index = None):
+    args = ["setCompare"]
+    if PARAM.length != 20:
+        args += ["-c", str(PARAM.length + 3)]
+    args += ["-i", PARAM.include, "-o", PARAM.exclude, "-l", PARAM.index_dir, "-e", "index", "-f", set_compare_file]
+    if query_index:
+        args += ["-s", query_index]
+    return args
+
+def _post_processing_args(PARAM):
+    script = os.path.join(PARAM.scripts_dir, "post_processing.py")
+    if PARAM.spool:
+        return [sys.executable, "-u", os.path.join(PARAM.scripts_dir, "post_processing_worker.py"), "submit", "--spool", PARAM.spool, "--"]
+    return [sys.executable, "-u", script]
+
+def _post_processing_step(PARAM, tag, workflow, set_compare_args, stderr_mode, extra_args = None):
+    workflow.post_processing_args = ["--include", PARAM.include, "--exclude", PARAM.exclude, "--couch_endpoint", PARAM.couch_endpoint,
+        "--taxon_db", PARAM.taxon_db, "--genome_db", PARAM.genome_db] + set_compare_args + ["--length", str(PARAM.length),
+        "--motif_broker_endpoint", PARAM.motif_broker_endpoint, "--tag", tag] + (extra_args if extra_args else [])
+    if PARAM.result_cache:
+        workflow.post_processing_args += ["--result_cache", PARAM.result_cache]
+    # post_processing.py prints its own error json, only its failures without results are reported
+    return Step("post_processing", _post_processing_args(PARAM) + workflow.post_processing_args, None, "post_processing.err", stderr_mode, check_stderr = False, timeout = PARAM.timeouts.get("post_processing"))
+
+def restore_cached_results(post_processing_args):
+    """Search job results in results cache, and write them like post_processing.py would do if they are found
+
+    :param post_processing_args: post_processing.py arguments of the job, with --result_cache
+    :type post_processing_args: List[str]
+    :return: True if results were restored
+    :rtype: bool
+    """
+    from CSTB.post_processing import args_gestion as post_processing_args_gestion, result_cache_key, restore_cached_results as restore_results
+    from CSTB.utils.result_cache import ResultCache
+    import pycouch.wrapper as couch_wrapper
+    PARAM = post_processing_args_gestion(post_processing_args)
+    try:
+        wrapper = couch_wrapper.Wrapper(PARAM.couch_endpoint)
+        key, _ = result_cache_key(PARAM, wrapper)
+        return bool(key) and restore_results(PARAM, ResultCache(PARAM.result_cache, PARAM.result_cache_size), key)
+    except Exception as e:
+        logging.warning(f"Result cache is not used : {e}")
+        return False
+
+def all_genomes_workflow(PARAM, tag):
+    """Workflow of crispr_workflow.sh : sgRNAs of included genomes, absent from excluded genomes
+
+    :param PARAM: Workflow arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param tag: Job tag
+    :type tag: str
+    :rtype: Workflow
+    """
+    workflow = Workflow(not PARAM.sequential)
+    post_processing_error = _exit_with(f"Error while post-processing - job {tag}. {SUPPORT_MESSAGE}")
+    if PARAM.set_compare_engine == "numpy":
+        workflow.add(_post_processing_step(PARAM, tag, workflow, ["--index_dir", PARAM.index_dir], "a"), on_error = post_processing_error)
+        return workflow
+
+    set_compare_file = "set_index.txt"
+    workflow.add(Step("setCompare", _set_compare_args(PARAM, set_compare_file), "setCompare.log", "setCompare.err", timeout = PARAM.timeouts.get("setCompare")),
+        on_error = _exit_with(f"Error while setCompare - job {tag}. An email has automatically been send to support.", "No hits found", SET_COMPARE_EMPTY))
+    workflow.add(_post_processing_step(PARAM, tag, workflow, ["--set_compare", set_compare_file], "a"), ["setCompare"],
+        post_processing_error, _require_filled(set_compare_file))
+    return workflow
+
+def specific_gene_workflow(PARAM, tag):
+    """Workflow of crispr_workflow_specific.sh : sgRNAs of a gene sequence, in included genomes and absent from excluded genomes, with their position on homolog genes found by blastn
+
+    :param PARAM: Workflow arguments, as returned by args_gestion()
+    :type PARAM: argparse.Namespace
+    :param tag: Job tag
+    :type tag: str
+    :rtype: Workflow
+    """
+    query_fasta = "query.fasta"
+    query_index = "query.index"
+    blast_output = "blast_output.tsv"
+    with open(query_fasta, "w") as o:
+        o.write(f">query\n{PARAM.sequence}\n")
+
+    workflow = Workflow(not PARAM.sequential)
+    workflow.add(Step("index_query", [sys.executable, "-u", os.path.join(PARAM.scripts_dir, "index_sequence.py"), "-f", query_fasta, "-o", query_index],
+        "index_query.out", "index_query.err", timeout = PARAM.timeouts.get("index_query")),
+        on_error = _exit_with(f"Error while index gene - job {tag}. {SUPPORT_MESSAGE}"))
+
+    if PARAM.set_compare_engine == "numpy":
+        set_compare_file = query_index
+        set_compare_args = ["--index_dir", PARAM.index_dir, "--query_index", query_index]
+    else:
+        set_compare_file = "set_index.txt"
+        set_compare_args = ["--set_compare", set_compare_file]
+        workflow.add(Step("setCompare", _set_compare_args(PARAM, set_compare_file, query_index), "setCompare.log", "setCompare.err", timeout = PARAM.timeouts.get("setCompare")),
+            ["index_query"], _exit_with(f"Error while setCompare - job {tag}. {SUPPORT_MESSAGE}", "No hits found", SET_COMPARE_EMPTY), _require_filled(query_index))
+
+    # blastn only needs query fasta, it runs during indexing and setCompare
+    workflow.add(Step("blast", ["blastn", "-outfmt", BLAST_OUTFMT, "-query", query_fasta, "-db", PARAM.blast_db], blast_output, "blast.err", timeout = PARAM.timeouts.get("blast")),
+        on_error = _exit_with(f"Blast error - job {tag}. {SUPPORT_MESSAGE}"))
+    workflow.add(_post_processing_step(PARAM, tag, workflow, set_compare_args, "w", ["--blast", blast_output, "--blast_format", "tabular", "--p_id", f"{PARAM.p_id:g}", "--query_fasta", query_fasta]),
+        [step.name for step in workflow.steps], _exit_with(f"Error while post-processing - job {tag}. {SUPPORT_MESSAGE}", "No hits found"), _require_filled(set_compare_file))
+    return workflow
+
+def _timeouts(values):
+    timeouts = {}
+    for value in values or []:
+        step, seconds = value.split("=")
+        timeouts[step] = float(seconds)
+    return timeouts
+
+def args_gestion(argv = None):
+    """
+    Take and treat arguments that user gives in command line, or argv if given. Defaults are read from the environment variables used by workflow scripts.
+    """
+    env = os.environ.get
+    parser = argparse.ArgumentParser(prog = "crispr_workflow.py", description = "Run a CRISPR search job in current directory")
+    parser.add_argument("workflow", help = "all : sgRNAs of all included genomes, specific : sgRNAs of a gene sequence", choices = ["all", "specific"])
+    parser.add_argument("--include", metavar = "<str>", help = "Included genomes uuid, separated by & (env gi)", default = env("gi"))
+    parser.add_argument("--exclude", metavar = "<str>", help = "Excluded genomes uuid, separated by & (env gni)", default = env("gni", ""))
+    parser.add_argument("--length", metavar = "<int>", help = "sgRNA length without pam (env sl)", default = int(env("sl", 20)), type = int)
+    parser.add_argument("--index_dir", metavar = "<dir>", help = "Genomes index files directory (env rfg)", default = env("rfg"))
+    parser.add_argument("--sequence", metavar = "<str>", help = "Gene sequence, for specific workflow (env seq)", default = env("seq"))
+    parser.add_argument("--blast_db", metavar = "<str>", help = "blastn database, for specific workflow (env blastdb)", default = env("blastdb"))
+    parser.add_argument("--p_id", metavar = "<float>", help = "Identity percentage of homolog genes (env pid)", default = float(env("pid", 70)), type = float)
+    parser.add_argument("--couch_endpoint", metavar = "<url>", help = "couchDB endpoint (env COUCH_ENDPOINT)", default = env("COUCH_ENDPOINT"))
+    parser.add_argument("--taxon_db", metavar = "<str>", help = "Taxon database name (env NAME_TAXON)", default = env("NAME_TAXON"))
+    parser.add_argument("--genome_db", metavar = "<str>", help = "Genome database name (env NAME_GENOME)", default = env("NAME_GENOME"))
+    parser.add_argument("--motif_broker_endpoint", metavar = "<url>", help = "motif-broker endpoint (env MOTIF_BROKER_ENDPOINT)", default = env("MOTIF_BROKER_ENDPOINT"))
+    parser.add_argument("--set_compare_engine", metavar = "<str>", help = "setCompare binary, or numpy to compute sets in post-processing (env SET_COMPARE_ENGINE)", choices = ["setCompare", "numpy"], default = "numpy" if env("SET_COMPARE_ENGINE") == "numpy" else "setCompare")
+    parser.add_argument("--spool", metavar = "<dir>", help = "Submit post-processing to the post_processing_worker.py serving this spool directory (env POST_PROCESSING_SPOOL)", default = env("POST_PROCESSING_SPOOL"))
+    parser.add_argument("--result_cache", metavar = "<dir>", help = "Results cache directory, results of a job already run are restored from it instead of running steps (env RESULT_CACHE)", default = env("RESULT_CACHE"))
+    parser.add_argument("--scripts_dir", metavar = "<dir>", help = "Directory of CSTB scripts (env CRISPR_TOOLS_SCRIPT_PATH)", default = env("CRISPR_TOOLS_SCRIPT_PATH", os.path.dirname(os.path.abspath(sys.argv[0]))))
+    parser.add_argument("--tag", metavar = "<str>", help = "Job tag, defaults to current directory name")
+    parser.add_argument("--timeout", metavar = "<step=seconds>", help = "Maximum running time of a step (index_query, setCompare, blast, post_processing), can be repeated", action = "append")
+    parser.add_argument("--sequential", help = "Run steps one after the other, like workflow scripts", action = "store_true")
+    PARAM = parser.parse_args(argv)
+
+    required = ["include", "index_dir", "couch_endpoint", "taxon_db", "genome_db", "motif_broker_endpoint"]
+    if PARAM.workflow == "specific":
+        required += ["sequence", "blast_db"]
+    missing = [name for name in required if getattr(PARAM, name) is None]
+    if missing:
+        parser.error(f"missing {', '.join('--' + name for name in missing)}")
+    try:
+        PARAM.timeouts = _timeouts(PARAM.timeout)
+    except ValueError:
+        parser.error("--timeout must be <step>=<seconds>")
+    return PARAM
+
+def main(argv = None):
+    PARAM = args_gestion(argv)
+    tag = PARAM.tag if PARAM.tag else os.path.basename(os.getcwd())
+    logging.info(f"== crispr_workflow.py {PARAM.workflow} - job {tag}")
+    workflow = all_genomes_workflow(PARAM, tag) if PARAM.workflow == "all" else specific_gene_workflow(PARAM, tag)
+    start = time.perf_counter()
+    if PARAM.result_cache and restore_cached_results(workflow.post_processing_args):
+        logging.info("Results restored from result cache, steps are not run")
+        workflow.cached = True
+        total = time.perf_counter() - start
+    else:
+        total = workflow.run()
+    workflow.write_timings(TIMINGS_FILE, total)
+    with open("running_time.txt", "w") as o:
+        o.write(f"{round(total)}\n")
@@ -0,0 +1,31 @@
+import glob
+import os
+import sys
+import pytest
+
+# Same paths as test/setenv, plus repository root for bench modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "lib"))
+sys.path.insert(0, ROOT)
+
+DATA = os.path.join(ROOT, "test", "data")
+
+from bench.stand_in import Fixtures, StandIn
+
+# Genomes of test/data/ag_simple and test/data/ag_len_16 fixtures
+AG_SIMPLE_GENOMES = ["GCF_000217635.1", "GCF_000953695.1"]
+AG_LEN_16_GENOMES = [*AG_SIMPLE_GENOMES, "GCF_000940995.1"]
+
+
+def fixtures():
+    """Stand-in documents of test/data results.json files"""
+    stand_in_fixtures = Fixtures()
+    for path in sorted(glob.glob(os.path.join(DATA, "*", "results.json"))):
+        stand_in_fixtures.load(path)
+    return stand_in_fixtures
+
+@pytest.fixture(scope = "module")
+def stand_in():
+    """couchDB and motif-broker stand-in without faults, shared by tests of a module"""
+    with StandIn(fixtures()) as running:
+        yield running
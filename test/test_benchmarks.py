@@ -0,0 +1,55 @@
+"""
+Benchmark stages on small synthetic inputs, so that bench/run_benchmarks.py stays runnable.
+With pytest-benchmark installed, stages of each size are timed by its benchmark fixture
+(pytest --benchmark-autosave, then --benchmark-compare), otherwise they run once.
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import pytest
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+import generators
+import run_benchmarks
+from CSTB.utils.disk_cache import SqliteLRUStore
+
+HAS_BENCHMARK = importlib.util.find_spec("pytest_benchmark") is not None
+
+
+@pytest.fixture
+def run_stages(request):
+    """Run a function with pytest-benchmark if it is installed"""
+    if HAS_BENCHMARK:
+        benchmark = request.getfixturevalue("benchmark")
+        return lambda function, *args: benchmark.pedantic(function, args = args, rounds = 1, iterations = 1)
+    return lambda function, *args: function(*args)
+
+@pytest.fixture
+def metadata_store(tmp_path):
+    genome_docs, taxon_docs = generators.metadata_documents(generators.genome_uuids(2))
+    path = str(tmp_path / "metadata.sqlite")
+    store = SqliteLRUStore(path)
+    store.put_many({f"{run_benchmarks.GENOME_DB}/{doc_id}" : doc for doc_id, doc in genome_docs.items()})
+    store.put_many({f"{run_benchmarks.TAXON_DB}/{doc_id}" : doc for doc_id, doc in taxon_docs.items()})
+    store.close()
+    return path
+
+@pytest.mark.parametrize("word_length", [20, 16])
+def test_stages(tmp_path, metadata_store, run_stages, word_length):
+    PARAM = run_benchmarks.args_gestion(["--genomes", "2", "--homologs", "5", "--no_memory"])
+    results = run_stages(run_benchmarks.bench_one, PARAM, str(tmp_path), 200, word_length, metadata_store)
+    assert [result["stage"] for result in results] == run_benchmarks.STAGES
+    assert all(result["treated_hits"] == 200 and result["word_length"] == word_length for result in results)
+
+def test_compare_counts_regressions(tmp_path, capsys):
+    baseline = [{"stage" : "parse", "size" : 10, "word_length" : 20, "seconds" : 1.0},
+        {"stage" : "format_results", "size" : 10, "word_length" : 20, "seconds" : 1.0}]
+    baseline_file = tmp_path / "bench.json"
+    baseline_file.write_text(json.dumps({"parameters" : {"no_memory" : True}, "results" : baseline}))
+    results = [dict(baseline[0], seconds = 1.2), dict(baseline[1], seconds = 1.5),
+        {"stage" : "parse", "size" : 100, "word_length" : 20, "seconds" : 10.0}]
+    assert run_benchmarks.compare(results, str(baseline_file), 0.25, True) == 1
+    assert "REGRESSION format_results" in capsys.readouterr().out
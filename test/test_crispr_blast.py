@@ -0,0 +1,89 @@
+"""
+Tests of blast results parsing and homolog genes index
+"""
+
+import os
+import random
+import pytest
+from conftest import DATA
+from CSTB.engine.crispr_blast import BlastHit, BlastReport, GeneIndex
+
+BLAST_DATA = os.path.join(DATA, "blast")
+
+
+def gene(org_uuid, fasta_header, start, end):
+    # BlastHit coordinates are 1-based
+    return BlastHit(org_uuid, fasta_header, start + 1, end + 1, end - start + 1)
+
+def linear_genes_containing(genes, org_uuid, fasta_header, start, end):
+    """Genes containing [start, end] found by scanning all genes, numbered by genome in genes order
+    """
+    nb_homolog = {}
+    found = []
+    for g in genes:
+        nb_homolog[g.org_uuid] = nb_homolog.get(g.org_uuid, 0) + 1
+        if g.org_uuid == org_uuid and g.fasta_header == fasta_header and g.start <= start and end <= g.end:
+            found.append((g.start, f"homolog_gene_{nb_homolog[g.org_uuid]}"))
+    return [gene_id for _, gene_id in sorted(found, key = lambda item: item[0])]
+
+
+def test_nested_and_overlapping_genes():
+    # A long gene contains the next ones, so the backward scan has to go past genes that end before the coordinate
+    genes = [gene("g1", "chr", 0, 1000), gene("g1", "chr", 100, 200), gene("g1", "chr", 150, 400), gene("g1", "chr", 300, 350), gene("g1", "chr", 500, 520)]
+    index = GeneIndex(genes)
+    assert index.genesContaining("g1", "chr", 160, 180) == ["homolog_gene_1", "homolog_gene_2", "homolog_gene_3"]
+    assert index.genesContaining("g1", "chr", 310, 340) == ["homolog_gene_1", "homolog_gene_3", "homolog_gene_4"]
+    assert index.genesContaining("g1", "chr", 505, 515) == ["homolog_gene_1", "homolog_gene_5"]
+    assert index.genesContaining("g1", "chr", 990, 1010) == []
+    assert index.genesContaining("g1", "chr", 1500, 1520) == []
+
+def test_same_coordinates_on_two_fasta_headers():
+    genes = [gene("g1", "chr1", 100, 200), gene("g1", "chr2", 500, 600)]
+    index = GeneIndex(genes)
+    assert ("g1", "chr1") in index and ("g1", "chr2") in index
+    assert index.genesContaining("g1", "chr1", 120, 140) == ["homolog_gene_1"]
+    # Genes of another fasta header are not matched, even at the same coordinates
+    assert index.genesContaining("g1", "chr2", 120, 140) == []
+    assert index.genesContaining("g1", "chr2", 520, 540) == ["homolog_gene_2"]
+    assert index.genesContaining("g1", "chr3", 120, 140) == []
+
+def test_numbering_by_genome():
+    # Genes are numbered in given order, separately for each genome, whatever their fasta header
+    genes = [gene("g1", "chr1", 100, 200), gene("g2", "chr1", 100, 200), gene("g1", "chr2", 50, 80), gene("g2", "chr1", 150, 300)]
+    index = GeneIndex(genes)
+    assert index.genesContaining("g1", "chr1", 110, 130) == ["homolog_gene_1"]
+    assert index.genesContaining("g1", "chr2", 60, 70) == ["homolog_gene_2"]
+    assert index.genesContaining("g2", "chr1", 160, 180) == ["homolog_gene_1", "homolog_gene_2"]
+    assert ("g3", "chr1") not in index
+    assert index.genesContaining("g3", "chr1", 110, 130) == []
+
+def test_same_as_linear_scan():
+    rng = random.Random(0)
+    genes = []
+    for _ in range(300):
+        start = rng.randrange(10000)
+        genes.append(gene(rng.choice(["g1", "g2"]), rng.choice(["chr1", "chr2"]), start, start + rng.randrange(2000)))
+    index = GeneIndex(genes)
+    for _ in range(2000):
+        org_uuid, fasta_header, start = rng.choice(["g1", "g2"]), rng.choice(["chr1", "chr2"]), rng.randrange(12000)
+        assert index.genesContaining(org_uuid, fasta_header, start, start + 22) == linear_genes_containing(genes, org_uuid, fasta_header, start, start + 22)
+
+def genes_fields(genes):
+    return [(g.org_uuid, g.fasta_header, g.start, g.end, g.len) for g in genes]
+
+def test_xml_and_tabular_reports_are_equal():
+    xml_report = BlastReport(os.path.join(BLAST_DATA, "blast.xml"), 70, ["g1", "g2"], "xml")
+    tabular_report = BlastReport(os.path.join(BLAST_DATA, "blast.tsv"), 70, ["g1", "g2"], "tabular")
+    assert xml_report.is_hit() and tabular_report.is_hit()
+    # Hsps of g3 and hsps with identity under 70% are not kept, reverse hsps are stored from their lowest coordinate
+    assert genes_fields(xml_report.homolog_genes) == [("g1", "NC_000001.1", 1000, 1419, 420), ("g1", "NC_000001.1", 5000, 5419, 420),
+        ("g2", "NZ_000002.1", 2000, 2417, 418), ("g2", "NZ_000022.1", 401, 800, 400)]
+    assert genes_fields(tabular_report.homolog_genes) == genes_fields(xml_report.homolog_genes)
+    assert xml_report.organisms == tabular_report.organisms == {"g1", "g2"}
+    assert genes_fields(tabular_report.filterGenes(["g2"])) == genes_fields(xml_report.filterGenes(["g2"]))
+
+@pytest.mark.parametrize("file_name, blast_format", [("no_hit.xml", "xml"), ("no_hit.tsv", "tabular")])
+def test_no_hit(file_name, blast_format):
+    report = BlastReport(os.path.join(BLAST_DATA, file_name), 70, ["g1", "g2"], blast_format)
+    assert not report.is_hit()
+    assert report.homolog_genes == []
@@ -0,0 +1,63 @@
+"""
+Tests of Hit occurences, their memoized formating and count, and of coordinates parsing
+"""
+
+import pytest
+from CSTB.engine.crispr_blast import BlastHit, GeneIndex
+from CSTB.engine.crispr_hit import Hit, formatCoord, parseCoord
+
+SEQUENCE = "ACGTACGTACGTACGTACGTAGG"
+DOCUMENT = {"g1" : {"chr1" : ["+(100,122)", "-(500,522)"]}, "g2" : {"chr2" : ["+(40,62)"]}}
+
+
+def test_occurences_are_formated_once():
+    hit = Hit(0, 3, 20, sequence = SEQUENCE)
+    hit.store_occurences([DOCUMENT], ["g1", "g2"])
+    occurences = hit.occurences
+    assert hit.occurences is occurences
+    assert hit.number_occurences == 3
+    assert occurences == {"g1" : {"chr1" : {"coords" : [{"coord" : "+(100,122)", "is_on_gene" : []}, {"coord" : "-(500,522)", "is_on_gene" : []}]}},
+        "g2" : {"chr2" : {"coords" : [{"coord" : "+(40,62)", "is_on_gene" : []}]}}}
+
+def test_store_occurences_invalidates_memo():
+    hit = Hit(0, 3, 20, sequence = SEQUENCE)
+    hit.store_occurences([{"g1" : DOCUMENT["g1"]}], ["g1"])
+    assert hit.number_occurences == 2 and list(hit.occurences) == ["g1"]
+    hit.store_occurences([{"g2" : DOCUMENT["g2"]}], ["g2"])
+    assert hit.number_occurences == 3 and list(hit.occurences) == ["g1", "g2"]
+
+def test_coordinates_update_invalidates_memo():
+    # Occurences of 23-length words are shortened to the 16-length sgRNA once stored
+    hit = Hit(0, 3, 16, longer_index = [1], sequence = SEQUENCE[7:], longer_sequences = [SEQUENCE])
+    hit.store_occurences([DOCUMENT], ["g1"])
+    assert [coord["coord"] for coord in hit.occurences["g1"]["chr1"]["coords"]] == ["+(107,122)", "-(500,515)"]
+    hit._update_coords()
+    assert [coord["coord"] for coord in hit.occurences["g1"]["chr1"]["coords"]] == ["+(114,122)", "-(500,508)"]
+
+def test_genes_annotation_invalidates_memo():
+    hit = Hit(0, 3, 20, sequence = SEQUENCE)
+    hit.store_occurences([DOCUMENT], ["g1", "g2"])
+    assert not any(coord["is_on_gene"] for coord in hit.occurences["g1"]["chr1"]["coords"])
+    hit.storeOnGeneOccurences(GeneIndex([BlastHit("g1", "chr1", 400, 600, 201)]))
+    assert [coord["is_on_gene"] for coord in hit.occurences["g1"]["chr1"]["coords"]] == [[], ["homolog_gene_1"]]
+    assert hit.number_occurences == 3
+
+@pytest.mark.parametrize("coord", ["+(0,22)", "-(48781,48803)", "+(4294967295,4294967317)"])
+def test_coordinates_round_trip(coord):
+    parsed = parseCoord(coord)
+    assert parsed == (coord[0], int(coord[2:coord.index(",")]), int(coord[coord.index(",") + 1:-1]))
+    assert formatCoord(parsed) == coord
+
+@pytest.mark.parametrize("coord", ["(1,23)", "+(1,23", "*(1,23)", "+(-1,21)", "+(1, 23)", ""])
+def test_irregular_coordinates_are_refused(coord):
+    with pytest.raises(ValueError):
+        parseCoord(coord)
+
+def test_parsed_coordinates_are_stored_like_strings():
+    from_strings, from_tuples = Hit(0, 3, 20, sequence = SEQUENCE), Hit(0, 3, 20, sequence = SEQUENCE)
+    from_strings.store_occurences([DOCUMENT], ["g1", "g2"])
+    parsed = {genome : {fasta_header : [parseCoord(coord) for coord in coords] for fasta_header, coords in fasta.items()} for genome, fasta in DOCUMENT.items()}
+    from_tuples.store_occurences([parsed], ["g1", "g2"])
+    assert [(occ.genome, occ.fasta_header, occ.coords) for occ in from_tuples.list_occurences] == \
+        [(occ.genome, occ.fasta_header, occ.coords) for occ in from_strings.list_occurences]
+    assert from_tuples.occurences == from_strings.occurences
@@ -0,0 +1,160 @@
+"""
+Tests of the streaming setCompare parser, against the list-based parser it replaced
+"""
+
+import io
+import os
+import re
+import pytest
+from conftest import DATA
+import CSTB.engine.crispr_set_compare as set_compare
+from CSTB.crispr_result_manager import CrisprResultManager, RANK_KEYS
+from CSTB.engine.hit_table import HitTable
+
+AG_SIMPLE = os.path.join(DATA, "ag_simple", "set_index.txt")
+AG_LEN_16 = os.path.join(DATA, "ag_len_16", "set_index.txt")
+
+
+def baseline_parse(path, word_length, to_keep = None):
+    """Hits of setCompare file as parsed before streaming, file read at once
+
+    :return: Number of hits of header and (index, weight[, longer_index]) of the to_keep first hits
+    :rtype: Tuple[str, List[Tuple]]
+    """
+    with open(path) as filin:
+        text = filin.readlines()
+    hits = []
+    if word_length == 20:
+        nb_total_hits = re.search("[0-9]+", text[-2]).group()
+        for rank_occ in text[-1].strip().split(","):
+            if to_keep and len(hits) == to_keep: break
+            hits.append((int(rank_occ.split(":")[0]), int(rank_occ.split(":")[1])))
+        return nb_total_hits, hits
+
+    lines = iter(text)
+    for line in lines:
+        regex_nb_hits = re.search("^# ([0-9]+)", line)
+        if regex_nb_hits:
+            nb_total_hits = regex_nb_hits.group(1)
+            break
+    for rank_occ in lines:
+        if (to_keep and len(hits) == to_keep) or rank_occ == "\n": break
+        rank_splitted = rank_occ.split(":")
+        longer_index = [int(index.replace("'", "")) for index in rank_occ.split("[")[1].rstrip("]\n").split(",")]
+        hits.append((int(rank_splitted[0]), int(rank_splitted[1].split("[")[0]), longer_index))
+    return nb_total_hits, hits
+
+def parse(path, word_length, to_keep = None, rank_by = "file"):
+    manager = CrisprResultManager(None, "taxon_db", "genome_db", "", "test")
+    manager.parse_set_compare(path, word_length, to_keep, rank_by)
+    return manager
+
+def table_hits(manager):
+    table = manager.hit_table
+    if manager.word_length == 20:
+        return [(table.indexes[i], table.weights[i]) for i in range(len(table))]
+    return [(table.indexes[i], table.weights[i], table.longer_index(i)) for i in range(len(table))]
+
+
+@pytest.mark.parametrize("path, word_length", [(AG_SIMPLE, 20), (AG_LEN_16, 16)], ids = ["ag_simple", "ag_len_16"])
+@pytest.mark.parametrize("to_keep", [None, 1, 10, 1000])
+def test_parse_same_as_baseline(path, word_length, to_keep):
+    nb_total_hits, hits = baseline_parse(path, word_length, to_keep)
+    manager = parse(path, word_length, to_keep)
+    assert str(manager.nb_total_hits) == nb_total_hits
+    assert table_hits(manager) == hits
+    assert manager.nb_treated_hits == len(hits)
+    assert [hit.index for hit in manager.hits_collection] == [hit[0] for hit in hits]
+
+def test_nb_total_hits_from_header():
+    # Header count is kept as written by setCompare, whatever the number of treated hits
+    manager = parse(AG_SIMPLE, 20, 5)
+    assert manager.nb_total_hits == "112"
+    assert manager.nb_treated_hits == 5
+    manager = parse(AG_LEN_16, 16, 5)
+    assert manager.nb_total_hits == 137
+    assert manager.nb_treated_hits == 5
+
+@pytest.mark.parametrize("path, iter_hits", [(AG_SIMPLE, set_compare.iter_hits_20), (AG_LEN_16, set_compare.iter_hits_other)], ids = ["ag_simple", "ag_len_16"])
+def test_to_keep_stops_early(path, iter_hits):
+    with open(path) as filin:
+        nb_total_hits = int(set_compare.read_nb_hits(filin))
+        hits = iter_hits(filin)
+        manager = CrisprResultManager(None, "taxon_db", "genome_db", "", "test")
+        manager.hit_table = HitTable()
+        manager._fill_hit_table(hits, 5, "file")
+        # Hits after the one that stopped parsing are not read
+        assert len(manager.hit_table) == 5
+        assert len(list(hits)) == nb_total_hits - 6
+
+def test_read_nb_hits_leaves_file_at_hits():
+    filin = io.StringIO("Final set (Intersect of 2 sets) - (Union of 0 sets)\n# 2 items set\n1:3,2:4\n")
+    assert set_compare.read_nb_hits(filin) == "2"
+    assert list(set_compare.iter_hits_20(filin)) == [(1, 3), (2, 4)]
+
+def test_read_nb_hits_without_header():
+    with pytest.raises(ValueError):
+        set_compare.read_nb_hits(io.StringIO("1:3,2:4\n"))
+
+
+def hits_text(path):
+    with open(path) as filin:
+        set_compare.read_nb_hits(filin)
+        return filin.read()
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 13, 64, 1 << 16])
+def test_iter_hits_20_chunks(chunk_size):
+    _, hits = baseline_parse(AG_SIMPLE, 20)
+    assert list(set_compare.iter_hits_20(io.StringIO(hits_text(AG_SIMPLE)), chunk_size)) == hits
+
+def test_iter_hits_20_chunk_boundary_in_entry():
+    text = "163238212351:8,652952849407:8,10:2\n"
+    # Chunks end in the middle of an index, after the colon, in the middle of a weight and right after a comma
+    for chunk_size in (5, 13, 14, 16, 30):
+        assert list(set_compare.iter_hits_20(io.StringIO(text), chunk_size)) == [(163238212351, 8), (652952849407, 8), (10, 2)]
+    # Without end of line
+    assert list(set_compare.iter_hits_20(io.StringIO(text.rstrip()), 4)) == [(163238212351, 8), (652952849407, 8), (10, 2)]
+    # Nothing after the hits line is read as hits
+    assert list(set_compare.iter_hits_20(io.StringIO("1:2,3:4\n5:6\n"), 3)) == [(1, 2), (3, 4)]
+
+def test_iter_hits_other():
+    _, hits = baseline_parse(AG_LEN_16, 16)
+    assert list(set_compare.iter_hits_other(io.StringIO(hits_text(AG_LEN_16)))) == hits
+    # Quoted longer indexes, and end of hits at first empty line
+    assert list(set_compare.iter_hits_other(io.StringIO("12:3['45','67']\n8:2[9]\n\n10:1[11]\n"))) == [(12, 3, [45, 67]), (8, 2, [9])]
+
+
+def baseline_top_k(hits, k, key):
+    """k best hits by sorting the whole list, ties in stream order
+    """
+    ranked = sorted(enumerate(hits), key = lambda item: (-key(*item[1]), item[0]))
+    return ranked[:k] if k else ranked
+
+WEIGHT = RANK_KEYS["weight"]
+
+@pytest.mark.parametrize("k", [None, 0, 1, 5, 50, 112, 500])
+def test_top_k_same_as_sort(k):
+    _, hits = baseline_parse(AG_SIMPLE, 20)
+    shuffled = hits[::2] + hits[1::2]
+    assert set_compare.top_k(iter(shuffled), k, WEIGHT) == baseline_top_k(shuffled, k, WEIGHT)
+
+@pytest.mark.parametrize("k", [None, 0])
+def test_top_k_all_hits(k):
+    _, hits = baseline_parse(AG_LEN_16, 16)
+    kept = set_compare.top_k(iter(hits), k, WEIGHT)
+    assert len(kept) == len(hits)
+    assert kept == baseline_top_k(hits, k, WEIGHT)
+
+def test_top_k_ties_by_position():
+    hits = [(10, 3), (11, 5), (12, 3), (13, 5), (14, 3), (15, 1)]
+    # Hits of same weight are kept and ranked in stream order
+    assert set_compare.top_k(iter(hits), 3, WEIGHT) == [(1, (11, 5)), (3, (13, 5)), (0, (10, 3))]
+    assert set_compare.top_k(iter(hits), 4, WEIGHT) == [(1, (11, 5)), (3, (13, 5)), (0, (10, 3)), (2, (12, 3))]
+    assert set_compare.top_k(iter([]), 3, WEIGHT) == []
+
+@pytest.mark.parametrize("path, word_length", [(AG_SIMPLE, 20), (AG_LEN_16, 16)], ids = ["ag_simple", "ag_len_16"])
+def test_parse_rank_by_weight(path, word_length):
+    _, hits = baseline_parse(path, word_length)
+    manager = parse(path, word_length, 10, "weight")
+    assert table_hits(manager) == [hit for _, hit in baseline_top_k(hits, 10, WEIGHT)]
+    assert manager.treated_positions == {position for position, _ in baseline_top_k(hits, 10, WEIGHT)}
@@ -0,0 +1,70 @@
+"""
+Tests of the columnar table of setCompare hits
+"""
+
+import numpy as np
+import pytest
+from CSTB.engine.crispr_hit import Hit
+from CSTB.engine.hit_table import HitTable
+
+# 16-length hits with 0, 2, 1 and 3 longer indexes
+INDEXES = [3, 1 << 30, 12345678, (1 << 32) - 1]
+WEIGHTS = [8, 7, 7, 2]
+LONGER = [[], [5, 1 << 40], [(1 << 46) - 1], [7, 8, 9]]
+
+
+def appended_table(longer = LONGER):
+    table = HitTable()
+    for index, weight, longer_index in zip(INDEXES, WEIGHTS, longer):
+        table.append(index, weight, longer_index)
+    return table
+
+def columns(table):
+    return list(table.indexes), list(table.weights), list(table.longer_offsets), list(table.longer_indexes)
+
+def test_append():
+    table = appended_table()
+    assert len(table) == 4
+    assert columns(table) == (INDEXES, WEIGHTS, [0, 0, 2, 3, 6], [5, 1 << 40, (1 << 46) - 1, 7, 8, 9])
+    assert [table.longer_index(i) for i in range(4)] == LONGER
+
+def test_append_without_longer_indexes():
+    table = HitTable()
+    table.append(1, 2)
+    table.append(3, 4, [])
+    assert columns(table) == ([1, 3], [2, 4], [0, 0, 0], [])
+    assert table.longer_index(1) == []
+
+def test_from_arrays_is_appended_table():
+    offsets = np.array([0, 0, 2, 3, 6], dtype = np.uint64)
+    table = HitTable.from_arrays(np.array(INDEXES, dtype = np.uint64), np.array(WEIGHTS), offsets, np.concatenate([np.array(longer, dtype = np.uint64) for longer in LONGER]))
+    assert columns(table) == columns(appended_table())
+
+def test_from_arrays_without_longer_indexes():
+    table = HitTable.from_arrays(np.array(INDEXES, dtype = np.uint64), np.array(WEIGHTS, dtype = np.uint64))
+    assert columns(table) == (INDEXES, WEIGHTS, [0] * 5, [])
+
+@pytest.mark.parametrize("start, stop", [(0, None), (0, 4), (1, 3), (2, 3), (3, None), (0, 0), (2, 2), (4, None), (1, 10), (3, 1)])
+def test_slice(start, stop):
+    part = appended_table().slice(start, stop)
+    end = 4 if stop is None else min(stop, 4)
+    positions = range(start, max(start, end))
+    assert list(part.indexes) == [INDEXES[i] for i in positions]
+    assert list(part.weights) == [WEIGHTS[i] for i in positions]
+    assert [part.longer_index(i) for i in range(len(part))] == [LONGER[i] for i in positions]
+    assert part.longer_offsets[0] == 0 and part.longer_offsets[-1] == len(part.longer_indexes)
+
+@pytest.mark.parametrize("codec", ["twobits", "pow2"])
+@pytest.mark.parametrize("start, stop", [(0, None), (1, 3), (3, 10), (2, 2)])
+def test_to_hits(codec, start, stop):
+    # Hits decode their own indexes when sequences are not given
+    hits = appended_table().to_hits(16, codec, start, stop)
+    expected = [Hit(index, weight, 16, longer, codec) for index, weight, longer in list(zip(INDEXES, WEIGHTS, LONGER))[start:stop]]
+    assert [(hit.index, hit.weight, hit.len_sgrna, hit.sequence, hit.longer_index, hit.to_request_sequences) for hit in hits] == \
+        [(hit.index, hit.weight, hit.len_sgrna, hit.sequence, hit.longer_index, hit.to_request_sequences) for hit in expected]
+
+def test_to_hits_of_20_length_words():
+    table = appended_table([[]] * 4)
+    hits = table.to_hits(23)
+    assert [hit.to_request_sequences for hit in hits] == [[hit.sequence] for hit in hits]
+    assert all(len(hit.sequence) == 23 and hit.longer_index == [] for hit in hits)
@@ -0,0 +1,108 @@
+"""
+Tests of couch documents cache, against a stub of the pycouch wrapper
+"""
+
+import pytest
+from CSTB.utils.metadata_cache import MetadataCache
+
+
+class StubWrapper():
+    """pycouch wrapper answering from a dict of documents by database, recording requests
+    """
+    def __init__(self, dbs):
+        self.end_point = "http://couch.stub"
+        self.dbs = dbs
+        self.requests = []
+
+    def couchGetDoc(self, target, key):
+        self.requests.append(("get", target, key))
+        return self.dbs[target].get(key)
+
+    def couchPostRequest(self, path, data):
+        self.requests.append(("post", path, tuple(data["keys"])))
+        db, _, view = path.partition("/")
+        rows = []
+        for key in data["keys"]:
+            doc = self.dbs[db].get(key)
+            if doc is None:
+                rows.append({"key" : key, "error" : "not_found"})
+                continue
+            row = {"id" : key, "key" : key, "value" : {"rev" : doc["_rev"]}}
+            if "include_docs=true" in view:
+                row["doc"] = doc
+            rows.append(row)
+        return {"rows" : rows}
+
+
+@pytest.fixture
+def wrapper():
+    return StubWrapper({"genome_db" : {"g1" : {"_id" : "g1", "_rev" : "1-a", "taxon" : "t1"}, "g2" : {"_id" : "g2", "_rev" : "1-b", "taxon" : "t2"}}})
+
+
+def test_memo(wrapper):
+    cache = MetadataCache(wrapper)
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t1"
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t1"
+    assert wrapper.requests == [("get", "genome_db", "g1")]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_missing_document_is_not_cached(wrapper):
+    cache = MetadataCache(wrapper)
+    assert cache.get_doc("genome_db", "g3") is None
+    assert cache.get_doc("genome_db", "g3") is None
+    assert len(wrapper.requests) == 2
+
+def test_expired_document_with_same_revision(wrapper):
+    cache = MetadataCache(wrapper, ttl = 0)
+    cache.get_doc("genome_db", "g1")
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t1"
+    # Revision is checked, document is not downloaded again
+    assert wrapper.requests == [("get", "genome_db", "g1"), ("post", "genome_db/_all_docs", ("g1",))]
+    assert (cache.hits, cache.misses, cache.revalidations) == (1, 1, 1)
+
+def test_expired_document_with_new_revision(wrapper):
+    cache = MetadataCache(wrapper, ttl = 0)
+    cache.get_doc("genome_db", "g1")
+    wrapper.dbs["genome_db"]["g1"] = {"_id" : "g1", "_rev" : "2-c", "taxon" : "t3"}
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t3"
+    assert wrapper.requests[-1] == ("get", "genome_db", "g1")
+    assert (cache.hits, cache.misses, cache.revalidations) == (0, 2, 1)
+
+def test_document_not_expired_is_not_revalidated(wrapper):
+    cache = MetadataCache(wrapper, ttl = 3600)
+    cache.get_doc("genome_db", "g1")
+    wrapper.dbs["genome_db"]["g1"] = {"_id" : "g1", "_rev" : "2-c", "taxon" : "t3"}
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t1"
+    assert cache.revalidations == 0
+
+def test_get_docs_bulk(wrapper):
+    cache = MetadataCache(wrapper)
+    docs = cache.get_docs("genome_db", ["g1", "g2", "g3", "g1"])
+    assert list(docs) == ["g1", "g2", "g3"]
+    assert docs["g1"]["taxon"] == "t1" and docs["g2"]["taxon"] == "t2" and docs["g3"] is None
+    # One request for all documents
+    assert wrapper.requests == [("post", "genome_db/_all_docs?include_docs=true", ("g1", "g2", "g3"))]
+
+    # Cached documents are not requested again
+    docs = cache.get_docs("genome_db", ["g2", "g1"])
+    assert docs["g2"]["taxon"] == "t2"
+    assert len(wrapper.requests) == 1
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t1"
+    assert len(wrapper.requests) == 1
+
+def test_get_docs_revalidation(wrapper):
+    cache = MetadataCache(wrapper, ttl = 0)
+    cache.get_docs("genome_db", ["g1", "g2"])
+    wrapper.dbs["genome_db"]["g2"] = {"_id" : "g2", "_rev" : "2-d", "taxon" : "t4"}
+    docs = cache.get_docs("genome_db", ["g1", "g2"])
+    assert docs["g1"]["taxon"] == "t1" and docs["g2"]["taxon"] == "t4"
+    # One revision check for expired documents, then only changed one is downloaded
+    assert wrapper.requests[1:] == [("post", "genome_db/_all_docs", ("g1", "g2")), ("post", "genome_db/_all_docs?include_docs=true", ("g2",))]
+
+def test_disk_store_shared_across_caches(wrapper, tmp_path):
+    store_path = str(tmp_path / "metadata.sqlite")
+    MetadataCache(wrapper, store_path).get_docs("genome_db", ["g1"])
+    cache = MetadataCache(wrapper, store_path)
+    assert cache.get_doc("genome_db", "g1")["taxon"] == "t1"
+    assert len(wrapper.requests) == 1
+    assert cache.hits == 1
@@ -0,0 +1,67 @@
+"""
+Tests of job metrics : Prometheus text format and HTTP requests counted during a run against the stand-in
+"""
+
+import json
+import re
+import CSTB.post_processing as post_processing
+from bench.stand_in import StandIn
+from CSTB.utils.metrics import HttpCounter, Metrics, PROMETHEUS_PREFIX
+from conftest import fixtures
+from test_worker import job_args
+
+# name{label="value",...} value
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\{((?:[a-zA-Z_][a-zA-Z0-9_]*="[^"\n]*",?)+)\} (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="([^"\n]*)"')
+
+
+def read_samples(path):
+    """Samples of a Prometheus text file, as (name, labels, value)"""
+    samples = []
+    with open(path) as f:
+        for line in f.read().splitlines():
+            match = SAMPLE.match(line)
+            assert match, line
+            samples.append((match.group(1), dict(LABEL.findall(match.group(2))), float(match.group(3))))
+    return samples
+
+def test_prometheus_text_format(tmp_path):
+    http = HttpCounter({"http://couch" : "couch"})
+    http.counts = {"couch" : {"requests" : 3, "bytes_sent" : 10, "bytes_received" : 200}}
+    metrics = Metrics("job", http)
+    with metrics.stage("parse"):
+        http.counts["couch"]["requests"] += 2
+    metrics.set("treated_hits", 40)
+    metrics.status = "ok"
+    path = tmp_path / "job.prom"
+    metrics.write_prometheus(path)
+
+    samples = read_samples(path)
+    assert all(name.startswith(PROMETHEUS_PREFIX + "_") and labels["tag"] == "job" for name, labels, _ in samples)
+    # One sample by name and labels
+    assert len({(name, tuple(sorted(labels.items()))) for name, labels, _ in samples}) == len(samples)
+    samples = {(name[len(PROMETHEUS_PREFIX) + 1:], tuple(sorted(labels.items()))) : value for name, labels, value in samples}
+    assert samples[("status", (("status", "ok"), ("tag", "job")))] == 1
+    assert samples[("treated_hits", (("tag", "job"),))] == 40
+    assert samples[("http_requests", (("service", "couch"), ("tag", "job")))] == 5
+    assert samples[("stage_http_requests", (("service", "couch"), ("stage", "parse"), ("tag", "job")))] == 2
+    assert ("stage_wall_seconds", (("stage", "parse"), ("tag", "job"))) in samples
+
+def test_http_counter_totals_match_stand_in(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with StandIn(fixtures()) as stand_in:
+        post_processing.run(post_processing.args_gestion(job_args(stand_in) + ["--output", "results.json", "--metrics_prometheus", "job.prom"]))
+        stats = stand_in.stats()
+    with open("job_metrics.json") as f:
+        metrics = json.load(f)
+
+    assert metrics["status"] == "ok"
+    for service in ("couch", "motif_broker"):
+        assert metrics["http"][service]["requests"] == stats[service]["requests"] > 0
+        # Stages share out requests of the job
+        assert sum(stage.get(service, {}).get("requests", 0) for stage in metrics["stages"]) == stats[service]["requests"]
+    # Plus handshake
+    assert metrics["counters"]["motif_broker_requests"] + 1 == stats["motif_broker"]["requests"]
+
+    http_requests = {labels["service"] : value for name, labels, value in read_samples("job.prom") if name == f"{PROMETHEUS_PREFIX}_http_requests"}
+    assert http_requests == {service : metrics["http"][service]["requests"] for service in metrics["http"]}
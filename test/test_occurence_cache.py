@@ -0,0 +1,68 @@
+"""
+Tests of motif-broker documents cache and of sequences de-duplication in occurences search
+"""
+
+import CSTB.utils.occurence_fetcher as occurence_fetcher
+from CSTB.crispr_result_manager import CrisprResultManager
+from CSTB.engine.crispr_hit import Hit
+from CSTB.utils.occurence_cache import OccurenceCache
+from CSTB.utils.occurence_fetcher import OccurenceFetcher
+from test_occurence_fetcher import ENDPOINT, StubSession
+
+DOCUMENT = {"g1" : {"chr" : ["+(0,22)"]}}
+SEQUENCES = ["A" * 23, "C" * 23, "G" * 23, "T" * 23]
+
+
+def test_documents_are_cached_by_revision(tmp_path):
+    path = str(tmp_path / "occurences.sqlite")
+    cache = OccurenceCache(path, "5-a")
+    cache.put_many({SEQUENCES[0] : DOCUMENT})
+    assert cache.get_many(SEQUENCES[:2]) == {SEQUENCES[0] : DOCUMENT}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A new genome database revision doesn't see documents of the previous one
+    updated = OccurenceCache(path, "6-b")
+    assert updated.get_many(SEQUENCES[:1]) == {}
+    assert (updated.hits, updated.misses) == (0, 1)
+    updated.put_many({SEQUENCES[0] : {"g2" : {"chr" : ["-(5,27)"]}}})
+    assert OccurenceCache(path, "5-a").get_many(SEQUENCES[:1]) == {SEQUENCES[0] : DOCUMENT}
+    assert OccurenceCache(path, "6-b").get_many(SEQUENCES[:1]) == {SEQUENCES[0] : {"g2" : {"chr" : ["-(5,27)"]}}}
+
+def search(monkeypatch, session, hits, occurence_cache = None):
+    fetcher = OccurenceFetcher(ENDPOINT, chunk_size = 2, workers = 1)
+    fetcher.handshaked = True
+    # Set once the fetcher mounted its connection pool on the real session
+    monkeypatch.setattr(occurence_fetcher, "SESSION", session)
+    manager = CrisprResultManager(None, "taxon_db", "genome_db", ENDPOINT, "test", hits_collection = hits, occurence_cache = occurence_cache, occurence_fetcher = fetcher)
+    manager.search_occurences(["g1"])
+    return fetcher
+
+def shorter_hits():
+    # 16-length hits sharing 23-length words, and two hits of the same word
+    return [Hit(0, 1, 16, longer_index = [1, 2], sequence = "X", longer_sequences = SEQUENCES[:2]),
+        Hit(1, 1, 16, longer_index = [2, 3], sequence = "Y", longer_sequences = SEQUENCES[1:3]),
+        Hit(2, 1, 16, longer_index = [3], sequence = "Z", longer_sequences = SEQUENCES[2:3]),
+        Hit(3, 1, 16, longer_index = [3], sequence = "Z", longer_sequences = SEQUENCES[2:3]),
+        Hit(4, 1, 16, longer_index = [4], sequence = "W", longer_sequences = SEQUENCES[3:4])]
+
+def test_each_sequence_is_requested_once(monkeypatch):
+    session = StubSession(0)
+    hits = shorter_hits()
+    fetcher = search(monkeypatch, session, hits)
+    requested = [seq for _, keys in session.posts for seq in keys]
+    assert sorted(requested) == SEQUENCES
+    assert fetcher.nb_requests == 2
+    # Hits waiting for a sequence requested by another hit get its occurences too
+    assert [hit.number_occurences for hit in hits] == [2, 2, 1, 1, 1]
+    assert all(list(hit.occurences) == ["g1"] for hit in hits)
+
+def test_cached_sequences_are_not_requested(tmp_path, monkeypatch):
+    session = StubSession(0)
+    cache = OccurenceCache(str(tmp_path / "occurences.sqlite"), "5-a")
+    cache.put_many({SEQUENCES[1] : DOCUMENT, SEQUENCES[2] : DOCUMENT})
+    hits = shorter_hits()
+    search(monkeypatch, session, hits, cache)
+    assert sorted(seq for _, keys in session.posts for seq in keys) == [SEQUENCES[0], SEQUENCES[3]]
+    assert [hit.number_occurences for hit in hits] == [2, 2, 1, 1, 1]
+    # Requested documents are cached for next jobs
+    assert OccurenceCache(cache.store.path, "5-a").get_many(SEQUENCES).keys() == set(SEQUENCES)
@@ -0,0 +1,86 @@
+"""
+Tests of motif-broker client retries and connection pools, with a mocked session
+"""
+
+import pytest
+import requests
+import CSTB.utils.error as error
+import CSTB.utils.occurence_fetcher as occurence_fetcher
+from CSTB.utils.occurence_fetcher import OccurenceFetcher
+
+ENDPOINT = "http://motif-broker.stub"
+
+
+class StubResponse():
+    def __init__(self, status_code, data = None):
+        self.status_code = status_code
+        self.data = data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Server Error")
+
+    def json(self):
+        return self.data
+
+
+class StubSession():
+    """Session answering bulk requests with the given number of 5xx errors first
+    """
+    def __init__(self, nb_errors):
+        self.nb_errors = nb_errors
+        self.posts = []
+
+    def post(self, url, json = None):
+        self.posts.append((url, json["keys"]))
+        if len(self.posts) <= self.nb_errors:
+            return StubResponse(503)
+        return StubResponse(200, {"request" : {seq : {"g1" : {"chr" : ["+(0,22)"]}} for seq in json["keys"]}})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(occurence_fetcher.time, "sleep", waits.append)
+    return waits
+
+
+def test_retry_with_exponential_backoff(monkeypatch, sleeps):
+    fetcher = OccurenceFetcher(ENDPOINT, chunk_size = 10, workers = 1, max_retries = 5, backoff = 0.5)
+    session = StubSession(3)
+    monkeypatch.setattr(occurence_fetcher, "SESSION", session)
+    results = fetcher.fetch(["AAA", "CCC"])
+    assert results == {"AAA" : {"g1" : {"chr" : ["+(0,22)"]}}, "CCC" : {"g1" : {"chr" : ["+(0,22)"]}}}
+    assert sleeps == [0.5, 1, 2]
+    assert fetcher.nb_requests == 4
+    assert session.posts == [(ENDPOINT + "/bulk_request", ["AAA", "CCC"])] * 4
+
+def test_give_up_after_max_retries(monkeypatch, sleeps):
+    fetcher = OccurenceFetcher(ENDPOINT, chunk_size = 10, workers = 1, max_retries = 2, backoff = 1)
+    session = StubSession(10)
+    monkeypatch.setattr(occurence_fetcher, "SESSION", session)
+    with pytest.raises(error.PingError):
+        fetcher.fetch(["AAA"])
+    assert sleeps == [1, 2]
+    assert len(session.posts) == 3
+
+def test_chunks(monkeypatch, sleeps):
+    fetcher = OccurenceFetcher(ENDPOINT, chunk_size = 2, workers = 2)
+    session = StubSession(0)
+    monkeypatch.setattr(occurence_fetcher, "SESSION", session)
+    chunks = []
+    assert fetcher.fetch(["AAA", "CCC", "GGG", "TTT", "ACG"], on_chunk = chunks.append) == {}
+    assert sorted(seq for chunk in chunks for seq in chunk) == ["AAA", "ACG", "CCC", "GGG", "TTT"]
+    assert sorted(keys for _, keys in session.posts) == [["AAA", "CCC"], ["ACG"], ["GGG", "TTT"]]
+    assert sleeps == []
+
+def test_connection_pool_shared_by_endpoint():
+    endpoint = ENDPOINT + "/pools"
+    OccurenceFetcher(endpoint, workers = 4)
+    adapter = occurence_fetcher.SESSION.get_adapter(endpoint + "/bulk_request")
+    # A fetcher with less workers keeps the pool of the first one, a bigger pool replaces it
+    OccurenceFetcher(endpoint, workers = 2)
+    assert occurence_fetcher.SESSION.get_adapter(endpoint + "/bulk_request") is adapter
+    OccurenceFetcher(endpoint, workers = 8)
+    assert occurence_fetcher.SESSION.get_adapter(endpoint + "/bulk_request") is not adapter
+    assert occurence_fetcher.SESSION.get_adapter(endpoint + "/bulk_request")._pool_maxsize == 8
@@ -0,0 +1,73 @@
+"""
+Tests of local occurence indexes, built from motif-broker documents and looked up like motif-broker
+"""
+
+import random
+import numpy as np
+import pytest
+from CSTB.engine.batch_decoding import encode_batch
+from CSTB.engine.crispr_hit import Hit, parseCoord
+from CSTB.engine.occurence_index import CODEC, GenomeOccurenceIndex, OccurenceResolver, build_occurence_index
+
+GENOMES = ["g1", "g2"]
+
+
+def random_documents(nb_sequences, seed = 0):
+    """motif-broker documents of random sequences, each one in one or both genomes"""
+    rng = random.Random(seed)
+    documents = {}
+    while len(documents) < nb_sequences:
+        sequence = "".join(rng.choice("ACGT") for _ in range(22)) + "G"
+        document = {}
+        for genome in rng.sample(GENOMES, rng.randint(1, 2)):
+            document[genome] = {}
+            for fasta_header in rng.sample([f"{genome}_chr{i}" for i in range(3)], rng.randint(1, 3)):
+                starts = rng.sample(range(10 ** 6), rng.randint(1, 4))
+                document[genome][fasta_header] = [f"{rng.choice('+-')}({start},{start + 22})" for start in starts]
+        documents[sequence] = document
+    return documents
+
+def expected_occurences(document):
+    return [(fasta_header, *parseCoord(coord)) for fasta_header, coords in document.items() for coord in coords]
+
+@pytest.fixture
+def documents():
+    return random_documents(300)
+
+@pytest.fixture
+def location(tmp_path, documents):
+    for genome in GENOMES:
+        build_occurence_index(documents, genome, str(tmp_path))
+    return str(tmp_path)
+
+def test_build_and_lookup(location, documents):
+    # Sequences absent from g1, and sequences absent from both genomes
+    absent = list(random_documents(20, seed = 1))
+    sequences = list(documents) + absent
+    random.Random(2).shuffle(sequences)
+    for genome in GENOMES:
+        index = GenomeOccurenceIndex(f"{location}/{genome}")
+        for sequence, occurences in zip(sequences, index.occurences(encode_batch(sequences, CODEC))):
+            if genome in documents.get(sequence, {}):
+                assert occurences == expected_occurences(documents[sequence][genome])
+            else:
+                assert occurences is None
+
+def test_lookup_in_empty_index(tmp_path):
+    build_occurence_index({"A" * 23 : {"g2" : {"chr" : ["+(0,22)"]}}}, "g1", str(tmp_path))
+    index = GenomeOccurenceIndex(str(tmp_path / "g1"))
+    assert index.occurences(np.array([0, 5], dtype = np.uint64)) == [None, None]
+
+def test_irregular_coordinate_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        build_occurence_index({"A" * 23 : {"g1" : {"chr" : ["+(0,19)"]}}}, "g1", str(tmp_path))
+
+def test_resolved_occurences_are_stored_like_motif_broker_ones(location, documents):
+    sequences = [sequence for sequence, document in documents.items() if len(document) == 2][:50]
+    resolved = OccurenceResolver(location, GENOMES, chunk_size = 7).fetch(sequences)
+    assert resolved.keys() == set(sequences)
+    for sequence in sequences:
+        from_index, from_motif_broker = Hit(0, 1, 20, sequence = sequence), Hit(0, 1, 20, sequence = sequence)
+        from_index.store_occurences([resolved[sequence]], GENOMES)
+        from_motif_broker.store_occurences([documents[sequence]], GENOMES)
+        assert from_index.occurences == from_motif_broker.occurences
@@ -0,0 +1,26 @@
+"""
+Tests of stages profiling
+"""
+
+import pstats
+import pytest
+import CSTB.post_processing as post_processing
+from CSTB.utils.profiling import Profiler, profile_stage
+from test_tsv_export import ARGS
+
+
+def test_stages_are_profiled_in_order(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    for name in ("parse", "search occurences"):
+        with profile_stage(profiler, name):
+            sorted(range(10000), key = lambda i: -i)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["01_parse.alloc.txt", "01_parse.pstats",
+        "02_search_occurences.alloc.txt", "02_search_occurences.pstats"]
+    assert pstats.Stats(str(tmp_path / "01_parse.pstats")).total_calls > 0
+    assert (tmp_path / "02_search_occurences.alloc.txt").read_text().startswith("Stage search occurences\nPeak traced memory")
+
+def test_profile_is_refused_with_concurrent_stages():
+    assert post_processing.args_gestion(ARGS + ["--profile"]).profile == "profile"
+    assert post_processing.args_gestion(ARGS + ["--concurrent"]).concurrent
+    with pytest.raises(SystemExit):
+        post_processing.args_gestion(ARGS + ["--profile", "--concurrent"])
@@ -0,0 +1,105 @@
+"""
+Tests of job results cache keys and eviction
+"""
+
+import io
+import json
+import os
+import pytest
+import CSTB.post_processing as post_processing
+from CSTB.utils.result_cache import ResultCache, job_key
+from test_tsv_export import ARGS
+
+REVISIONS = {"taxon_db" : "12-a", "genome_db" : "30-b"}
+
+
+class StubWrapper():
+    """pycouch wrapper answering database info with given update sequences"""
+
+    def __init__(self, revisions):
+        self.revisions = revisions
+
+    def couchGetRequest(self, path):
+        return {"update_seq" : self.revisions[path]}
+
+def write_results(tmp_path, name, size):
+    """Results json and tsv report of a job, tsv report of about size bytes"""
+    json_path, tsv_path = tmp_path / f"{name}.json", tmp_path / f"{name}.tsv"
+    json_path.write_text(json.dumps({"tag" : name, "data" : []}))
+    # Random rows, so that the gzip-compressed entry keeps about this size
+    tsv_path.write_bytes(os.urandom(size // 2).hex().encode())
+    return str(json_path), str(tsv_path)
+
+def put(cache, tmp_path, key, size, mtime):
+    cache.put(key, *write_results(tmp_path, key, size))
+    os.utime(cache.entry_path(key), (mtime, mtime))
+
+def test_key_is_stable_across_genomes_and_options_order():
+    key, inputs = job_key(["g1", "g2"], ["g3", "g4"], 20, REVISIONS, options = {"to_keep" : 0, "rank_by" : "weight"})
+    same_key, _ = job_key(["g2", "g1"], ["g4", "g3"], "20", dict(reversed(REVISIONS.items())), options = {"rank_by" : "weight", "to_keep" : 0})
+    assert key == same_key
+    assert inputs["include"] == ["g1", "g2"] and inputs["p_id"] is None
+    assert job_key(["g1", "g2"], ["g3", "g4"], 20, REVISIONS, options = {"to_keep" : 10, "rank_by" : "weight"})[0] != key
+    assert job_key(["g1", "g2", "g3"], ["g4"], 20, REVISIONS, options = {"to_keep" : 0, "rank_by" : "weight"})[0] != key
+
+def test_job_arguments_order_does_not_change_key():
+    def key(include, extra):
+        args = list(ARGS)
+        args[args.index("--include") + 1] = include
+        return post_processing.result_cache_key(post_processing.args_gestion(args + extra), StubWrapper(REVISIONS))[0]
+    assert key("g1&g2", ["--to_keep", "5", "--rank_by", "file"]) == key("g2&g1", ["--rank_by", "file", "--to_keep", "5"])
+    assert key("g1&g2", ["--to_keep", "5"]) != key("g1&g2", ["--to_keep", "6"])
+
+def test_database_revision_change_invalidates_key():
+    key = post_processing.result_cache_key(post_processing.args_gestion(ARGS), StubWrapper(REVISIONS))[0]
+    for database in REVISIONS:
+        revisions = dict(REVISIONS, **{database : "31-c"})
+        assert post_processing.result_cache_key(post_processing.args_gestion(ARGS), StubWrapper(revisions))[0] != key
+
+def test_restore_replaces_tag(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    json_path, tsv_path = write_results(tmp_path, "job1", 100)
+    cache.put("ab12", json_path, tsv_path)
+    stream = io.StringIO()
+    assert cache.restore("ab12", "job2", stream, str(tmp_path / "restored.tsv"))
+    assert json.loads(stream.getvalue()) == {"tag" : "job2", "data" : []}
+    assert (tmp_path / "restored.tsv").read_bytes() == open(tsv_path, "rb").read()
+    assert not cache.restore("cd34", "job2", io.StringIO(), str(tmp_path / "other.tsv"))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def entry_size(cache, key):
+    entry = cache.entry_path(key)
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+def cache_size(cache):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache.directory) for name in names)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes = None)
+    put(cache, tmp_path, "aa01", 10000, 1000)
+    # Room for two entries
+    cache.max_bytes = entry_size(cache, "aa01") * 5 // 2
+    put(cache, tmp_path, "bb02", 10000, 1001)
+    assert os.path.isdir(cache.entry_path("aa01"))
+    cache.put("cc03", *write_results(tmp_path, "cc03", 10000))
+    assert [os.path.isdir(cache.entry_path(key)) for key in ["aa01", "bb02", "cc03"]] == [False, True, True]
+    assert cache_size(cache) <= cache.max_bytes
+
+    # Reading bb02 makes cc03 the least recently used entry
+    os.utime(cache.entry_path("cc03"), (1002, 1002))
+    assert cache.restore("bb02", "job", io.StringIO(), str(tmp_path / "restored.tsv"))
+    cache.put("dd04", *write_results(tmp_path, "dd04", 10000))
+    assert [os.path.isdir(cache.entry_path(key)) for key in ["bb02", "cc03", "dd04"]] == [True, False, True]
+    assert cache_size(cache) <= cache.max_bytes
+
+def test_entry_bigger_than_cache_is_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes = 1000)
+    cache.put("aa01", *write_results(tmp_path, "aa01", 10000))
+    assert not os.path.isdir(cache.entry_path("aa01"))
+
+@pytest.mark.parametrize("max_bytes", [None, 0])
+def test_no_eviction_without_size_bound(tmp_path, max_bytes):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes = max_bytes)
+    for i, key in enumerate(["aa01", "bb02"]):
+        put(cache, tmp_path, key, 10000, 1000 + i)
+    assert all(os.path.isdir(cache.entry_path(key)) for key in ["aa01", "bb02"])
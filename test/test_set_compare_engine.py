@@ -0,0 +1,130 @@
+"""
+Tests of the in-process setCompare engine against setCompare results of test/data. test/data has no genome
+index files, so index files are built so that setCompare gives these results : each hit is split between
+included genomes with the same total number of occurences, excluded genomes get the hits setCompare removed,
+and other words are added to some genomes only.
+"""
+
+import os
+import random
+import numpy as np
+import pytest
+from conftest import DATA
+import CSTB.engine.crispr_set_compare as crispr_set_compare
+from CSTB.engine.set_compare_engine import IndexStore, read_index, set_compare
+
+FULL_MASK = (1 << 46) - 1
+
+
+def read_set_compare(path, word_length):
+    with open(path) as filin:
+        nb_hits = int(crispr_set_compare.read_nb_hits(filin))
+        hits = list(crispr_set_compare.iter_hits_20(filin) if word_length == 20 else crispr_set_compare.iter_hits_other(filin))
+    assert len(hits) == nb_hits
+    return hits
+
+def write_index(path, occurences):
+    with open(path, "w") as o:
+        o.write(f"# {len(occurences)} 23 twobits\n")
+        for code, nb in sorted(occurences.items()):
+            o.write(f"{code} {nb}\n")
+
+def add_noise(rng, genomes, hit_codes, length, excluded = (), nb_words = 200):
+    """Add words that are not in all included genomes, and whose shorter word is not a hit. Excluded genomes get some of them.
+    """
+    mask = (1 << (2 * length)) - 1
+    for _ in range(nb_words):
+        code = rng.randrange(FULL_MASK)
+        if code & mask in hit_codes:
+            continue
+        for genome in rng.sample(genomes, rng.randrange(1, len(genomes))) + [genome for genome in excluded if rng.random() < 0.5]:
+            genome[code] = genome.get(code, 0) + rng.randrange(1, 4)
+
+def split_hits_20(hits, nb_genomes):
+    """Occurences of each hit in each genome, that sum to hit weight
+    """
+    genomes = [{} for _ in range(nb_genomes)]
+    for code, weight in hits:
+        for i, genome in enumerate(genomes):
+            genome[code] = weight // nb_genomes + (1 if i < weight % nb_genomes else 0)
+    return genomes
+
+def split_hits_other(hits, nb_genomes):
+    """23-length words of each hit in genomes : each genome has at least one, each word is in one genome at least, and occurences sum to hit weight
+    """
+    genomes = [{} for _ in range(nb_genomes)]
+    for _, weight, longer_index in hits:
+        entries = [(i % nb_genomes, longer_index[i % len(longer_index)]) for i in range(max(nb_genomes, len(longer_index)))]
+        for genome, code in entries:
+            genomes[genome][code] = genomes[genome].get(code, 0) + 1
+        genome, code = entries[0]
+        genomes[genome][code] += weight - len(entries)
+    return genomes
+
+
+@pytest.fixture(scope = "module")
+def ag_store(tmp_path_factory):
+    """Genomes g1 and g2 of ag_simple, g3 excluded in ag_exclude
+    """
+    location = tmp_path_factory.mktemp("ag_indexes")
+    simple_hits = read_set_compare(os.path.join(DATA, "ag_simple", "set_index.txt"), 20)
+    exclude_codes = {code for code, _ in read_set_compare(os.path.join(DATA, "ag_exclude", "set_index.txt"), 20)}
+    g1, g2 = split_hits_20(simple_hits, 2)
+    g3 = {code : 1 for code, _ in simple_hits if code not in exclude_codes}
+    add_noise(random.Random(1), [g1, g2], {code for code, _ in simple_hits}, 23, [g3])
+    for name, genome in (("g1", g1), ("g2", g2), ("g3", g3)):
+        write_index(location / f"{name}.index", genome)
+    return IndexStore(str(location))
+
+@pytest.fixture(scope = "module")
+def len_16_store(tmp_path_factory):
+    location = tmp_path_factory.mktemp("len_16_indexes")
+    hits = read_set_compare(os.path.join(DATA, "ag_len_16", "set_index.txt"), 16)
+    genomes = split_hits_other(hits, 3)
+    add_noise(random.Random(2), genomes, {code for code, _, _ in hits}, 19)
+    for i, genome in enumerate(genomes):
+        write_index(location / f"h{i + 1}.index", genome)
+    return IndexStore(str(location))
+
+
+def as_hits_20(codes, weights, offsets, longer):
+    assert offsets is None and longer is None
+    return list(zip(codes.tolist(), weights.tolist()))
+
+def test_ag_simple(ag_store):
+    assert as_hits_20(*set_compare(ag_store, ["g1", "g2"], [], 20)) == read_set_compare(os.path.join(DATA, "ag_simple", "set_index.txt"), 20)
+
+def test_ag_exclude(ag_store):
+    assert as_hits_20(*set_compare(ag_store, ["g2", "g1"], ["g3"], 20)) == read_set_compare(os.path.join(DATA, "ag_exclude", "set_index.txt"), 20)
+
+def test_ag_len_16(len_16_store):
+    codes, weights, offsets, longer = set_compare(len_16_store, ["h1", "h2", "h3"], [], 16)
+    offsets = offsets.tolist()
+    hits = [(code, weight, longer[offsets[i]:offsets[i + 1]].tolist()) for i, (code, weight) in enumerate(zip(codes.tolist(), weights.tolist()))]
+    assert hits == read_set_compare(os.path.join(DATA, "ag_len_16", "set_index.txt"), 16)
+
+def test_query_codes(ag_store):
+    hits = read_set_compare(os.path.join(DATA, "ag_simple", "set_index.txt"), 20)
+    query = [code for code, _ in hits[::3]]
+    assert as_hits_20(*set_compare(ag_store, ["g1", "g2"], [], 20, np.array(query[::-1], dtype = np.uint64))) == hits[::3]
+
+
+def test_read_index(tmp_path):
+    path = tmp_path / "genome.index"
+    # Codes above 2^53 are parsed exactly, duplicated codes are merged
+    path.write_text("# 4 23 twobits\n70368744177663 2\n9007199254740993 1\n5 3\n5 1\n")
+    codes, occurences = read_index(str(path))
+    assert codes.tolist() == [5, 70368744177663, 9007199254740993]
+    assert occurences.tolist() == [4, 2, 1]
+    path.write_text("# 2 23 twobits\n12\n7\n")
+    codes, occurences = read_index(str(path))
+    assert codes.tolist() == [7, 12] and occurences.tolist() == [1, 1]
+
+def test_read_index_other_codec(tmp_path):
+    path = tmp_path / "genome.index"
+    path.write_text("# 1 23 pow2\n12 1\n")
+    with pytest.raises(ValueError):
+        read_index(str(path))
+    path.write_text("12 1\n")
+    with pytest.raises(IOError):
+        read_index(str(path))
@@ -0,0 +1,122 @@
+"""
+Tests of sharded post-processing : results of shards run in a process pool, or one by one then merged,
+must be the results of the sequential run. couchDB and motif-broker are served by the stand-in of bench/stand_in.py.
+"""
+
+import json
+import os
+import pytest
+import CSTB.post_processing as post_processing
+import CSTB.shards as shards
+from CSTB.utils.error import ErrorExit
+from conftest import AG_LEN_16_GENOMES, AG_SIMPLE_GENOMES, DATA
+
+SET_COMPARES = {"ag_simple" : (AG_SIMPLE_GENOMES, "20"), "ag_len_16" : (AG_LEN_16_GENOMES, "16")}
+
+
+def job_args(stand_in, set_compare, extra = ()):
+    genomes, length = SET_COMPARES[set_compare]
+    return ["--include", "&".join(genomes), "--exclude", "", "--couch_endpoint", stand_in.couch_endpoint, "--taxon_db", "taxon_db", "--genome_db", "genome_db",
+        "--motif_broker_endpoint", stand_in.motif_broker_endpoint, "--set_compare", os.path.join(DATA, set_compare, "set_index.txt"), "--length", length,
+        "--tag", "job", "--to_keep", "40", "--mb_chunk_size", "16", "--output", "results.json", *extra]
+
+def run_job(monkeypatch, stand_in, directory, set_compare, extra = ()):
+    """Run post-processing in directory
+
+    :return: Results json and tsv report
+    :rtype: Tuple[Dict, str]
+    """
+    directory.mkdir()
+    monkeypatch.chdir(directory)
+    post_processing.run(post_processing.args_gestion(job_args(stand_in, set_compare, extra)))
+    with open("results.json") as f, open("job_results.tsv") as tsv:
+        return json.load(f), tsv.read()
+
+def run_separate_shards(monkeypatch, stand_in, tmp_path, set_compare, shard_dir, nb_shards):
+    for i in range(nb_shards):
+        directory = tmp_path / f"node_{i}"
+        directory.mkdir()
+        monkeypatch.chdir(directory)
+        post_processing.run(post_processing.args_gestion(job_args(stand_in, set_compare, ["--shards", str(nb_shards), "--shard", str(i), "--shard_dir", shard_dir])))
+
+@pytest.mark.parametrize("set_compare", list(SET_COMPARES))
+@pytest.mark.parametrize("tsv_all_hits", [[], ["--tsv_all_hits"]])
+def test_shards_results_are_sequential_results(tmp_path, monkeypatch, stand_in, set_compare, tsv_all_hits):
+    results, tsv = run_job(monkeypatch, stand_in, tmp_path / "sequential", set_compare, tsv_all_hits)
+    assert results["number_treated_hits"] == 40 and len(results["data"]) == 40
+
+    for nb_shards in ("1", "3"):
+        assert run_job(monkeypatch, stand_in, tmp_path / f"shards_{nb_shards}", set_compare, [*tsv_all_hits, "--shards", nb_shards]) == (results, tsv)
+    # Partial results are removed once merged
+    assert sorted(os.listdir(tmp_path / "shards_3")) == ["job_metrics.json", "job_results.tsv", "results.json"]
+
+@pytest.mark.parametrize("tsv_all_hits", [[], ["--tsv_all_hits"]])
+def test_shards_run_separately_then_merged(tmp_path, monkeypatch, stand_in, tsv_all_hits):
+    results, tsv = run_job(monkeypatch, stand_in, tmp_path / "sequential", "ag_len_16", tsv_all_hits)
+    shard_dir = str(tmp_path / "shard_dir")
+    run_separate_shards(monkeypatch, stand_in, tmp_path, "ag_len_16", shard_dir, 3)
+    assert sorted(os.listdir(shard_dir)) == [f"job.shard-{i}-of-3.{extension}" for i in range(3) for extension in ("json", "tsv")]
+
+    merge_args = [*tsv_all_hits, "--shards", "3", "--merge_shards", "--shard_dir", shard_dir]
+    assert run_job(monkeypatch, stand_in, tmp_path / "merge", "ag_len_16", merge_args) == (results, tsv)
+    # Partial results may come from other nodes, they are kept
+    assert len(os.listdir(shard_dir)) == 6
+
+def test_merge_with_missing_shard_fails(tmp_path, monkeypatch, capsys, stand_in):
+    shard_dir = str(tmp_path / "shard_dir")
+    run_separate_shards(monkeypatch, stand_in, tmp_path, "ag_simple", shard_dir, 3)
+    os.remove(shards.shard_prefix(shard_dir, "job", 1, 3) + ".json")
+    capsys.readouterr()
+    with pytest.raises(ErrorExit):
+        run_job(monkeypatch, stand_in, tmp_path / "merge", "ag_simple", ["--shards", "3", "--merge_shards", "--shard_dir", shard_dir])
+    assert json.loads(capsys.readouterr().out.splitlines()[0])["error"].startswith("Error while process shards")
+
+def test_merge_with_overlapping_shards_fails(tmp_path, monkeypatch, capsys, stand_in):
+    shard_dir = str(tmp_path / "shard_dir")
+    run_separate_shards(monkeypatch, stand_in, tmp_path, "ag_simple", shard_dir, 3)
+    # Shard 1 claims the hits of shard 0
+    path = shards.shard_prefix(shard_dir, "job", 1, 3) + ".json"
+    with open(path) as f:
+        partial_results = json.load(f)
+    partial_results["first_position"] = 0
+    with open(path, "w") as o:
+        json.dump(partial_results, o)
+    capsys.readouterr()
+    with pytest.raises(ErrorExit):
+        run_job(monkeypatch, stand_in, tmp_path / "merge", "ag_simple", ["--shards", "3", "--merge_shards", "--shard_dir", shard_dir])
+    assert json.loads(capsys.readouterr().out.splitlines()[0])["error"].startswith("Error while process shards")
+    assert not os.path.exists(tmp_path / "merge" / "results.json")
+
+
+def shard(first_position, nb_hits, data = (), data_card = None):
+    return {"first_position" : first_position, "nb_hits" : nb_hits, "data" : list(data), "data_card" : data_card if data_card else {}}
+
+def test_check_shards():
+    shards.check_shards([shard(0, 3), shard(3, 3), shard(6, 4)], 10)
+    shards.check_shards([shard(0, 10)], 10)
+    shards.check_shards([shard(0, 0), shard(0, 0)], 0)
+
+@pytest.mark.parametrize("split", [
+    [shard(0, 3), shard(4, 6)], # missing hit
+    [shard(0, 4), shard(3, 7)], # overlap
+    [shard(3, 7), shard(0, 3)], # wrong order
+    [shard(0, 3), shard(3, 3)], # missing last hits
+    [shard(0, 6), shard(6, 6)], # too many hits
+    [shard(0, 3), shard(6, 4)], # missing shard
+])
+def test_check_shards_refuses_irregular_split(split):
+    with pytest.raises(ValueError):
+        shards.check_shards(split, 10)
+
+def test_merged_data_keeps_sequential_order():
+    # Entries are sorted by number of occurences, then hit position
+    split = [shard(0, 3, [[1, 2, "c"], [2, 0, "a"], [2, 1, "b"]]), shard(3, 2, [[1, 4, "e"], [3, 3, "d"]]), shard(5, 1, [[2, 5, "f"]])]
+    assert list(shards.iter_merged_data(split)) == ["c", "e", "a", "b", "f", "d"]
+
+def test_merged_data_card_keeps_first_appearance_order():
+    split = [shard(0, 1, data_card = {"o1" : {"chr1" : {"s1" : 1}}, "o2" : {"chr1" : {"s1" : 1}}}),
+        shard(1, 1, data_card = {"o2" : {"chr2" : {"s2" : 1}, "chr1" : {"s2" : 2}}, "o3" : {"chr1" : {"s2" : 1}}})]
+    merged = list(shards.iter_merged_data_card(split))
+    assert [genome_name for genome_name, _ in merged] == ["o1", "o2", "o3"]
+    assert merged[1][1] == {"chr1" : {"s1" : 1, "s2" : 2}, "chr2" : {"s2" : 1}}
+    assert list(merged[1][1]) == ["chr1", "chr2"]
@@ -0,0 +1,95 @@
+"""
+Tests of pipeline stages run in sequence or as a dependency graph
+"""
+
+import contextlib
+import threading
+import pytest
+from CSTB.utils.stage_graph import Stage, run_graph, run_sequence
+
+TIMEOUT = 5
+
+
+class StageError(Exception):
+    pass
+
+def recorder(events, name, work = None):
+    """Stage function recording its start and end in events"""
+    def run():
+        events.append(("start", name))
+        if work:
+            work()
+        events.append(("end", name))
+    return run
+
+def fail(name, before = None):
+    def run():
+        if before:
+            before()
+        raise StageError(name)
+    return run
+
+def test_stages_run_after_their_dependencies():
+    events = []
+    stages = [Stage("a", recorder(events, "a")), Stage("b", recorder(events, "b"), after = ["a"]),
+        Stage("c", recorder(events, "c"), after = ["a"]), Stage("d", recorder(events, "d"), after = ["b", "c"])]
+    run_graph(stages)
+    assert len(events) == 8
+    for stage in stages:
+        for dependency in stage.after:
+            assert events.index(("end", dependency)) < events.index(("start", stage.name))
+
+def test_independent_stages_overlap():
+    # Each stage waits for the other one to be started, this can only succeed if they run concurrently
+    barrier = threading.Barrier(2, timeout = TIMEOUT)
+    events = []
+    run_graph([Stage("a", recorder(events, "a", barrier.wait)), Stage("b", recorder(events, "b", barrier.wait))])
+    assert sorted(events) == [("end", "a"), ("end", "b"), ("start", "a"), ("start", "b")]
+
+def test_measure_wraps_each_stage():
+    measured = []
+    @contextlib.contextmanager
+    def measure(name):
+        measured.append(name)
+        yield
+    run_graph([Stage("a", lambda: None), Stage("b", lambda: None, after = ["a"])], measure = measure)
+    assert measured == ["a", "b"]
+
+def test_dependency_on_later_stage_is_refused():
+    with pytest.raises(ValueError):
+        run_graph([Stage("a", lambda: None, after = ["b"]), Stage("b", lambda: None)])
+
+def test_first_failure_in_sequential_order_is_raised():
+    # c fails first in time, but b is before it in sequential order
+    c_failed = threading.Event()
+    handled = []
+    stages = [Stage("a", lambda: None), Stage("b", fail("b", lambda: c_failed.wait(TIMEOUT)), on_error = handled.append),
+        Stage("c", fail("c", c_failed.set), on_error = handled.append)]
+    with pytest.raises(StageError, match = "b"):
+        run_graph(stages)
+    assert [str(e) for e in handled] == ["b"]
+
+def test_stages_after_failure_are_not_started():
+    # a is still running when b fails : a ends, but c (after a) and d (after b) would not have run sequentially
+    b_failed = threading.Event()
+    events = []
+    stages = [Stage("a", recorder(events, "a", lambda: b_failed.wait(TIMEOUT))), Stage("b", fail("b", b_failed.set)),
+        Stage("c", recorder(events, "c"), after = ["a"]), Stage("d", recorder(events, "d"), after = ["b"])]
+    with pytest.raises(StageError, match = "b"):
+        run_graph(stages)
+    assert events == [("start", "a"), ("end", "a")]
+
+def test_pending_stages_are_not_started_with_one_worker():
+    events = []
+    stages = [Stage("a", fail("a")), Stage("b", recorder(events, "b")), Stage("c", recorder(events, "c"))]
+    with pytest.raises(StageError, match = "a"):
+        run_graph(stages, max_workers = 1)
+    assert events == []
+
+def test_sequence_stops_at_first_failure():
+    events = []
+    handled = []
+    stages = [Stage("a", recorder(events, "a")), Stage("b", fail("b"), on_error = handled.append), Stage("c", recorder(events, "c"))]
+    with pytest.raises(StageError, match = "b"):
+        run_sequence(stages)
+    assert events == [("start", "a"), ("end", "a")] and [str(e) for e in handled] == ["b"]
@@ -0,0 +1,63 @@
+"""
+Tests of the couchDB and motif-broker stand-in of bench/stand_in.py : its answers have the shapes of the
+real services answers and CSTB clients retry through its injected faults.
+"""
+
+import pycouch.wrapper as couch_wrapper
+import requests
+from bench.stand_in import Faults, StandIn, GENOME_DB, TAXON_DB
+from CSTB.utils.metadata_cache import MetadataCache
+from CSTB.utils.occurence_fetcher import OccurenceFetcher
+from conftest import AG_SIMPLE_GENOMES, fixtures
+
+# Answer of couchDB 3 to POST /genome_db/_all_docs?include_docs=true with an existing and a missing key, documents left out
+COUCH_ALL_DOCS = {"total_rows" : 3, "offset" : None, "rows" : [
+    {"id" : "GCF_000217635.1", "key" : "GCF_000217635.1", "value" : {"rev" : "1-a"}},
+    {"key" : "missing", "error" : "not_found"}]}
+
+
+def shape(data):
+    """Keys and value types of a json document, recursively"""
+    if isinstance(data, dict):
+        return {key : shape(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [shape(value) for value in data]
+    return type(data)
+
+def test_all_docs_has_couch_shape(stand_in):
+    url = f"{stand_in.couch_endpoint}/{GENOME_DB}/_all_docs"
+    answer = requests.post(url + "?include_docs=true", json = {"keys" : [AG_SIMPLE_GENOMES[0], "missing"]}).json()
+    doc = answer["rows"][0].pop("doc")
+    assert shape(answer) == shape(COUCH_ALL_DOCS)
+    assert doc["_id"] == AG_SIMPLE_GENOMES[0] and doc["_rev"] == answer["rows"][0]["value"]["rev"]
+    # Without include_docs, rows only give revisions
+    assert requests.post(url, json = {"keys" : [AG_SIMPLE_GENOMES[0], "missing"]}).json() == answer
+
+def test_metadata_cache_reads_stand_in(stand_in):
+    cache = MetadataCache(couch_wrapper.Wrapper(stand_in.couch_endpoint))
+    genomes = cache.get_docs(GENOME_DB, [*AG_SIMPLE_GENOMES, "missing"])
+    assert genomes["missing"] is None
+    taxons = cache.get_docs(TAXON_DB, [genomes[uuid]["taxon"] for uuid in AG_SIMPLE_GENOMES])
+    assert [taxon["name"].split()[-1] for taxon in taxons.values()] == AG_SIMPLE_GENOMES
+
+def test_bulk_request_has_motif_broker_shape(stand_in):
+    sequences = sorted(fixtures().occurences)[:2]
+    answer = requests.post(f"{stand_in.motif_broker_endpoint}/bulk_request", json = {"keys" : sequences}).json()
+    # {"request" : {sequence : {genome uuid : {fasta header : ["+(start,end)", ...]}}}}
+    assert list(answer) == ["request"] and sorted(answer["request"]) == sequences
+    for doc in answer["request"].values():
+        for refs in doc.values():
+            assert all(coords and shape(coords) == [str] * len(coords) for coords in refs.values())
+
+def test_fetcher_retries_through_faults():
+    stand_in_fixtures = fixtures()
+    sequences = sorted(stand_in_fixtures.occurences)[:60]
+    faults = Faults(error_rate = 0.3, drop_rate = 0.1, seed = 1)
+    with StandIn(stand_in_fixtures, motif_broker_faults = faults) as stand_in:
+        fetcher = OccurenceFetcher(stand_in.motif_broker_endpoint, chunk_size = 5, workers = 3, max_retries = 20, backoff = 0.001)
+        assert fetcher.fetch(sequences) == {sequence : stand_in_fixtures.occurence(sequence) for sequence in sequences}
+        stats = stand_in.stats()["motif_broker"]
+
+    assert stats["errors"] > 0 and stats["drops"] > 0
+    # Each failed request is retried once
+    assert fetcher.nb_requests == stats["requests"] == len(sequences) // 5 + stats["errors"] + stats["drops"]
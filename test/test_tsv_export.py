@@ -0,0 +1,28 @@
+"""
+Tests of tsv report compression
+"""
+
+import pytest
+import CSTB.utils.tsv_export as tsv_export
+import CSTB.post_processing as post_processing
+
+ARGS = ["--include", "g1", "--exclude", "", "--couch_endpoint", "http://couch", "--taxon_db", "taxon_db", "--genome_db", "genome_db",
+    "--set_compare", "set_index.txt", "--length", "20", "--motif_broker_endpoint", "http://motif-broker", "--tag", "test"]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_write_and_read(tmp_path, compression):
+    path = tsv_export.output_path(str(tmp_path / "results.tsv"), compression)
+    rows = [f"seq{i}\tg1\tchr\t+({i},{i + 22})\n" for i in range(10000)]
+    with tsv_export.open_text(path, compression) as o:
+        tsv_export.write_rows(o, iter(rows), batch_size = 7)
+    with tsv_export.open_text_reader(path, compression) as f:
+        assert f.readlines() == rows
+
+def test_zstd_without_zstandard_is_refused_before_running(monkeypatch):
+    monkeypatch.setattr(tsv_export.importlib.util, "find_spec", lambda name : None)
+    assert not tsv_export.compression_available("zstd")
+    assert tsv_export.compression_available("gzip") and tsv_export.compression_available(None)
+    with pytest.raises(SystemExit):
+        post_processing.args_gestion(ARGS + ["--tsv_compression", "zstd"])
+    assert post_processing.args_gestion(ARGS + ["--tsv_compression", "gzip"]).tsv_compression == "gzip"
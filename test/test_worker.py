@@ -0,0 +1,65 @@
+"""
+Tests of the post-processing worker : jobs submitted to a spool directory are run by a worker serving it,
+against the couchDB and motif-broker stand-in.
+"""
+
+import json
+import os
+import threading
+import CSTB.worker as worker
+from conftest import AG_SIMPLE_GENOMES, DATA
+
+TIMEOUT = 60
+
+
+def job_args(stand_in, set_index = os.path.join(DATA, "ag_simple", "set_index.txt")):
+    return ["--include", "&".join(AG_SIMPLE_GENOMES), "--exclude", "", "--couch_endpoint", stand_in.couch_endpoint,
+        "--taxon_db", "taxon_db", "--genome_db", "genome_db", "--motif_broker_endpoint", stand_in.motif_broker_endpoint,
+        "--set_compare", set_index, "--length", "20", "--tag", "job", "--to_keep", "40"]
+
+def serve_in_background(spool, max_jobs):
+    thread = threading.Thread(target = worker.serve, args = (str(spool), max_jobs), daemon = True)
+    thread.start()
+    return thread
+
+def read_stdout(status):
+    with open(status["stdout"]) as f:
+        return f.read()
+
+def test_submit_then_serve_one_job(tmp_path, stand_in):
+    spool = tmp_path / "spool"
+    cwd = tmp_path / "job"
+    cwd.mkdir()
+    thread = serve_in_background(spool, 1)
+    status = worker.submit(str(spool), job_args(stand_in), str(cwd), timeout = TIMEOUT)
+    thread.join(TIMEOUT)
+    assert not thread.is_alive()
+
+    assert status["status"] == 0
+    results = json.loads(read_stdout(status))
+    assert results["number_treated_hits"] == 40 and len(results["data"]) == 40
+    assert os.path.exists(cwd / "post_processing.log")
+    # Job files are moved out of spool directories once done
+    assert all(not os.listdir(spool / directory) for directory in (worker.INCOMING, worker.RUNNING, worker.DONE))
+
+def test_worker_survives_failed_jobs(tmp_path, stand_in):
+    spool = tmp_path / "spool"
+    cwd = tmp_path / "job"
+    cwd.mkdir()
+    thread = serve_in_background(spool, 3)
+
+    # error_exit exits with status 0 like post_processing.py, error is in results json
+    status = worker.submit(str(spool), job_args(stand_in, str(tmp_path / "missing.txt")), str(cwd), timeout = TIMEOUT)
+    assert status["status"] == 0
+    assert json.loads(read_stdout(status).splitlines()[0])["error"].startswith("Error while parse setCompare")
+
+    # Job files can't be written, status is still written
+    status = worker.submit(str(spool), job_args(stand_in), str(tmp_path / "missing_cwd"), timeout = TIMEOUT)
+    assert status["status"] == 1
+    assert not os.path.exists(status["stdout"])
+
+    status = worker.submit(str(spool), job_args(stand_in), str(cwd), timeout = TIMEOUT)
+    assert status["status"] == 0
+    assert len(json.loads(read_stdout(status))["data"]) == 40
+    thread.join(TIMEOUT)
+    assert not thread.is_alive()
@@ -0,0 +1,113 @@
+"""
+Tests of job workflows, with stub commands in place of setCompare, blastn and post_processing.py
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+import pytest
+import CSTB.post_processing as post_processing
+import CSTB.workflow as workflow
+from CSTB.workflow import Step, StepTimeout, Workflow
+from conftest import AG_SIMPLE_GENOMES, DATA
+
+EMPTY_SEARCH = [sys.executable, "-c", "import json; print(json.dumps({'emptySearch' : 'No hits found'}))"]
+
+
+def is_running(pid):
+    """Tell if process exists and is not a zombie"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+    except FileNotFoundError:
+        return False
+
+def printed_json(capfd):
+    return [json.loads(line) for line in capfd.readouterr().out.splitlines()]
+
+@pytest.fixture(autouse = True)
+def job_dir(tmp_path, monkeypatch):
+    """Steps write their command line and outputs in current directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_step_timeout_kills_process_group():
+    # Shell waits for a command it started in background, in the same process group
+    step = Step("sleep", ["sh", "-c", "sleep 30 & echo $! > child.pid; wait"], None, "sleep.err", timeout = 0.3)
+    with pytest.raises(StepTimeout):
+        step.run(time.perf_counter(), lambda: False)
+    assert step.status == "timeout" and step.returncode == -9 and step.seconds < 5
+    with open("child.pid") as f:
+        child = int(f.read())
+    deadline = time.time() + 5
+    while is_running(child) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not is_running(child)
+    with open("sleep.cmd") as f:
+        assert f.read() == "sh -c 'sleep 30 & echo $! > child.pid; wait'\n"
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_failure_cancels_following_steps(capfd, concurrent):
+    flow = Workflow(concurrent)
+    flow.add(Step("first", ["sleep", "0.3"], None, "first.err"))
+    flow.add(Step("fail", ["false"], None, "fail.err"), on_error = workflow._exit_with("Error while fail"))
+    flow.add(Step("last", ["sleep", "30"], None, "last.err"))
+    assert flow.run() < 5
+    assert printed_json(capfd) == [{"error" : "Error while fail"}]
+    # Steps before the failing one in sequential order go on, steps after it are stopped or never started
+    assert [step.status for step in flow.steps] == ["ok", "failed", "cancelled" if concurrent else "pending"]
+
+@pytest.mark.parametrize("args, check_stderr, returncode, expected_json, expected_status", [
+    (["true"], True, 0, [], "ok"),
+    (["false"], True, 1, [{"error" : "Error"}], "failed"),
+    (["sh", "-c", "exit 3"], False, 3, [{"error" : "Error"}], "failed"),
+    # Error output fails checked steps even with status 0
+    (["sh", "-c", "echo warning >&2"], True, 0, [{"error" : "Error"}], "failed"),
+    (["sh", "-c", "echo warning >&2"], False, 0, [], "ok"),
+    (["sh", "-c", f"echo '{workflow.SET_COMPARE_EMPTY}' >&2; exit 1"], True, 1, [{"emptySearch" : "No hits found"}], "failed"),
+    # Like post_processing.py, prints its emptySearch json itself and exits with status 0
+    (EMPTY_SEARCH, False, 0, [{"emptySearch" : "No hits found"}], "ok"),
+])
+def test_exits_of_steps(capfd, args, check_stderr, returncode, expected_json, expected_status):
+    flow = Workflow()
+    flow.add(Step("step", args, None, "step.err", check_stderr = check_stderr), on_error = workflow._exit_with("Error", "No hits found", workflow.SET_COMPARE_EMPTY))
+    flow.run()
+    assert printed_json(capfd) == expected_json
+    assert flow.steps[0].returncode == returncode and flow.steps[0].status == expected_status
+
+def test_empty_input_ends_with_empty_search(capfd):
+    flow = Workflow()
+    flow.add(Step("step", ["true"], None, "step.err"), on_error = workflow._exit_with("Error", "No hits found"), check = workflow._require_filled("set_index.txt"))
+    flow.run()
+    assert printed_json(capfd) == [{"emptySearch" : "No hits found"}]
+    assert flow.steps[0].status == "pending" and not os.path.exists("step.cmd")
+
+def test_results_restored_from_cache_without_running_steps(job_dir, monkeypatch, capsys, stand_in):
+    for name in ("SET_COMPARE_ENGINE", "POST_PROCESSING_SPOOL"):
+        monkeypatch.delenv(name, raising = False)
+    argv = ["all", "--include", "&".join(AG_SIMPLE_GENOMES), "--exclude", "", "--index_dir", str(job_dir / "index"),
+        "--couch_endpoint", stand_in.couch_endpoint, "--taxon_db", "taxon_db", "--genome_db", "genome_db",
+        "--motif_broker_endpoint", stand_in.motif_broker_endpoint, "--result_cache", str(job_dir / "result_cache"), "--tag", "job"]
+    post_processing_args = workflow.all_genomes_workflow(workflow.args_gestion(argv), "job").post_processing_args
+    assert not workflow.restore_cached_results(post_processing_args)
+
+    # Job run by post_processing.py, on setCompare output of test data
+    (job_dir / "run").mkdir()
+    monkeypatch.chdir(job_dir / "run")
+    shutil.copy(os.path.join(DATA, "ag_simple", "set_index.txt"), "set_index.txt")
+    post_processing.run(post_processing.args_gestion(post_processing_args))
+    results = capsys.readouterr().out
+    assert len(json.loads(results)["data"]) > 0
+
+    (job_dir / "restored").mkdir()
+    monkeypatch.chdir(job_dir / "restored")
+    workflow.main(argv)
+    assert capsys.readouterr().out == results
+    with open(job_dir / "run" / "job_results.tsv") as f, open("job_results.tsv") as restored:
+        assert restored.read() == f.read()
+    with open(workflow.TIMINGS_FILE) as f:
+        timings = json.load(f)
+    assert timings["cached"] and [step["status"] for step in timings["steps"]] == ["pending", "pending"]
+    assert not os.path.exists("setCompare.cmd")
@@ -0,0 +1,37 @@
+"""
+Tests of the streamed results json
+"""
+
+import io
+import json
+import pytest
+import CSTB.utils.error as error
+from CSTB.crispr_result_manager import CrisprResultManager
+from CSTB.engine.crispr_hit import Hit
+
+SEQUENCES = ["ACGTACGTACGTACGTACGTAGG", "TTGTACGTACGTACGTACGTAGG"]
+DOCUMENTS = [{"g1" : {"chr1" : ["+(100,122)", "-(500,522)"]}, "g2" : {"chr2" : ["+(40,62)"]}}, {"g1" : {"chr2" : ["+(7,29)"]}}]
+
+
+def manager(include_taxon):
+    hits = [Hit(i, 3, 20, sequence = sequence) for i, sequence in enumerate(SEQUENCES)]
+    for hit, document in zip(hits, DOCUMENTS):
+        hit.store_occurences([document], list(document))
+    results = CrisprResultManager(None, "taxon_db", "genome_db", None, "job", include_taxon, nb_total_hits = 10, nb_treated_hits = 2, hits_collection = hits)
+    # Metadata come from couchDB
+    results.generate_json_size = lambda: {name : {"chr1" : 1000} for name in include_taxon.values()}
+    results.generate_fasta_metadata = lambda: [{"org" : name, "fasta_ref" : "chr1", "size" : 1000, "header" : "chr1"} for name in include_taxon.values()]
+    return results
+
+def test_streamed_json_is_format_results():
+    results = manager({"g1" : "Organism 1", "g2" : "Organism 2"})
+    stream = io.StringIO()
+    results.write_results(stream)
+    assert stream.getvalue() == json.dumps(results.format_results())
+
+def test_nothing_is_written_if_results_are_inconsistent():
+    results = manager({"g1" : "Organism 1"})
+    stream = io.StringIO()
+    with pytest.raises(error.ConsistencyError):
+        results.write_results(stream)
+    assert stream.getvalue() == ""